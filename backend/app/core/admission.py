@@ -0,0 +1,190 @@
+"""
+Admission control for new sessions.
+
+Every new session starts a container, so a burst of logins used to start as
+many containers as there were requests and slow down the whole Docker host.
+AdmissionController caps the number of sessions holding a container at once,
+both globally and per user. The per-user cap only counts sessions in use: a
+user's paused or unattached sessions still hold containers, but must not keep
+that user waiting for a new one. Requests over the cap wait in a fair queue:
+waiting users are served round-robin, so one user opening many projects
+cannot starve everybody else, and each waiter is told its position as it
+moves up.
+"""
+
+import asyncio
+import collections
+import threading
+import time
+
+
+class AdmissionController:
+    """Grants session slots up to a global and a per-user limit."""
+
+    def __init__(self, max_sessions: int, max_per_user: int):
+        self.max_sessions = max_sessions
+        self.max_per_user = max_per_user
+        self._active = collections.Counter()
+        # Granted slots whose sessions sit idle; not held against the user
+        self._idle = collections.Counter()
+        # User ID -> FIFO of waiting futures, in round-robin order
+        self._queues = collections.OrderedDict()
+        self._changed = asyncio.Event()
+        self._loop = None
+        self._lock = threading.Lock()
+        self.stats = {"admitted": 0, "queued": 0, "released": 0, "wait_seconds": 0.0}
+
+    async def acquire(self, user_id: str, on_position=None):
+        """Wait until user_id may start a session.
+
+        While queued, ``await on_position(position)`` is called with the
+        request's place in the queue (1 = next), whenever it changes.
+        """
+        self._loop = asyncio.get_running_loop()
+        future = self._loop.create_future()
+        with self._lock:
+            self._queues.setdefault(user_id, collections.deque()).append(future)
+        self._dispatch()
+        if future.done():
+            return
+
+        self.stats["queued"] += 1
+        started = time.monotonic()
+        position = None
+        try:
+            while not future.done():
+                changed = self._changed
+                current = self._position(user_id, future)
+                if current != position and on_position is not None:
+                    position = current
+                    await on_position(position)
+                waiter = asyncio.ensure_future(changed.wait())
+                try:
+                    await asyncio.wait(
+                        {future, waiter}, return_when=asyncio.FIRST_COMPLETED
+                    )
+                finally:
+                    waiter.cancel()
+        except BaseException:
+            with self._lock:
+                if future.done():
+                    # Granted while we were giving up; hand the slot back
+                    self._release(user_id)
+                else:
+                    future.cancel()
+                    self._remove(user_id, future)
+            self._dispatch()
+            raise
+        finally:
+            self.stats["wait_seconds"] += time.monotonic() - started
+
+    def release(self, user_id: str, idle: bool = False):
+        """Return a slot taken by acquire(). Thread-safe.
+
+        idle says whether the slot was last marked idle.
+        """
+        with self._lock:
+            if idle:
+                self._unidle(user_id)
+            self._release(user_id)
+        self._schedule_dispatch()
+
+    def mark_idle(self, user_id: str, idle: bool):
+        """Stop (or resume) counting one of user_id's slots against the
+        per-user limit while its session is paused or unattached. Thread-safe.
+        """
+        with self._lock:
+            if idle:
+                self._idle[user_id] += 1
+            else:
+                self._unidle(user_id)
+        if idle:
+            self._schedule_dispatch()
+
+    def _schedule_dispatch(self):
+        if self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._dispatch)
+        except RuntimeError:
+            # The loop is already closed (shutdown); nothing is waiting on it
+            pass
+
+    def snapshot(self):
+        with self._lock:
+            return dict(
+                self.stats,
+                active=sum(self._active.values()),
+                idle=sum(self._idle.values()),
+                waiting=sum(len(queue) for queue in self._queues.values()),
+                max_sessions=self.max_sessions,
+                max_per_user=self.max_per_user,
+            )
+
+    def _grant(self, user_id: str):
+        self._active[user_id] += 1
+        self.stats["admitted"] += 1
+
+    def _release(self, user_id: str):
+        if self._active[user_id] > 0:
+            self._active[user_id] -= 1
+            self.stats["released"] += 1
+        if not self._active[user_id]:
+            del self._active[user_id]
+
+    def _unidle(self, user_id: str):
+        if self._idle[user_id] > 0:
+            self._idle[user_id] -= 1
+        if not self._idle[user_id]:
+            del self._idle[user_id]
+
+    def _in_use(self, user_id: str):
+        return self._active[user_id] - self._idle[user_id]
+
+    def _remove(self, user_id: str, future):
+        queue = self._queues.get(user_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            pass
+        if not queue:
+            del self._queues[user_id]
+
+    def _position(self, user_id: str, future):
+        """Requests served before future under round-robin, plus one."""
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue is None or future not in queue:
+                return 0
+            index = queue.index(future)
+            ahead = index
+            before = True
+            for other, waiting in self._queues.items():
+                if other == user_id:
+                    before = False
+                    continue
+                ahead += min(len(waiting), index + 1 if before else index)
+            return ahead + 1
+
+    def _dispatch(self):
+        """Grant free slots to waiting users, round-robin. Runs on the loop."""
+        with self._lock:
+            while self._queues and sum(self._active.values()) < self.max_sessions:
+                for user_id in self._queues:
+                    if self._in_use(user_id) < self.max_per_user:
+                        break
+                else:
+                    break
+                # The served user moves to the back of the rotation
+                queue = self._queues.pop(user_id)
+                future = queue.popleft()
+                if queue:
+                    self._queues[user_id] = queue
+                self._grant(user_id)
+                future.set_result(None)
+
+        # Waiters recompute their positions whenever the queue changes
+        self._changed.set()
+        self._changed = asyncio.Event()
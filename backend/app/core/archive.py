@@ -0,0 +1,481 @@
+"""
+Project export and import as tar or zip archives.
+
+Archives are built and parsed one entry, and one chunk of an entry, at a
+time, so memory use does not grow with the size of the project:
+
+- Export yields the archive as a generator of byte strings for a
+  StreamingResponse. File bodies are passed through as the blob store (or the
+  workspace) yields them, framed by headers; for tar nothing is copied into a
+  buffer, and large uncompressed blobs are yielded as slices of an mmap.
+  Rows are read a page at a time, each page in a short session of its own, so
+  a slow download never holds a database snapshot open.
+- Import reads the request body from a worker thread. Each file is streamed
+  into the blob store as it is parsed; only paths and hashes are kept. Once
+  the whole archive has been read, and so is known to be complete and within
+  IMPORT_MAX_SIZE, the files are written to the database in bulk
+  (FileRepository.import_files), in batches that each commit on their own.
+
+tar (optionally gzipped) is parsed straight off the request. zip keeps its
+directory at the end of the archive, so an uploaded zip is spooled to a
+temporary file first.
+"""
+
+import asyncio
+import datetime
+import io
+import os
+import stat
+import tarfile
+import tempfile
+import time
+import zipfile
+import zlib
+from typing import Optional
+
+from ..db.database import SessionLocal
+from ..db.repository import FileRepository
+from .blobs import CHUNK_SIZE, BlobNotFound, blob_store
+from .config import IMPORT_MAX_FILES, IMPORT_MAX_SIZE
+from .sync import workspace_relpath, workspace_sync
+
+# Archive formats and their media types
+FORMATS = {
+    "tar": "application/x-tar",
+    "tar.gz": "application/gzip",
+    "zip": "application/zip",
+}
+
+# File rows read per query while exporting
+EXPORT_PAGE_SIZE = 500
+
+# Files written to the database per transaction while importing
+IMPORT_BATCH_SIZE = 500
+
+# tar writes in 512-byte blocks and pads the archive to 20 of them
+TAR_BLOCK = tarfile.BLOCKSIZE
+TAR_RECORD = tarfile.RECORDSIZE
+
+# Timestamps before 1980 cannot be stored in a zip
+ZIP_EPOCH = 315532800
+
+# Errors of a malformed archive, raised while parsing or reading its members
+ARCHIVE_ERRORS = (tarfile.TarError, zipfile.BadZipFile, zlib.error, EOFError)
+
+
+class InvalidArchive(ValueError):
+    """Raised for an upload that is not a readable archive."""
+
+
+class ArchiveTooLarge(InvalidArchive):
+    """Raised for an archive over IMPORT_MAX_SIZE bytes or IMPORT_MAX_FILES files."""
+
+
+class ArchiveEntry:
+    """A file or directory to be written to an archive.
+
+    open() returns an iterator over the file's bytes, or None if the file
+    disappeared since it was listed; the entry is then left out.
+    """
+
+    def __init__(self, path: str, is_directory: bool, size=0, mtime=0, open=None):
+        self.path = path
+        self.is_directory = is_directory
+        self.size = size
+        self.mtime = mtime
+        self.open = open
+
+
+def safe_path(name: str):
+    """name as a relative path inside the project, or None if it would escape."""
+    parts = [
+        part for part in name.replace("\\", "/").split("/") if part not in ("", ".")
+    ]
+    if not parts or ".." in parts:
+        return None
+    return "/".join(parts)
+
+
+def _exactly(chunks, size: int):
+    """chunks cut or zero-padded to size bytes.
+
+    A workspace file can change between being listed and being read; the
+    archive header has already promised size bytes.
+    """
+    left = size
+    for chunk in chunks:
+        if len(chunk) >= left:
+            if left:
+                yield chunk[:left]
+            left = 0
+            break
+        yield chunk
+        left -= len(chunk)
+    while left > 0:
+        yield bytes(min(left, CHUNK_SIZE))
+        left -= CHUNK_SIZE
+
+
+def write_tar(entries):
+    """Yield a tar archive of entries."""
+    written = 0
+    for entry in entries:
+        chunks = None if entry.is_directory else entry.open()
+        if chunks is None and not entry.is_directory:
+            continue
+        info = tarfile.TarInfo(entry.path)
+        info.mtime = int(entry.mtime)
+        if entry.is_directory:
+            info.type, info.mode = tarfile.DIRTYPE, 0o755
+        else:
+            info.size, info.mode = entry.size, 0o644
+        header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+        yield header
+        written += len(header)
+        if entry.is_directory:
+            continue
+        yield from _exactly(chunks, entry.size)
+        padding = -entry.size % TAR_BLOCK
+        if padding:
+            yield bytes(padding)
+        written += entry.size + padding
+    # Two zero blocks end the archive, then zeros up to a whole record
+    end = 2 * TAR_BLOCK
+    yield bytes(end + -(written + end) % TAR_RECORD)
+
+
+def gzipped(chunks):
+    """Yield chunks compressed as one gzip stream."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _Drain:
+    """Write-only file that collects what zipfile writes until drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def write_zip(entries):
+    """Yield a zip archive of entries, files deflated.
+
+    zipfile writes to a non-seekable file in streaming mode (sizes and CRCs
+    in data descriptors after each file); what it wrote is yielded after
+    every chunk of input.
+    """
+    out = _Drain()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as archive:
+        for entry in entries:
+            chunks = None if entry.is_directory else entry.open()
+            if chunks is None and not entry.is_directory:
+                continue
+            date_time = time.gmtime(max(entry.mtime, ZIP_EPOCH))[:6]
+            if entry.is_directory:
+                info = zipfile.ZipInfo(entry.path + "/", date_time)
+                info.external_attr = (stat.S_IFDIR | 0o755) << 16 | 0x10
+                archive.writestr(info, b"")
+            else:
+                info = zipfile.ZipInfo(entry.path, date_time)
+                info.external_attr = (stat.S_IFREG | 0o644) << 16
+                info.compress_type = zipfile.ZIP_DEFLATED
+                # Known up front, so files over 4 GiB get zip64 headers
+                info.file_size = entry.size
+                with archive.open(info, "w") as target:
+                    for chunk in _exactly(chunks, entry.size):
+                        target.write(chunk)
+                        data = out.drain()
+                        if data:
+                            yield data
+            data = out.drain()
+            if data:
+                yield data
+    # The central directory, written when the archive is closed
+    yield out.drain()
+
+
+def write_archive(entries, archive_format: str):
+    if archive_format == "zip":
+        return write_zip(entries)
+    if archive_format == "tar.gz":
+        return gzipped(write_tar(entries))
+    return write_tar(entries)
+
+
+def _blob_opener(content_hash: str):
+    def open_blob():
+        try:
+            return blob_store.iter_chunks(content_hash)
+        except BlobNotFound:
+            print(f"Blob {content_hash} is missing; left out of the export")
+            return None
+
+    return open_blob
+
+
+def _database_entries(project_id: str):
+    after = None
+    while True:
+        db = SessionLocal()
+        try:
+            rows = FileRepository.get_project_file_page(
+                db, project_id, after, EXPORT_PAGE_SIZE, with_content=True
+            )
+        finally:
+            db.close()
+        for row in rows:
+            path = workspace_relpath(row.path)
+            if path is None:
+                continue
+            # updated_at is naive UTC
+            mtime = (
+                row.updated_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+                if row.updated_at
+                else 0
+            )
+            if row.is_directory:
+                yield ArchiveEntry(path, True, mtime=mtime)
+            elif row.content_hash is None:
+                yield ArchiveEntry(path, False, 0, mtime, lambda: iter(()))
+            else:
+                yield ArchiveEntry(
+                    path, False, row.size, mtime, _blob_opener(row.content_hash)
+                )
+        if len(rows) < EXPORT_PAGE_SIZE:
+            return
+        after = rows[-1].path
+
+
+def _file_opener(path: str):
+    def open_file():
+        try:
+            f = open(path, "rb")
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+
+        def chunks():
+            with f:
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        return chunks()
+
+    return open_file
+
+
+def _workspace_entries(root: str):
+    """Entries for the regular files and directories under root; links are skipped."""
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        rel_dir = os.path.relpath(directory, root)
+        if rel_dir != ".":
+            mtime = os.lstat(directory).st_mtime
+            yield ArchiveEntry(rel_dir.replace(os.sep, "/"), True, mtime=mtime)
+        for name in sorted(filenames):
+            path = os.path.join(directory, name)
+            try:
+                st = os.lstat(path)
+            except FileNotFoundError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            rel = os.path.relpath(path, root).replace(os.sep, "/")
+            yield ArchiveEntry(rel, False, st.st_size, st.st_mtime, _file_opener(path))
+
+
+def export_archive(user_id: str, project_id: str, archive_format: str, source: str):
+    """The project's archive as a generator of bytes. Blocking; iterate in a thread.
+
+    source is "database" for the files table, "workspace" for the files in
+    DATA_DIR/<user>/<project>.
+    """
+    if source == "workspace":
+        entries = _workspace_entries(workspace_sync.workspace_dir(user_id, project_id))
+    else:
+        entries = _database_entries(project_id)
+    return write_archive(entries, archive_format)
+
+
+class StreamReader(io.RawIOBase):
+    """A blocking, readable file over an async iterator of byte strings.
+
+    For a worker thread to read a request body that arrives on the event loop.
+    """
+
+    def __init__(self, chunks, loop: asyncio.AbstractEventLoop):
+        self._chunks = chunks.__aiter__()
+        self._loop = loop
+        self._buffer = memoryview(b"")
+        self._done = False
+
+    def readable(self):
+        return True
+
+    async def _next(self):
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def readinto(self, buffer):
+        while not self._buffer and not self._done:
+            chunk = asyncio.run_coroutine_threadsafe(self._next(), self._loop).result()
+            if chunk is None:
+                self._done = True
+            else:
+                self._buffer = memoryview(chunk)
+        n = min(len(buffer), len(self._buffer))
+        buffer[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def sniff_format(stream: io.BufferedReader):
+    """The format of the archive at the start of stream, without consuming it."""
+    head = stream.peek(4)[:4]
+    if head in (b"PK\x03\x04", b"PK\x05\x06"):
+        return "zip"
+    if head[:2] == b"\x1f\x8b":
+        return "tar.gz"
+    return "tar"
+
+
+def read_tar(stream):
+    """Yield (path, is_directory, file or None) for each member of a tar stream.
+
+    path is None for members that are not imported: links, devices, and names
+    that would escape the project. Each file is only readable until the next
+    member is requested.
+    """
+    with tarfile.open(fileobj=stream, mode="r|*") as archive:
+        for member in archive:
+            path = safe_path(member.name)
+            if path is None or not (member.isdir() or member.isreg()):
+                yield None, False, None
+            elif member.isdir():
+                yield path, True, None
+            else:
+                yield path, False, archive.extractfile(member)
+
+
+def read_zip(file):
+    """Yield (path, is_directory, file or None) for each member of a zip file."""
+    with zipfile.ZipFile(file) as archive:
+        for info in archive.infolist():
+            path = safe_path(info.filename)
+            mode = info.external_attr >> 16
+            if path is None or (
+                mode and not (stat.S_ISREG(mode) or stat.S_ISDIR(mode))
+            ):
+                yield None, False, None
+            elif info.is_dir():
+                yield path, True, None
+            else:
+                with archive.open(info) as member:
+                    yield path, False, member
+
+
+def _spool(stream, limit: int):
+    """Copy stream to a temporary file, at most limit bytes of it."""
+    spooled = tempfile.TemporaryFile(dir=blob_store._tmp_dir)
+    try:
+        copied = 0
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            copied += len(chunk)
+            if copied > limit:
+                raise ArchiveTooLarge(f"Archive is larger than {limit} bytes")
+            spooled.write(chunk)
+        spooled.seek(0)
+        return spooled
+    except BaseException:
+        spooled.close()
+        raise
+
+
+def _store_members(members):
+    """Stream the members' files into the blob store.
+
+    Returns (entries, skipped), entries being (path, is_directory,
+    content_hash, size) tuples. Raises ArchiveTooLarge once the files add up
+    to more than IMPORT_MAX_SIZE bytes or IMPORT_MAX_FILES files.
+    """
+    entries, skipped, total = [], 0, 0
+    for path, is_directory, member in members:
+        if path is None:
+            skipped += 1
+            continue
+        if len(entries) >= IMPORT_MAX_FILES:
+            raise ArchiveTooLarge(f"Archive has more than {IMPORT_MAX_FILES} files")
+        if is_directory:
+            entries.append((path, True, None, 0))
+            continue
+        writer = blob_store.writer()
+        try:
+            while True:
+                chunk = member.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > IMPORT_MAX_SIZE:
+                    raise ArchiveTooLarge(
+                        f"Archive holds more than {IMPORT_MAX_SIZE} bytes"
+                    )
+                writer.write(chunk)
+            content_hash, size = writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+        entries.append((path, False, content_hash, size))
+    return entries, skipped
+
+
+def import_archive(project_id: str, stream, archive_format: Optional[str] = None):
+    """Import the files of the archive read from stream into the project.
+
+    Blocking; run it in a thread. The format is detected when not given.
+    Returns the counts of FileRepository.import_files, with members that were
+    not imported added to "skipped". Raises InvalidArchive or ArchiveTooLarge
+    without changing the project, as the archive is read in full before any
+    file is written. If writing fails partway, raises ImportIncomplete with
+    the counts of the entries already applied, which stay in the project.
+    """
+    stream = io.BufferedReader(stream, CHUNK_SIZE)
+    archive_format = archive_format or sniff_format(stream)
+    try:
+        if archive_format == "zip":
+            with _spool(stream, IMPORT_MAX_SIZE) as spooled:
+                entries, skipped = _store_members(read_zip(spooled))
+        else:
+            entries, skipped = _store_members(read_tar(stream))
+    except ARCHIVE_ERRORS as e:
+        raise InvalidArchive(f"Not a valid {archive_format} archive: {e}")
+
+    db = SessionLocal()
+    try:
+        counts = FileRepository.import_files(db, project_id, entries, IMPORT_BATCH_SIZE)
+    finally:
+        db.close()
+    counts["skipped"] += skipped
+    return counts
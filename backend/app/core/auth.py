@@ -3,11 +3,11 @@ from datetime import datetime, timedelta
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..db.database import get_db
-from ..db.repository import UserRepository
-from ..schemas.users import TokenData
+from ..db.database import get_async_db
+from ..db.repository import AsyncUserRepository
+from .auth_cache import auth_cache
 
 # Constants for JWT token
 SECRET_KEY = "YOUR_SECRET_KEY_HERE"  # In production, use a properly secured secret key
@@ -28,8 +28,35 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 
+def verify_token(token: str):
+    """The user ID a valid token was issued for, or None."""
+    user_id = auth_cache.get_token(token)
+    if user_id is not None:
+        return user_id
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    user_id = payload.get("sub")
+    if user_id is not None:
+        auth_cache.put_token(token, user_id, payload.get("exp"))
+    return user_id
+
+
+async def get_principal(db: AsyncSession, user_id: str):
+    """The user's cached principal (see core.auth_cache), or None if not found."""
+    user = auth_cache.get_user(user_id)
+    if user is not None:
+        return user
+    generation = auth_cache.generation
+    user = await AsyncUserRepository.get_user(db, user_id)
+    if user is None:
+        return None
+    return auth_cache.put_user(user, generation)
+
+
 async def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -37,17 +64,13 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-        token_data = TokenData(user_id=user_id)
-    except JWTError:
+    user_id = verify_token(token)
+    if user_id is None:
         raise credentials_exception
 
-    user = UserRepository.get_user(db, user_id=token_data.user_id)
-    if user is None:
+    # The session only opens a connection on a cache miss
+    user = await get_principal(db, user_id)
+    if user is None or user.is_active is False:
         raise credentials_exception
 
     return user
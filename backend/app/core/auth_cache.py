@@ -0,0 +1,125 @@
+"""
+Cache of verified tokens and the users they name.
+
+Every authenticated request used to decode its JWT and load the user from
+SQLite, which dominated cheap polling endpoints such as GET /projects. Now
+both results are kept in bounded LRU caches with a TTL:
+
+- tokens: the token string -> the user ID it was issued for, until the TTL
+  or the token's own expiry, whichever comes first. Only valid tokens are
+  cached.
+- users: user ID -> a principal, a read-only snapshot of the user's columns
+  (not an ORM object, so it can outlive the session it was loaded in; the
+  password hash is left out).
+
+The repositories call invalidate_user() after committing any change to a
+user, such as deactivating them, which drops the user and every cached token
+naming them. A lookup that started before an invalidation does not cache its
+(possibly stale) result. Each worker process has its own cache, so changes
+made in another worker take effect within the TTL.
+"""
+
+import collections
+import threading
+import time
+import types
+
+from .config import AUTH_CACHE_SIZE, AUTH_CACHE_TTL
+
+# User columns a principal carries
+PRINCIPAL_FIELDS = ("id", "username", "email", "name", "is_active", "created_at")
+
+
+def principal(user):
+    """A read-only snapshot of a user row."""
+    return types.SimpleNamespace(**{f: getattr(user, f) for f in PRINCIPAL_FIELDS})
+
+
+class AuthCache:
+    """Bounded TTL/LRU caches of verified tokens and user principals. Thread-safe."""
+
+    def __init__(self, max_size: int = 10_000, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # token -> (user ID, monotonic expiry)
+        self._tokens = collections.OrderedDict()
+        # user ID -> (principal, monotonic expiry)
+        self._users = collections.OrderedDict()
+        # Bumped by every invalidation
+        self.generation = 0
+        self.stats = {
+            "token_hits": 0,
+            "token_misses": 0,
+            "user_hits": 0,
+            "user_misses": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+
+    def get_token(self, token: str):
+        """The user ID of a cached valid token, or None."""
+        return self._get(self._tokens, token, "token")
+
+    def put_token(self, token: str, user_id: str, expires_at=None):
+        """Cache a verified token; expires_at is its "exp" claim (Unix time)."""
+        ttl = self.ttl
+        if expires_at is not None:
+            ttl = min(ttl, expires_at - time.time())
+        if ttl > 0:
+            self._put(self._tokens, token, user_id, ttl)
+
+    def get_user(self, user_id: str):
+        """The cached principal of a user, or None."""
+        return self._get(self._users, user_id, "user")
+
+    def put_user(self, user, generation: int):
+        """Cache and return the principal of user, a row loaded from the database.
+
+        generation is self.generation from before the row was loaded; if a
+        user was invalidated since, the row may be stale and is not cached.
+        """
+        snapshot = principal(user)
+        with self._lock:
+            if generation == self.generation:
+                self._put_locked(self._users, user.id, snapshot, self.ttl)
+        return snapshot
+
+    def invalidate_user(self, user_id: str):
+        """Drop a user's principal and every cached token naming them."""
+        with self._lock:
+            self.generation += 1
+            self.stats["invalidations"] += 1
+            self._users.pop(user_id, None)
+            for token in [t for t, (u, _) in self._tokens.items() if u == user_id]:
+                del self._tokens[token]
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, tokens=len(self._tokens), users=len(self._users))
+
+    def _get(self, entries, key: str, kind: str):
+        with self._lock:
+            entry = entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                entries.move_to_end(key)
+                self.stats[kind + "_hits"] += 1
+                return entry[0]
+            if entry is not None:
+                del entries[key]
+            self.stats[kind + "_misses"] += 1
+            return None
+
+    def _put(self, entries, key: str, value, ttl: float):
+        with self._lock:
+            self._put_locked(entries, key, value, ttl)
+
+    def _put_locked(self, entries, key: str, value, ttl: float):
+        entries[key] = (value, time.monotonic() + ttl)
+        entries.move_to_end(key)
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+
+auth_cache = AuthCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
@@ -0,0 +1,286 @@
+"""
+Content-addressed store for file bodies.
+
+File rows used to carry their whole body in a TEXT column, so every query that
+touched a file dragged its content through SQLite, and identical files (the
+same requirements.txt in a hundred projects) were stored a hundred times. The
+bodies now live on disk under their SHA-256, and a file row holds only the
+hash and size. Writing the same content twice stores it once.
+
+Blobs larger than a few KiB are compressed with zstd when the zstandard
+package is installed and compression actually saves space. Uncompressed blobs
+are read through mmap, so serving a large file (or a range of it) does not
+copy it through read() calls.
+
+Blobs are never rewritten in place. One that no file refers to any more is
+removed by collect_garbage() once it is older than a grace period, which
+covers the gap between storing a blob and committing the row that uses it.
+"""
+
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+from .config import (
+    BLOB_COMPRESS_MIN_SIZE,
+    BLOB_COMPRESSION,
+    BLOB_COMPRESSION_LEVEL,
+    BLOB_DIR,
+    BLOB_MMAP_THRESHOLD,
+)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bytes per chunk when streaming a blob
+CHUNK_SIZE = 64 * 1024
+
+
+class BlobNotFound(Exception):
+    """Raised when a blob is not in the store."""
+
+
+class BlobStore:
+    """Stores byte strings on disk, keyed by their SHA-256."""
+
+    def __init__(
+        self,
+        root: str,
+        compression: str = "zstd",
+        level: int = 3,
+        compress_min_size: int = 4096,
+        mmap_threshold: int = 1024 * 1024,
+    ):
+        self.root = root
+        if compression == "zstd" and zstandard is None:
+            print("zstandard is not installed; storing blobs uncompressed")
+            compression = "none"
+        self.compression = compression
+        self.level = level
+        self.compress_min_size = compress_min_size
+        self.mmap_threshold = mmap_threshold
+        self._tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.stats = {
+            "stored": 0,
+            "deduplicated": 0,
+            "compressed": 0,
+            "bytes_in": 0,
+            "bytes_written": 0,
+            "collected": 0,
+        }
+
+    def writer(self):
+        """A BlobWriter for content that arrives in chunks."""
+        return BlobWriter(self)
+
+    def put(self, data: bytes):
+        """Store data; returns its (hash, size)."""
+        writer = self.writer()
+        try:
+            writer.write(data)
+            return writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+
+    def exists(self, digest: str):
+        return self._find(digest) is not None
+
+    def read(self, digest: str):
+        """The whole blob as bytes."""
+        return b"".join(self.iter_chunks(digest))
+
+    def read_text(self, digest: str):
+        """The blob decoded as UTF-8; invalid bytes are replaced."""
+        return self.read(digest).decode("utf-8", errors="replace")
+
+    def iter_chunks(self, digest: str, start: int = 0, end: int = None):
+        """Yield the blob's bytes from start up to end (exclusive), in chunks.
+
+        Raises BlobNotFound before yielding anything if the blob is missing.
+        """
+        path, compressed = self._locate(digest)
+        if compressed:
+            return self._iter_compressed(path, start, end)
+        return self._iter_raw(path, start, end)
+
+    def delete(self, digest: str):
+        for path in self._paths(digest):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def collect_garbage(self, referenced: set, min_age: float):
+        """Remove blobs not in referenced that are older than min_age seconds.
+
+        Also removes temporary files left by interrupted writes. Returns the
+        number of blobs removed. Blocking; walks the whole store.
+        """
+        cutoff = time.time() - min_age
+        removed = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if dirpath != self._tmp_dir:
+                    if filename.split(".")[0] in referenced:
+                        continue
+                try:
+                    if os.stat(path).st_mtime > cutoff:
+                        continue
+                    os.unlink(path)
+                except FileNotFoundError:
+                    continue
+                if dirpath != self._tmp_dir:
+                    removed += 1
+        with self._lock:
+            self.stats["collected"] += removed
+        return removed
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, compression=self.compression)
+
+    def _paths(self, digest: str):
+        base = os.path.join(self.root, digest[:2], digest)
+        return base, base + ".zst"
+
+    def _find(self, digest: str):
+        for path in self._paths(digest):
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _locate(self, digest: str):
+        path = self._find(digest)
+        if path is None:
+            raise BlobNotFound(digest)
+        compressed = path.endswith(".zst")
+        if compressed and zstandard is None:
+            raise RuntimeError(f"Blob {digest} is compressed; install zstandard")
+        return path, compressed
+
+    def _iter_raw(self, path: str, start: int, end: int):
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            end = size if end is None else min(end, size)
+            if size >= self.mmap_threshold:
+                # Slices come straight from the page cache
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    for offset in range(start, end, CHUNK_SIZE):
+                        yield mapped[offset : min(offset + CHUNK_SIZE, end)]
+                return
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def _iter_compressed(self, path: str, start: int, end: int):
+        with open(path, "rb") as f:
+            reader = zstandard.ZstdDecompressor().stream_reader(f)
+            position = 0
+            while end is None or position < end:
+                chunk = reader.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                chunk_start = position
+                position += len(chunk)
+                if position <= start:
+                    continue
+                low = max(start - chunk_start, 0)
+                high = len(chunk) if end is None else end - chunk_start
+                yield chunk[low:high]
+
+    def _commit(self, tmp_path: str, digest: str, size: int):
+        """Move a finished temporary file into place under digest."""
+        existing = self._find(digest)
+        if existing is not None:
+            os.unlink(tmp_path)
+            # Refresh its age so a concurrent collect_garbage() keeps it
+            os.utime(existing)
+            with self._lock:
+                self.stats["deduplicated"] += 1
+                self.stats["bytes_in"] += size
+            return
+
+        raw_path, zst_path = self._paths(digest)
+        os.makedirs(os.path.dirname(raw_path), exist_ok=True)
+        path, written = raw_path, size
+        if self.compression == "zstd" and size >= self.compress_min_size:
+            compressed_path = self._compress(tmp_path)
+            written = os.path.getsize(compressed_path)
+            # Only keep the compressed copy when it saves at least 10%
+            if written < size * 0.9:
+                os.unlink(tmp_path)
+                tmp_path, path = compressed_path, zst_path
+            else:
+                os.unlink(compressed_path)
+                written = size
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.stats["stored"] += 1
+            self.stats["bytes_in"] += size
+            self.stats["bytes_written"] += written
+            if path == zst_path:
+                self.stats["compressed"] += 1
+
+    def _compress(self, tmp_path: str):
+        fd, compressed_path = tempfile.mkstemp(dir=self._tmp_dir)
+        compressor = zstandard.ZstdCompressor(level=self.level)
+        with open(tmp_path, "rb") as source, os.fdopen(fd, "wb") as target:
+            compressor.copy_stream(source, target)
+        return compressed_path
+
+
+class BlobWriter:
+    """Writes one blob chunk by chunk, hashing it on the way.
+
+    Call commit() when all chunks are written, or abort() to discard them.
+    """
+
+    def __init__(self, store: BlobStore):
+        self._store = store
+        fd, self._path = tempfile.mkstemp(dir=store._tmp_dir)
+        self._file = os.fdopen(fd, "wb")
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        """Store the blob; returns its (hash, size)."""
+        self._file.close()
+        digest = self._hash.hexdigest()
+        self._store._commit(self._path, digest, self.size)
+        return digest, self.size
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+
+
+blob_store = BlobStore(
+    BLOB_DIR,
+    BLOB_COMPRESSION,
+    BLOB_COMPRESSION_LEVEL,
+    BLOB_COMPRESS_MIN_SIZE,
+    BLOB_MMAP_THRESHOLD,
+)
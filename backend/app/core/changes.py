@@ -0,0 +1,325 @@
+"""
+Per-project feed of file tree changes.
+
+Clients used to find out about changes made elsewhere (another tab, or the
+terminal through workspace sync) only by listing the project again. The file
+repositories and WorkspaceSync now publish an event for every committed change,
+and clients subscribed to the project receive it (see the server-sent events
+endpoint in routes/files.py). Events are:
+
+    {"type": "created" | "modified", "file": <metadata>}
+    {"type": "renamed", "file": <metadata>, "old_path": ...}
+    {"type": "deleted", "id": ..., "path": ...}
+
+each with "seq", its number. <metadata> carries the file's version, so a
+client can tell an event it already applied (its own save) from a newer
+change.
+
+Events go through the file_changes table, so that clients see the changes
+made through every worker process. publish() hands them to a writer thread,
+which inserts them; SQLite numbers them, and that id is their seq, the same in
+every worker. Each worker polls the table for rows past the last one it read
+(at once for its own writes, every FEED_POLL_INTERVAL seconds for the others)
+and delivers them to its subscribers. seq increases across all projects, so a
+project's events are numbered with gaps. A client that reconnects with the
+seq of the last event it got (Last-Event-ID) is sent the project's events
+since, read back from the table, which keeps them for FEED_RETENTION seconds.
+
+Each subscriber has a bounded queue. One that falls FEED_QUEUE_SIZE events
+behind has its queue dropped and is sent a single snapshot of the file tree
+instead, so a slow client costs a fixed amount of memory and catches up in one
+step.
+"""
+
+import asyncio
+import collections
+import json
+import queue
+import threading
+import time
+
+from sqlalchemy import delete, func, insert, select
+
+from ..db import models
+from ..db.database import engine
+from .config import FEED_POLL_INTERVAL, FEED_QUEUE_SIZE, FEED_RETENTION
+
+# Returned by Subscription.get() and FileChangeFeed.backlog() when the
+# subscriber must be sent a snapshot
+SNAPSHOT = object()
+
+# Rows read per query while polling
+FEED_READ_SIZE = 1000
+
+# Seconds between prunings of old events
+FEED_PRUNE_INTERVAL = 60
+
+changes_table = models.FileChange.__table__
+
+
+def file_metadata(db_file):
+    """The JSON-ready metadata of a file row, as in file listings."""
+    return {
+        "id": db_file.id,
+        "name": db_file.name,
+        "path": db_file.path,
+        "is_directory": db_file.is_directory,
+        "size": db_file.size,
+        "version": db_file.version,
+        "updated_at": db_file.updated_at.isoformat() if db_file.updated_at else None,
+    }
+
+
+def file_event(kind: str, db_file, **fields):
+    """A created, modified or renamed event for db_file."""
+    return {"type": kind, "file": file_metadata(db_file), **fields}
+
+
+def deleted_event(file_id: str, path: str):
+    return {"type": "deleted", "id": file_id, "path": path}
+
+
+class Subscription:
+    """One client's queue of events for a project."""
+
+    def __init__(self, project_id: str, queue_size: int):
+        self.project_id = project_id
+        self.queue_size = queue_size
+        self._events = collections.deque()
+        self._snapshot = False
+        self._ready = asyncio.Event()
+
+    def push(self, event: dict):
+        """Queue event; returns True if the subscriber was switched to a snapshot."""
+        if self._snapshot:
+            return False
+        self._ready.set()
+        if len(self._events) < self.queue_size:
+            self._events.append(event)
+            return False
+        # Too far behind: replace the backlog with one snapshot
+        self._events.clear()
+        self._snapshot = True
+        return True
+
+    async def get(self, timeout: float):
+        """The queued events, SNAPSHOT, or [] if nothing came within timeout."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self._ready.clear()
+        if self._snapshot:
+            self._snapshot = False
+            return SNAPSHOT
+        events = list(self._events)
+        self._events.clear()
+        return events
+
+
+class FileChangeFeed:
+    """Fans out file change events to each project's subscribers."""
+
+    def __init__(
+        self,
+        queue_size: int = 256,
+        poll_interval: float = 0.5,
+        retention: float = 3600,
+        engine=engine,
+    ):
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.engine = engine
+        self._loop = None
+        # Project ID -> set of Subscriptions
+        self._subscribers = {}
+        # seq of the last event read from the table
+        self.position = 0
+        # (project ID, events) waiting for the writer thread; None stops it
+        self._pending = queue.SimpleQueue()
+        self._writer = None
+        self._poller = None
+        self._wake = None
+        self.stats = {"published": 0, "delivered": 0, "snapshots": 0, "errors": 0}
+
+    def start(self):
+        """Record events from now on and deliver them on the running loop."""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        with self.engine.connect() as connection:
+            self.position = connection.scalar(select(func.max(changes_table.c.id))) or 0
+        self._writer = threading.Thread(
+            target=self._write, name="file-changes", daemon=True
+        )
+        self._writer.start()
+        self._poller = self._loop.create_task(self._poll())
+
+    def stop(self):
+        """Stop polling, after recording the events already published."""
+        if self._loop is None:
+            return
+        self._loop = None
+        self._pending.put(None)
+        self._writer.join(timeout=5)
+        self._poller.cancel()
+
+    def subscribe(self, project_id: str):
+        subscription = Subscription(project_id, self.queue_size)
+        self._subscribers.setdefault(project_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.project_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.project_id]
+
+    def publish(self, project_id: str, events: list):
+        """Record committed events for every worker's subscribers. Thread-safe.
+
+        Does not block: the events are written by the writer thread.
+        """
+        if self._loop is None or not events:
+            return
+        self.stats["published"] += len(events)
+        self._pending.put((project_id, events))
+
+    async def backlog(self, project_id: str, after: int):
+        """The project's events with a seq above after, oldest first.
+
+        SNAPSHOT if some of them are no longer kept, or there are more than
+        a subscriber's queue holds.
+        """
+        return await asyncio.to_thread(self._read_backlog, project_id, after)
+
+    def snapshot(self):
+        return dict(
+            self.stats,
+            position=self.position,
+            projects=len(self._subscribers),
+            subscribers=sum(len(s) for s in self._subscribers.values()),
+        )
+
+    def _write(self):
+        pruned = 0.0
+        while True:
+            batch = [self._pending.get()]
+            while not self._pending.empty():
+                batch.append(self._pending.get())
+            now = time.time()
+            rows = []
+            for item in batch:
+                if item is not None:
+                    project_id, events = item
+                    rows += [
+                        {
+                            "project_id": project_id,
+                            "event": json.dumps(event),
+                            "created_at": now,
+                        }
+                        for event in events
+                    ]
+            try:
+                with self.engine.begin() as connection:
+                    if rows:
+                        connection.execute(insert(changes_table), rows)
+                    if now - pruned > FEED_PRUNE_INTERVAL:
+                        self._prune(connection, now)
+                        pruned = now
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Could not record file changes: {e}")
+            loop = self._loop
+            if rows and loop is not None:
+                try:
+                    loop.call_soon_threadsafe(self._wake.set)
+                except RuntimeError:
+                    # The loop is closed
+                    pass
+            if None in batch:
+                return
+
+    def _prune(self, connection, now: float):
+        # The newest event is always kept, so backlog() can tell a client
+        # that missed pruned events from one that is up to date
+        newest = select(func.max(changes_table.c.id)).scalar_subquery()
+        connection.execute(
+            delete(changes_table).where(
+                changes_table.c.created_at < now - self.retention,
+                changes_table.c.id < newest,
+            )
+        )
+
+    async def _poll(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                rows = await asyncio.to_thread(self._read, self.position)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Could not read file changes: {e}")
+                continue
+            for seq, project_id, event in rows:
+                self.position = seq
+                if project_id in self._subscribers:
+                    self._deliver(project_id, [dict(json.loads(event), seq=seq)])
+            if len(rows) == FEED_READ_SIZE:
+                # More to read
+                self._wake.set()
+
+    def _read(self, after: int):
+        with self.engine.connect() as connection:
+            return connection.execute(
+                select(
+                    changes_table.c.id,
+                    changes_table.c.project_id,
+                    changes_table.c.event,
+                )
+                .where(changes_table.c.id > after)
+                .order_by(changes_table.c.id)
+                .limit(FEED_READ_SIZE)
+            ).all()
+
+    def _read_backlog(self, project_id: str, after: int):
+        with self.engine.connect() as connection:
+            first, last = connection.execute(
+                select(func.min(changes_table.c.id), func.max(changes_table.c.id))
+            ).one()
+            if last is None:
+                # Nothing was ever recorded
+                return [] if after == 0 else SNAPSHOT
+            if after > last or after < first - 1:
+                # Not one of ours, or events after it were pruned
+                return SNAPSHOT
+            rows = connection.execute(
+                select(changes_table.c.id, changes_table.c.event)
+                .where(
+                    changes_table.c.project_id == project_id,
+                    changes_table.c.id > after,
+                )
+                .order_by(changes_table.c.id)
+                .limit(self.queue_size + 1)
+            ).all()
+        if len(rows) > self.queue_size:
+            return SNAPSHOT
+        return [dict(json.loads(event), seq=seq) for seq, event in rows]
+
+    def _deliver(self, project_id: str, events: list):
+        subscribers = self._subscribers.get(project_id)
+        if not subscribers:
+            return
+        for event in events:
+            for subscription in subscribers:
+                if subscription.push(event):
+                    self.stats["snapshots"] += 1
+        self.stats["delivered"] += len(events) * len(subscribers)
+
+
+file_changes = FileChangeFeed(FEED_QUEUE_SIZE, FEED_POLL_INTERVAL, FEED_RETENTION)
@@ -1,7 +1,8 @@
 import os
 
-# Use local directory for development
-DATA_DIR = os.path.join(
+# Use the DATA_DIR environment variable when provided (e.g. in docker-compose),
+# otherwise fall back to a local directory for development
+DATA_DIR = os.environ.get("DATA_DIR") or os.path.join(
     os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
     "persistent_data/users",
 )
@@ -9,8 +10,195 @@ DATA_DIR = os.path.join(
 # Create data directory if it doesn't exist
 os.makedirs(DATA_DIR, exist_ok=True)
 
-# Session timeout in seconds (30 minutes)
-SESSION_TIMEOUT = 1800
+# Sessions move through three tiers: active, paused (frozen with the cgroup
+# freezer, resumed in milliseconds) and stopped.
+# Seconds without input before a connected session is paused (30 minutes)
+SESSION_TIMEOUT = int(os.environ.get("SESSION_TIMEOUT", 1800))
 
-# Cleanup check interval in seconds (5 minutes)
-CLEANUP_INTERVAL = 300
+# Seconds a paused session is kept before its container is stopped
+PAUSED_SESSION_TIMEOUT = int(os.environ.get("PAUSED_SESSION_TIMEOUT", 1800))
+
+# Base image for user containers
+CONTAINER_IMAGE = "python:3.12-slim"
+
+# cgroup limits applied to every user container: CPUs (fractions allowed),
+# memory (a Docker size string such as "1g") and number of processes
+CONTAINER_CPUS = float(os.environ.get("CONTAINER_CPUS", 1.0))
+CONTAINER_MEMORY = os.environ.get("CONTAINER_MEMORY", "1g")
+CONTAINER_PIDS_LIMIT = int(os.environ.get("CONTAINER_PIDS_LIMIT", 256))
+
+# Admission control: sessions holding a container at once, overall and per
+# user. Further sessions wait in a queue that serves users round-robin.
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 50))
+MAX_SESSIONS_PER_USER = int(os.environ.get("MAX_SESSIONS_PER_USER", 3))
+
+# Build context of the runtime image (base image plus the standard package
+# set) and the repository its hash-based tags are created under
+RUNTIME_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "runtime",
+)
+RUNTIME_IMAGE_REPOSITORY = "web-terminal-runtime"
+# A failed build is retried after RUNTIME_IMAGE_RETRY_INTERVAL seconds, the
+# wait doubling with each further failure up to RUNTIME_IMAGE_RETRY_MAX
+RUNTIME_IMAGE_RETRY_INTERVAL = 60
+RUNTIME_IMAGE_RETRY_MAX = 1800
+
+# Pre-warmed container pool. The pool keeps at least POOL_MIN_SIZE idle
+# containers ready and grows up to POOL_MAX_SIZE when claims outpace it.
+POOL_MIN_SIZE = int(os.environ.get("POOL_MIN_SIZE", 2))
+POOL_MAX_SIZE = int(os.environ.get("POOL_MAX_SIZE", 8))
+
+# Number of containers the pool starts in parallel while refilling
+POOL_REFILL_CONCURRENCY = int(os.environ.get("POOL_REFILL_CONCURRENCY", 2))
+
+# Seconds between pool refill checks
+POOL_REFILL_INTERVAL = 5
+
+# Seconds without a pool miss before the pool shrinks back towards its minimum
+POOL_SHRINK_AFTER = 120
+
+# Workspace directories of idle pooled containers. Kept next to DATA_DIR so
+# they live on the same filesystem and can be renamed into place on claim.
+POOL_DIR = os.path.join(os.path.dirname(DATA_DIR), "pool")
+os.makedirs(POOL_DIR, exist_ok=True)
+
+# Docker calls run on a bounded thread pool. Each operation type has its own
+# concurrency cap and timeout in seconds (None waits indefinitely).
+DOCKER_MAX_WORKERS = int(os.environ.get("DOCKER_MAX_WORKERS", 64))
+DOCKER_CONCURRENCY = {
+    "build": 1,
+    "create": 8,
+    "exec": 48,
+    "pause": 16,
+    "stop": 16,
+    "ping": 8,
+}
+DOCKER_TIMEOUTS = {
+    "build": None,
+    "create": 300,
+    "exec": 600,
+    "pause": 30,
+    "stop": 30,
+    "ping": 5,
+}
+
+# Docker daemons to place session containers on, as a JSON list of
+# {"name", "url", "capacity", "draining"} objects, e.g.
+# [{"name": "a", "url": "tcp://10.0.0.2:2375", "capacity": 40}]. Unset means
+# the single daemon from the environment with room for MAX_SESSIONS. All hosts
+# must see DATA_DIR at the same path (HOST_DATA_DIR) for workspace mounts.
+DOCKER_HOSTS = os.environ.get("DOCKER_HOSTS")
+
+# Bearer token for the admin API (routes/admin.py), which drains Docker hosts
+# at runtime. Unset disables the admin API.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Seconds between Docker host health checks
+DOCKER_HEALTH_CHECK_INTERVAL = 10
+
+# Output chunks buffered between a running command and the websocket. When a
+# client reads slower than the command writes, the command's output reader
+# waits once this many chunks are queued.
+EXEC_OUTPUT_QUEUE_SIZE = 64
+
+# Scrollback kept per session so a reconnecting client can be sent the output
+# it missed, and the total memory all scrollback buffers may use (bytes)
+SCROLLBACK_SIZE = int(os.environ.get("SCROLLBACK_SIZE", 256 * 1024))
+SCROLLBACK_MEMORY_BUDGET = int(
+    os.environ.get("SCROLLBACK_MEMORY_BUDGET", 256 * 1024 * 1024)
+)
+
+# Seconds a session keeps running after its last websocket drops, waiting for
+# the client to reconnect, before it is paused
+RESUME_GRACE_PERIOD = int(os.environ.get("RESUME_GRACE_PERIOD", 60))
+
+# Where sessions are registered: "memory" for a single worker process, or
+# "sqlite" to share them between uvicorn workers through a database file on
+# the same host, so each project gets exactly one container
+SESSION_REGISTRY = os.environ.get("SESSION_REGISTRY", "memory")
+SESSION_REGISTRY_PATH = os.environ.get("SESSION_REGISTRY_PATH") or os.path.join(
+    os.path.dirname(DATA_DIR), "sessions.db"
+)
+# Each worker renews its registry entries every REGISTRY_HEARTBEAT_INTERVAL
+# seconds; the websocket counts of a worker silent for REGISTRY_WORKER_LEASE
+# seconds (it crashed) no longer keep sessions from pausing
+REGISTRY_HEARTBEAT_INTERVAL = int(os.environ.get("REGISTRY_HEARTBEAT_INTERVAL", 15))
+REGISTRY_WORKER_LEASE = int(os.environ.get("REGISTRY_WORKER_LEASE", 60))
+
+# SQLite tuning applied to every database connection. "wal" uses write-ahead
+# logging (readers never wait for the writer), synchronous=NORMAL (fsync on
+# checkpoint rather than on every commit) and memory-mapped reads; "default"
+# keeps SQLite's own settings.
+DB_PROFILE = os.environ.get("DB_PROFILE", "wal")
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", 256 * 1024 * 1024))
+# Milliseconds a connection waits for the write lock before failing
+DB_BUSY_TIMEOUT = int(os.environ.get("DB_BUSY_TIMEOUT", 5000))
+
+# Connection pool per engine, and prepared statements cached per connection
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+DB_STATEMENT_CACHE = int(os.environ.get("DB_STATEMENT_CACHE", 256))
+
+# Content-addressed store for file bodies (see core/blobs.py). Blobs of at
+# least BLOB_COMPRESS_MIN_SIZE bytes are compressed when BLOB_COMPRESSION is
+# "zstd" and the zstandard package is installed; "none" disables it.
+# Uncompressed blobs of at least BLOB_MMAP_THRESHOLD bytes are read via mmap.
+BLOB_DIR = os.environ.get("BLOB_DIR") or os.path.join(
+    os.path.dirname(DATA_DIR), "blobs"
+)
+BLOB_COMPRESSION = os.environ.get("BLOB_COMPRESSION", "zstd")
+BLOB_COMPRESSION_LEVEL = int(os.environ.get("BLOB_COMPRESSION_LEVEL", 3))
+BLOB_COMPRESS_MIN_SIZE = 4096
+BLOB_MMAP_THRESHOLD = 1024 * 1024
+
+# Blobs no file refers to are removed once they are older than
+# BLOB_GC_GRACE_PERIOD seconds, checked every BLOB_GC_INTERVAL seconds
+BLOB_GC_INTERVAL = 3600
+BLOB_GC_GRACE_PERIOD = 3600
+
+# Two-way sync between the files table and project workspaces (core/sync.py).
+# Workspace changes are collected for SYNC_DEBOUNCE seconds of quiet, but at
+# most SYNC_MAX_DELAY seconds, then written to the database in one batch.
+# Files larger than SYNC_MAX_FILE_SIZE bytes and the SYNC_IGNORE directories
+# stay in the workspace only.
+WORKSPACE_SYNC = os.environ.get("WORKSPACE_SYNC", "1") == "1"
+SYNC_DEBOUNCE = 0.5
+SYNC_MAX_DELAY = 2.0
+SYNC_MAX_FILE_SIZE = int(os.environ.get("SYNC_MAX_FILE_SIZE", 50 * 1024 * 1024))
+SYNC_IGNORE = (".git", "__pycache__", "node_modules", ".venv", "venv")
+
+# Per-project feed of file changes (core/changes.py). A subscriber that falls
+# more than FEED_QUEUE_SIZE events behind is sent a snapshot of the file tree
+# instead; idle streams get a keepalive every FEED_KEEPALIVE seconds.
+FEED_QUEUE_SIZE = 256
+FEED_KEEPALIVE = 15
+# Events are kept in the file_changes table, so every worker sees them and a
+# reconnecting client can resume from its Last-Event-ID. Each worker checks
+# for other workers' events every FEED_POLL_INTERVAL seconds; events older
+# than FEED_RETENTION seconds are pruned.
+FEED_POLL_INTERVAL = 0.5
+FEED_RETENTION = int(os.environ.get("FEED_RETENTION", 3600))
+
+# Full-text search over file contents (db/search.py). Binary files and files
+# larger than SEARCH_MAX_FILE_SIZE bytes are not indexed. A search ranks the
+# SEARCH_MAX_CANDIDATES newest files of the project that match it.
+SEARCH_MAX_FILE_SIZE = int(os.environ.get("SEARCH_MAX_FILE_SIZE", 1024 * 1024))
+SEARCH_MAX_CANDIDATES = 1000
+# A search's regex is matched by one of SEARCH_REGEX_WORKERS processes per
+# worker (core/patterns.py), and fails after SEARCH_REGEX_TIMEOUT seconds
+SEARCH_REGEX_WORKERS = int(os.environ.get("SEARCH_REGEX_WORKERS", 2))
+SEARCH_REGEX_TIMEOUT = float(os.environ.get("SEARCH_REGEX_TIMEOUT", 2))
+
+# Project export and import as tar or zip archives (core/archive.py). An
+# import is refused once its files add up to more than IMPORT_MAX_SIZE bytes
+# or IMPORT_MAX_FILES files.
+IMPORT_MAX_SIZE = int(os.environ.get("IMPORT_MAX_SIZE", 1024 * 1024 * 1024))
+IMPORT_MAX_FILES = 100_000
+
+# Verified tokens and the users they name are cached (core/auth_cache.py) for
+# up to AUTH_CACHE_TTL seconds, AUTH_CACHE_SIZE of each. Changes to a user
+# clear its entries at once in the worker that made them; other workers see
+# them within the TTL.
+AUTH_CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", 60))
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", 10_000))
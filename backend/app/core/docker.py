@@ -1,78 +1,685 @@
+import asyncio
+import functools
 import os
+import secrets
+import threading
+import time
 
 import docker
 
-from ..core.config import DATA_DIR
+from ..core.config import (
+    CONTAINER_CPUS,
+    CONTAINER_IMAGE,
+    CONTAINER_MEMORY,
+    CONTAINER_PIDS_LIMIT,
+    DATA_DIR,
+    DOCKER_CONCURRENCY,
+    DOCKER_HOSTS,
+    DOCKER_MAX_WORKERS,
+    DOCKER_TIMEOUTS,
+    EXEC_OUTPUT_QUEUE_SIZE,
+    MAX_SESSIONS,
+    MAX_SESSIONS_PER_USER,
+    PAUSED_SESSION_TIMEOUT,
+    POOL_DIR,
+    POOL_MAX_SIZE,
+    POOL_MIN_SIZE,
+    POOL_REFILL_CONCURRENCY,
+    POOL_REFILL_INTERVAL,
+    POOL_SHRINK_AFTER,
+    REGISTRY_WORKER_LEASE,
+    RESUME_GRACE_PERIOD,
+    RUNTIME_DIR,
+    RUNTIME_IMAGE_REPOSITORY,
+    SCROLLBACK_MEMORY_BUDGET,
+    SCROLLBACK_SIZE,
+    SESSION_REGISTRY,
+    SESSION_REGISTRY_PATH,
+    SESSION_TIMEOUT,
+)
+from .admission import AdmissionController
+from .executor import DockerExecutor
+from .expiry import ExpiryScheduler
+from .hosts import HostPool, load_hosts
+from .image import RuntimeImage, manifest_packages
+from .pool import ContainerPool
+from .registry import create_registry, worker_id
+from .scrollback import Scrollback, ScrollbackBudget
+from .shell import PtyShell
+from .streaming import ExecOutput, pump
+from .sync import workspace_sync
 
-docker_client = docker.from_env()
+# Docker daemons that session containers are placed on
+docker_hosts = HostPool(load_hosts(DOCKER_HOSTS, MAX_SESSIONS))
+
+# This worker's sessions, by "user_id:project_id"
 user_sessions = {}
 
+# Which container serves each key, shared with the other worker processes
+# A container left "pausing" for twice the pause timeout was abandoned by a
+# worker that died mid-pause
+session_registry = create_registry(
+    SESSION_REGISTRY,
+    SESSION_REGISTRY_PATH,
+    pause_lease=2 * DOCKER_TIMEOUTS["pause"],
+    worker_lease=REGISTRY_WORKER_LEASE,
+)
+WORKER_ID = worker_id()
 
-def create_container(user_id: str, project_id: str):
-    """Create a new Docker container for a user session."""
-    user_project_dir = os.path.join(DATA_DIR, user_id, project_id)
-    os.makedirs(user_project_dir, exist_ok=True)
+# Seconds between checks while another worker is creating a key's container
+REGISTRY_POLL_INTERVAL = 0.1
 
-    # For macOS Docker Desktop, we need to map the container path to host path
-    host_path = user_project_dir
-    if os.environ.get("HOST_DATA_DIR"):
-        # If running in Docker, map the container path to host path
-        host_path = os.path.join(os.environ.get("HOST_DATA_DIR"), user_id, project_id)
-        print(f"Mapping container path {user_project_dir} to host path {host_path}")
+# All Docker calls made from async code go through this executor
+docker_executor = DockerExecutor(
+    DOCKER_MAX_WORKERS, DOCKER_CONCURRENCY, DOCKER_TIMEOUTS
+)
+
+# Serializes session creation per user/project so two connections for the
+# same key cannot start two containers
+_session_locks = {}
+_session_locks_guard = threading.Lock()
+
+# Caps how many sessions hold a container at once; a session keeps its slot
+# until it is stopped
+session_admission = AdmissionController(MAX_SESSIONS, MAX_SESSIONS_PER_USER)
+
+# Counters for the paused tier
+lifecycle_stats = {"paused": 0, "resumed": 0, "last_resume_ms": None}
+
+# Shared by the scrollback buffers of all sessions
+scrollback_budget = ScrollbackBudget(SCROLLBACK_MEMORY_BUDGET)
+
+# The runtime image is built on every host
+runtime_images = {
+    name: RuntimeImage(host, RUNTIME_DIR, RUNTIME_IMAGE_REPOSITORY, CONTAINER_IMAGE)
+    for name, host in docker_hosts.hosts.items()
+}
+
+
+def to_host_path(path: str):
+    """Map a path on the backend's filesystem to the path the Docker host sees.
+
+    When the backend itself runs in Docker, HOST_DATA_DIR points at the host
+    directory that is mounted as DATA_DIR.
+    """
+    host_data_dir = os.environ.get("HOST_DATA_DIR")
+    if not host_data_dir:
+        return path
+
+    host_path = os.path.normpath(
+        os.path.join(host_data_dir, os.path.relpath(path, DATA_DIR))
+    )
+    print(f"Mapping container path {path} to host path {host_path}")
+    return host_path
+
+
+def session_environment(user_id: str, project_id: str):
+    """Environment variables for commands run in a user's container."""
+    return {
+        "USER_ID": user_id,
+        "PROJECT_ID": project_id,
+        "TERM": "xterm-256color",
+    }
 
-    # Ensure everyone can read/write to this directory
-    try:
-        os.system(f"chmod -R 777 {user_project_dir}")
-    except Exception as e:
-        print(f"Warning: Could not set permissions on {user_project_dir}: {str(e)}")
 
-    container = docker_client.containers.run(
-        "python:3.12-slim",
+def start_container(host, workspace_dir: str, environment: dict):
+    """Start a container on host with workspace_dir mounted at /workspace.
+
+    Uses the baked runtime image when it is available. Until it has been built
+    the base image is used and the packages are installed into the container.
+    """
+    runtime_image = runtime_images[host.name]
+    baked = runtime_image.ready
+    container = host.containers.run(
+        runtime_image.tag if baked else CONTAINER_IMAGE,
         command="bash",
         stdin_open=True,
         tty=True,
         detach=True,
         remove=True,  # Auto-remove when stopped
-        volumes={host_path: {"bind": "/workspace", "mode": "rw"}},
+        volumes={to_host_path(workspace_dir): {"bind": "/workspace", "mode": "rw"}},
         working_dir="/workspace",
-        environment={
-            "USER_ID": user_id,
-            "PROJECT_ID": project_id,
-            "TERM": "xterm-256color",
-        },
+        environment=environment,
+        nano_cpus=int(CONTAINER_CPUS * 1e9),
+        mem_limit=CONTAINER_MEMORY,
+        pids_limit=CONTAINER_PIDS_LIMIT,
     )
-    container.exec_run("pip install numpy pandas scipy")
+    if not baked:
+        container.exec_run(["pip", "install", *manifest_packages(RUNTIME_DIR)])
 
     return container
 
 
+def start_pooled_container(host, slot_dir: str):
+    """Start an idle container for the pool, not yet bound to any user."""
+    return start_container(host, slot_dir, {"TERM": "xterm-256color"})
+
+
+# One pool of pre-warmed containers per host
+container_pools = {
+    name: ContainerPool(
+        functools.partial(start_pooled_container, host),
+        docker_executor,
+        pool_dir=os.path.join(POOL_DIR, name),
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        refill_concurrency=POOL_REFILL_CONCURRENCY,
+        refill_interval=POOL_REFILL_INTERVAL,
+        shrink_after=POOL_SHRINK_AFTER,
+    )
+    for name, host in docker_hosts.hosts.items()
+}
+
+
+def create_container(host, user_id: str, project_id: str):
+    """Create a new Docker container on host for a user session."""
+    user_project_dir = os.path.join(DATA_DIR, user_id, project_id)
+    os.makedirs(user_project_dir, exist_ok=True)
+
+    # Ensure everyone can read/write to this directory
+    try:
+        os.system(f"chmod -R 777 {user_project_dir}")
+    except Exception as e:
+        print(f"Warning: Could not set permissions on {user_project_dir}: {str(e)}")
+
+    return start_container(
+        host, user_project_dir, session_environment(user_id, project_id)
+    )
+
+
+def _session_lock(session_key: str):
+    with _session_locks_guard:
+        return _session_locks.setdefault(session_key, threading.Lock())
+
+
 def get_session(user_id: str, project_id: str):
-    """Get or create a session for a user/project combination."""
+    """Get or create a session for a user/project combination.
+
+    The session registry decides which worker creates the key's container:
+    the worker that wins the claim takes a pre-warmed container from the pool
+    when one is available, otherwise cold-starts one, and publishes its ID.
+    Other workers wait for the ID and attach to the same container.
+    """
     session_key = f"{user_id}:{project_id}"
 
-    if session_key not in user_sessions:
-        container = create_container(user_id, project_id)
+    with _session_lock(session_key):
+        if session_key in user_sessions:
+            return user_sessions[session_key]
+
+        while True:
+            record = session_registry.claim(
+                session_key, WORKER_ID, DOCKER_TIMEOUTS["create"]
+            )
+            if record["claimed"]:
+                host, container = _create_session_container(user_id, project_id)
+                break
+            if record["container_id"] is not None and record["state"] != "pausing":
+                try:
+                    host = docker_hosts.host(record["host"])
+                    container = host.containers.get(record["container_id"])
+                    break
+                except (KeyError, docker.errors.NotFound):
+                    # The container is gone; let the next claim replace it
+                    session_registry.release(session_key, record["container_id"])
+                    continue
+            # Another worker is creating or pausing the container; the
+            # registry expires both if that worker dies
+            time.sleep(REGISTRY_POLL_INTERVAL)
+
         user_sessions[session_key] = {
+            "key": session_key,
             "container": container,
             "container_id": container.id,
+            "host": host,
+            "environment": session_environment(user_id, project_id),
             "last_active": None,
+            "scrollback": Scrollback(scrollback_budget.reserve(SCROLLBACK_SIZE)),
+            "resume_token": secrets.token_urlsafe(16),
+            "connections": 0,
+            "state": "active" if record["claimed"] else record["state"],
+            "lifecycle_lock": asyncio.Lock(),
+            "owner": record["claimed"],
+            "admitted": False,
+            # Whether the admission slot counts against the user's limit
+            "in_use": True,
         }
+        touch_session(user_sessions[session_key])
+
+        return user_sessions[session_key]
+
+
+def get_admitted_session(user_id: str, project_id: str, claim: threading.Lock):
+    """get_session for a caller holding one of user_id's admission slots.
+
+    Takes over the slot unless the caller already gave up on it (took claim
+    first), in which case it returns None without starting anything. The slot
+    then stays with the session if this worker started its container, and is
+    released otherwise, whether or not the caller is still waiting.
+    """
+    if not claim.acquire(blocking=False):
+        return None
+    try:
+        session = get_session(user_id, project_id)
+    except BaseException:
+        session_admission.release(user_id)
+        raise
+    with _session_lock(session["key"]):
+        admit = session["owner"] and not session["admitted"]
+        if admit:
+            session["admitted"] = True
+    if not admit:
+        # Another connection or worker started the container meanwhile
+        session_admission.release(user_id)
+    return session
 
-    return user_sessions[session_key]
 
+def _create_session_container(user_id: str, project_id: str):
+    """Place and start the container for a key this worker has claimed.
 
-def execute_command(container, cmd: str):
+    Publishes the container in the registry and returns (host, container).
+    """
+    session_key = f"{user_id}:{project_id}"
+    started = time.monotonic()
+    user_project_dir = os.path.join(DATA_DIR, user_id, project_id)
+    try:
+        host = _place(session_key)
+        # Other placements may have filled the host since its load was read;
+        # then place again with the current loads
+        while not session_registry.assign(session_key, host.name, host.capacity):
+            host = _place(session_key)
+        pool = container_pools[host.name]
+        container = pool.claim(user_project_dir)
+        pooled = container is not None
+        if not pooled:
+            container = create_container(host, user_id, project_id)
+    except BaseException:
+        session_registry.release(session_key)
+        raise
+
+    pool.record_claim(time.monotonic() - started, hit=pooled)
+    session_registry.publish(session_key, container.id)
+    return host, container
+
+
+def _place(session_key: str):
+    return docker_hosts.place(
+        session_key,
+        session_registry.host_loads(),
+        session_registry.draining_hosts(),
+    )
+
+
+def refresh_session(session: dict):
+    """Bring a local session up to date with the registry. Blocking.
+
+    Waits while another worker is pausing the container (at most the
+    registry's pause lease). Returns the registry record, or None, after
+    dropping the local session, if the container was stopped by another
+    worker.
+    """
+    while True:
+        record = session_registry.lookup(session["key"])
+        if record is None or record["container_id"] != session["container_id"]:
+            forget_session(session["key"])
+            return None
+        if record["state"] != "pausing":
+            break
+        time.sleep(REGISTRY_POLL_INTERVAL)
+    session["state"] = record["state"]
+    update_admission(session)
+    return record
+
+
+def execute_command(container, cmd: str, environment: dict = None):
     """Execute a command in a container and return the output."""
-    exec_result = container.exec_run(cmd=f"/bin/bash -c '{cmd}'", demux=True)
+    exec_result = container.exec_run(
+        cmd=f"/bin/bash -c '{cmd}'", demux=True, environment=environment
+    )
     return exec_result.exit_code, exec_result.output
 
 
+# Environment variable that tags the processes of a streamed command, so that
+# they can be found again if nobody is left to read the output
+EXEC_MARKER = "WEB_TERMINAL_EXEC"
+
+# Kills every process whose environment carries the marker given as $1
+KILL_MARKED = f"""
+for p in /proc/[0-9]*; do
+  while IFS= read -r -d "" v; do
+    if [[ $v == "{EXEC_MARKER}=$1" ]]; then kill -KILL "${{p#/proc/}}"; break; fi
+  done < "$p/environ"
+done 2>/dev/null
+"""
+
+
+def kill_command(container, marker: str):
+    """Kill a command started by stream_command_async, with its children."""
+    container.exec_run(["/bin/bash", "-c", KILL_MARKED, "kill", marker])
+
+
 def stop_session(user_id: str, project_id: str):
     """Stop and remove a user session."""
     session_key = f"{user_id}:{project_id}"
-    if session_key in user_sessions:
+    session = user_sessions.get(session_key)
+    if session is None:
+        return
+
+    # Only one worker stops the container; the others just drop their state
+    if session_registry.release(session_key, session["container_id"]):
         try:
-            user_sessions[session_key]["container"].stop()
-            del user_sessions[session_key]
+            if session["state"] == "paused":
+                # A frozen container cannot handle SIGTERM; don't wait for it
+                session["container"].kill()
+            else:
+                session["container"].stop()
         except Exception as e:
             print(f"Error stopping container: {str(e)}")
+    forget_session(session_key)
+
+
+def forget_session(session_key: str):
+    """Drop this worker's state for a session, leaving its container alone."""
+    session = user_sessions.pop(session_key, None)
+    if session is None:
+        return
+    session_expiry.cancel(session_key)
+    shell = session.get("shell")
+    if shell is not None:
+        shell.close()
+    scrollback_budget.release(session["scrollback"].capacity)
+    if session["admitted"]:
+        session_admission.release(
+            session_key.split(":", 1)[0], idle=not session["in_use"]
+        )
+    workspace_sync.unwatch(session_key.split(":", 1)[1])
+
+
+def pause_session(session: dict):
+    """Freeze the session's container and record the memory it holds."""
+    container = session["container"]
+    container.pause()
+    try:
+        stats = container.stats(stream=False, one_shot=True)
+        session["paused_memory"] = stats["memory_stats"].get("usage", 0)
+    except Exception:
+        session["paused_memory"] = 0
+
+
+def unpause_session(session: dict):
+    """Unfreeze the session's container.
+
+    A container marked paused after its pausing worker died may never have
+    been frozen; that is not an error.
+    """
+    container = session["container"]
+    try:
+        container.unpause()
+    except docker.errors.APIError:
+        container.reload()
+        if container.status == "paused":
+            raise
+
+
+def update_admission(session: dict):
+    """Hold the session against its user's session limit only while in use.
+
+    A paused session, or one without clients on this worker, keeps its
+    container but lets the user start another session.
+    """
+    in_use = session["connections"] > 0 and session["state"] != "paused"
+    if session["admitted"] and in_use != session["in_use"]:
+        session["in_use"] = in_use
+        user_id = session["key"].split(":", 1)[0]
+        session_admission.mark_idle(user_id, not in_use)
+
+
+def session_snapshot():
+    """Session counts per lifecycle tier and the memory held by paused ones."""
+    sessions = list(user_sessions.values())
+    paused = [session for session in sessions if session["state"] == "paused"]
+    return dict(
+        lifecycle_stats,
+        active=len(sessions) - len(paused),
+        paused_sessions=len(paused),
+        paused_memory_bytes=sum(session.get("paused_memory", 0) for session in paused),
+    )
+
+
+async def get_session_async(user_id: str, project_id: str, on_queued=None):
+    """Non-blocking get_session for use from the event loop.
+
+    Starting a new session goes through admission control first; while it
+    waits, ``await on_queued(position)`` is called as its queue position
+    changes.
+    """
+    session = user_sessions.get(f"{user_id}:{project_id}")
+    if (
+        session is not None
+        and await asyncio.to_thread(refresh_session, session) is None
+    ):
+        session = None
+    if session is None:
+        await session_admission.acquire(user_id, on_queued)
+        # Whoever takes this first, the create or the caller giving up,
+        # settles the admission slot
+        claim = threading.Lock()
+        try:
+            session = await docker_executor.run(
+                "create", get_admitted_session, user_id, project_id, claim
+            )
+        except BaseException:
+            # A create that already started, e.g. one that timed out, goes
+            # on in its thread and settles the slot when it finishes
+            if claim.acquire(blocking=False):
+                session_admission.release(user_id)
+            raise
+    # After get_session, which may have moved a pool slot onto the workspace
+    await workspace_sync.watch(user_id, project_id)
+    await activate_session_async(session)
+    return session
+
+
+async def activate_session_async(session: dict):
+    """Record activity on the session, unpausing its container if needed."""
+    lock = session["lifecycle_lock"]
+    # Also wait while a pause is in flight, so input never lands in a
+    # container that is about to be frozen
+    if session["state"] == "paused" or lock.locked():
+        async with lock:
+            if session["state"] == "paused":
+                started = time.monotonic()
+                # Another worker may have unpaused it already
+                if session_registry.transition(
+                    session["key"], session["container_id"], "paused", "active"
+                ):
+                    await docker_executor.run("pause", unpause_session, session)
+                session["state"] = "active"
+                session["paused_memory"] = 0
+                update_admission(session)
+                lifecycle_stats["resumed"] += 1
+                lifecycle_stats["last_resume_ms"] = round(
+                    (time.monotonic() - started) * 1000, 2
+                )
+    touch_session(session)
+
+
+def touch_session(session: dict):
+    """Push back the session's idle deadline.
+
+    Does not unpause; use activate_session_async from the event loop.
+    """
+    session["last_active"] = time.monotonic()
+    session_expiry.touch(session["key"], session["last_active"] + SESSION_TIMEOUT)
+
+
+def attach_session(session: dict):
+    """Record that a websocket is connected to the session."""
+    session["connections"] += 1
+    session_registry.add_connections(session["key"], 1, WORKER_ID)
+    update_admission(session)
+    touch_session(session)
+
+
+def detach_session(user_id: str, project_id: str):
+    """Record that a websocket left the session.
+
+    When the last one leaves, the container keeps running for
+    RESUME_GRACE_PERIOD so the client can reconnect to it, and is paused
+    afterwards if nobody did.
+    """
+    session_key = f"{user_id}:{project_id}"
+    session = user_sessions.get(session_key)
+    if session is None:
+        return
+
+    session["connections"] -= 1
+    session_registry.add_connections(session_key, -1, WORKER_ID)
+    if session["connections"] > 0:
+        return
+
+    update_admission(session)
+    session_expiry.touch(session_key, time.monotonic() + RESUME_GRACE_PERIOD)
+
+
+async def execute_command_async(container, cmd: str, environment: dict = None):
+    """Non-blocking execute_command for use from the event loop."""
+    return await docker_executor.run(
+        "exec", execute_command, container, cmd, environment
+    )
+
+
+async def stream_command_async(container, cmd: str, on_output, environment=None):
+    """Run a command and pass its output to on_output as it is produced.
+
+    ``await on_output(stdout, stderr)`` is called for every chunk; either part
+    may be None. Output is never buffered in full: a slow on_output throttles
+    the reader through a bounded queue. Returns the command's exit code.
+    """
+    api = container.client.api
+    exec_id = None
+    marker = secrets.token_hex(8)
+    environment = {**(environment or {}), EXEC_MARKER: marker}
+
+    def open_stream():
+        nonlocal exec_id
+        exec_id = api.exec_create(
+            container.id, ["/bin/bash", "-c", cmd], environment=environment
+        )["Id"]
+        return ExecOutput(api.exec_start(exec_id, socket=True))
+
+    async def on_chunk(chunk):
+        stdout, stderr = chunk
+        await on_output(stdout, stderr)
+
+    try:
+        await pump(
+            docker_executor, "exec", open_stream, on_chunk, EXEC_OUTPUT_QUEUE_SIZE
+        )
+    except BaseException:
+        # Stopped early (e.g. the client went away); the command would keep
+        # running with nobody reading its output
+        if exec_id is not None:
+            try:
+                await docker_executor.run("exec", kill_command, container, marker)
+            except Exception as e:
+                print(f"Error killing command in {container.id[:12]}: {e}")
+        raise
+
+    inspect = await docker_executor.run("exec", api.exec_inspect, exec_id)
+    return inspect["ExitCode"]
+
+
+async def stop_session_async(user_id: str, project_id: str):
+    """Non-blocking stop_session for use from the event loop."""
+    await docker_executor.run("stop", stop_session, user_id, project_id)
+
+
+async def expire_session(session_key: str):
+    """Move a session whose deadline has passed down to the next tier.
+
+    An active session is paused and gets PAUSED_SESSION_TIMEOUT before it is
+    stopped; a paused session is stopped. While clients on other workers
+    still use the container, this worker only drops its own state for it.
+    """
+    session = user_sessions.get(session_key)
+    if session is None:
+        return
+    user_id, project_id = session_key.split(":", 1)
+
+    state = session["state"]
+    record = await asyncio.to_thread(refresh_session, session)
+    if record is None:
+        return
+    if not session["connections"] and (
+        record["connections"] or record["state"] != state
+    ):
+        # Another worker has clients on the container or already moved it on
+        forget_session(session_key)
+        return
+    if record["connections"] > session["connections"]:
+        touch_session(session)
+        return
+
+    async with session["lifecycle_lock"]:
+        if session["state"] == "active":
+            if not session_registry.transition(
+                session_key, session["container_id"], "active", "pausing"
+            ):
+                # Paused by another worker in the meantime
+                session["state"] = "paused"
+                update_admission(session)
+                session_expiry.touch(
+                    session_key, time.monotonic() + PAUSED_SESSION_TIMEOUT
+                )
+                return
+            try:
+                await docker_executor.run("pause", pause_session, session)
+            except Exception as e:
+                print(f"Error pausing container, stopping it instead: {str(e)}")
+                session_registry.transition(
+                    session_key, session["container_id"], "pausing", "active"
+                )
+            else:
+                session_registry.transition(
+                    session_key, session["container_id"], "pausing", "paused"
+                )
+                session["state"] = "paused"
+                update_admission(session)
+                lifecycle_stats["paused"] += 1
+                session_expiry.touch(
+                    session_key, time.monotonic() + PAUSED_SESSION_TIMEOUT
+                )
+                return
+
+    await stop_session_async(user_id, project_id)
+
+
+# Pauses sessions once they have been idle for SESSION_TIMEOUT or their client
+# has been gone for RESUME_GRACE_PERIOD, and stops them once they have been
+# paused for PAUSED_SESSION_TIMEOUT
+session_expiry = ExpiryScheduler(expire_session)
+
+
+async def open_shell_async(session, rows: int = 24, cols: int = 80):
+    """Return the session's persistent PTY shell, starting it if needed."""
+    shell = session.get("shell")
+    if shell is not None and await docker_executor.run("exec", shell.is_running):
+        await docker_executor.run("exec", shell.resize, rows, cols)
+        return shell
+
+    shell = await docker_executor.run(
+        "exec",
+        PtyShell.open,
+        session["host"].api,
+        session["container_id"],
+        session["environment"],
+        rows,
+        cols,
+    )
+    session["shell"] = shell
+    return shell
+
+
+async def resize_shell_async(shell, rows: int, cols: int):
+    """Non-blocking PtyShell.resize for use from the event loop."""
+    await docker_executor.run("exec", shell.resize, rows, cols)
@@ -0,0 +1,87 @@
+"""
+Async facade for blocking Docker calls.
+
+docker-py only offers a blocking client, so every call is run on a bounded
+thread pool instead of on the event loop. Each kind of operation has its own
+concurrency cap and timeout, so a burst of slow container starts cannot use up
+the threads needed to run commands in sessions that already exist.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import threading
+
+
+class DockerTimeout(Exception):
+    """Raised when a Docker operation does not finish within its timeout."""
+
+
+class DockerExecutor:
+    """Runs blocking Docker calls on a thread pool with per-operation limits."""
+
+    def __init__(self, max_workers: int, limits: dict, timeouts: dict):
+        # limits and timeouts are keyed by operation type, e.g. "create" or "exec"
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="docker"
+        )
+        self._limits = limits
+        self._timeouts = timeouts
+        self._slots = {op: asyncio.Semaphore(n) for op, n in limits.items()}
+        self._lock = threading.Lock()
+        self.stats = {op: {"running": 0, "calls": 0, "timeouts": 0} for op in limits}
+
+    async def run(self, op: str, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) for operation type op and await its result.
+
+        The concurrency slot is held until the call really finishes, even if
+        the caller has already given up on it after a timeout, so the cap
+        always reflects how many threads are busy.
+        """
+        loop = asyncio.get_running_loop()
+        await self._slots[op].acquire()
+
+        with self._lock:
+            self.stats[op]["running"] += 1
+            self.stats[op]["calls"] += 1
+
+        try:
+            future = self._pool.submit(functools.partial(fn, *args, **kwargs))
+        except Exception:
+            self._release(op)
+            raise
+        future.add_done_callback(lambda _: self._release_threadsafe(loop, op))
+
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), self._timeouts.get(op)
+            )
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.stats[op]["timeouts"] += 1
+            raise DockerTimeout(
+                f"Docker {op} operation timed out after {self._timeouts.get(op)}s"
+            )
+
+    def snapshot(self):
+        """Per-operation counters."""
+        with self._lock:
+            return {
+                op: dict(stats, limit=self._limits[op])
+                for op, stats in self.stats.items()
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _release_threadsafe(self, loop, op: str):
+        try:
+            loop.call_soon_threadsafe(self._release, op)
+        except RuntimeError:
+            # The loop is already closed (shutdown); nothing is waiting on it
+            pass
+
+    def _release(self, op: str):
+        with self._lock:
+            self.stats[op]["running"] -= 1
+        self._slots[op].release()
@@ -0,0 +1,106 @@
+"""
+Deadline scheduler for idle sessions.
+
+Replaces periodically scanning every session: each session has a deadline in
+a min-heap and the scheduler sleeps until the earliest one. Touching a
+session only records its new deadline (O(1)); the heap entry is moved lazily
+when it comes up, so a busy session costs one heap operation per timeout
+period rather than one per keystroke.
+"""
+
+import asyncio
+import heapq
+import threading
+import time
+
+
+class ExpiryScheduler:
+    """Calls ``await on_expire(key)`` once a key's deadline has passed."""
+
+    def __init__(self, on_expire):
+        self._on_expire = on_expire
+        self._deadlines = {}
+        self._heap = []
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._tasks = set()
+        self.stats = {"expired": 0, "errors": 0}
+
+    def touch(self, key: str, deadline: float):
+        """Set key's deadline (a time.monotonic() value). Thread-safe."""
+        with self._lock:
+            current = self._deadlines.get(key)
+            self._deadlines[key] = deadline
+            if current is not None and deadline >= current:
+                # The existing heap entry fires first and is moved then
+                return
+            heapq.heappush(self._heap, (deadline, key))
+            earliest = self._heap[0][1] == key
+
+        if earliest and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def cancel(self, key: str):
+        """Forget key; its heap entry is dropped when it comes up."""
+        with self._lock:
+            self._deadlines.pop(key, None)
+
+    def deadline(self, key: str):
+        with self._lock:
+            return self._deadlines.get(key)
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["scheduled"] = len(self._deadlines)
+            stats["heap_size"] = len(self._heap)
+        stats["running"] = len(self._tasks)
+        return stats
+
+    async def run(self):
+        """Expire keys as their deadlines pass. Runs until cancelled."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
+        while True:
+            self._wakeup.clear()
+            for key in self._pop_expired(time.monotonic()):
+                task = asyncio.create_task(self._expire(key))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+            with self._lock:
+                timeout = (
+                    max(0.0, self._heap[0][0] - time.monotonic())
+                    if self._heap
+                    else None
+                )
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _pop_expired(self, now: float):
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, key = heapq.heappop(self._heap)
+                current = self._deadlines.get(key)
+                if current is None:
+                    continue
+                if current > deadline:
+                    # Touched since this entry was pushed
+                    heapq.heappush(self._heap, (current, key))
+                    continue
+                del self._deadlines[key]
+                expired.append(key)
+        return expired
+
+    async def _expire(self, key: str):
+        try:
+            await self._on_expire(key)
+            self.stats["expired"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Error expiring {key}: {str(e)}")
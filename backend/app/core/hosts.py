@@ -0,0 +1,203 @@
+"""
+Docker hosts that user containers are placed on.
+
+A single Docker daemon caps how many sessions the backend can serve, so
+containers can be spread over several daemons. Each host has a capacity (the
+number of sessions it may run). New sessions go to the least-loaded healthy
+host, relative to its capacity, but a project returns to the host it last ran
+on while that host has room, so its image layers and page cache stay warm.
+
+Hosts are checked periodically; an unhealthy host gets no new sessions until
+it answers again. A draining host keeps serving its existing sessions but is
+never picked for new ones, so it empties out as they end. Hosts are drained
+in DOCKER_HOSTS, or at runtime through the session registry so that every
+worker sees it (see routes/admin.py).
+"""
+
+import asyncio
+import collections
+import json
+import threading
+import time
+
+import docker
+
+
+class NoHostAvailable(Exception):
+    """Raised when no healthy, non-draining host has room for a session."""
+
+
+class DockerHost:
+    """One Docker daemon. Acts as its docker-py client, connecting lazily."""
+
+    def __init__(
+        self,
+        name: str,
+        url: str = None,
+        capacity: int = 50,
+        draining: bool = False,
+        client_factory=None,
+    ):
+        self.name = name
+        # None uses the environment (DOCKER_HOST or the local socket)
+        self.url = url
+        self.capacity = capacity
+        self.draining = draining
+        self.healthy = True
+        self.error = None
+        self.last_check = None
+        self._client_factory = client_factory or _connect
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self._client_factory(self.url)
+            return self._client
+
+    @property
+    def containers(self):
+        return self.client.containers
+
+    @property
+    def images(self):
+        return self.client.images
+
+    @property
+    def api(self):
+        return self.client.api
+
+    def check(self):
+        """Ping the daemon and record whether it is healthy. Blocking."""
+        try:
+            self.client.ping()
+        except Exception as e:
+            self.mark_unhealthy(e)
+        else:
+            self.healthy = True
+            self.error = None
+        self.last_check = time.time()
+        return self.healthy
+
+    def mark_unhealthy(self, error):
+        self.healthy = False
+        self.error = str(error)
+        # Reconnect from scratch on the next call
+        with self._lock:
+            self._client = None
+
+    def snapshot(self, load: int, draining: bool = False):
+        return {
+            "url": self.url,
+            "capacity": self.capacity,
+            "load": load,
+            "healthy": self.healthy,
+            "draining": self.draining or draining,
+            "error": self.error,
+            "last_check": self.last_check,
+        }
+
+
+def _connect(url: str):
+    if url is None:
+        return docker.from_env()
+    return docker.DockerClient(base_url=url)
+
+
+class HostPool:
+    """Chooses the host for each new session container."""
+
+    def __init__(self, hosts: list, sticky_size: int = 10000):
+        if not hosts:
+            raise ValueError("At least one Docker host is required")
+        self.hosts = {host.name: host for host in hosts}
+        # Project key -> name of the host it last ran on, least recent first
+        self._sticky = collections.OrderedDict()
+        self._sticky_size = sticky_size
+        self._lock = threading.Lock()
+        self.stats = {"placed": 0, "sticky": 0, "rejected": 0}
+
+    def host(self, name: str):
+        return self.hosts[name]
+
+    def place(self, key: str, loads: dict, draining=()):
+        """Pick the host for key's container.
+
+        loads maps host names to the number of sessions running on them, and
+        draining holds the names of hosts drained at runtime. As
+        they may be out of date by the time the container is recorded, the
+        caller reserves the place with the registry's assign(), which refuses
+        a full host, and places again if it was refused.
+        """
+        available = [
+            host
+            for host in self.hosts.values()
+            if host.healthy
+            and not (host.draining or host.name in draining)
+            and loads.get(host.name, 0) < host.capacity
+        ]
+
+        with self._lock:
+            if not available:
+                self.stats["rejected"] += 1
+                raise NoHostAvailable("No Docker host has room for a new session")
+
+            previous = self._sticky.get(key)
+            host = next((host for host in available if host.name == previous), None)
+            if host is not None:
+                self.stats["sticky"] += 1
+            else:
+                host = min(
+                    available,
+                    key=lambda host: loads.get(host.name, 0) / host.capacity,
+                )
+
+            self._sticky[key] = host.name
+            self._sticky.move_to_end(key)
+            if len(self._sticky) > self._sticky_size:
+                self._sticky.popitem(last=False)
+            self.stats["placed"] += 1
+        return host
+
+    async def run_health_checks(self, executor, interval: float):
+        """Check every host each interval seconds. Runs until cancelled."""
+        while True:
+            results = await asyncio.gather(
+                *(executor.run("ping", host.check) for host in self.hosts.values()),
+                return_exceptions=True,
+            )
+            for host, result in zip(self.hosts.values(), results):
+                if isinstance(result, Exception):
+                    # The check itself timed out
+                    host.mark_unhealthy(result)
+            await asyncio.sleep(interval)
+
+    def snapshot(self, loads: dict, draining=()):
+        with self._lock:
+            stats = dict(self.stats)
+        stats["hosts"] = {
+            name: host.snapshot(loads.get(name, 0), name in draining)
+            for name, host in self.hosts.items()
+        }
+        return stats
+
+
+def load_hosts(spec: str, default_capacity: int):
+    """Parse the DOCKER_HOSTS setting.
+
+    spec is a JSON list of {"name", "url", "capacity", "draining"} objects.
+    An empty spec means a single host from the environment.
+    """
+    if not spec:
+        return [DockerHost("local", None, default_capacity)]
+    return [
+        DockerHost(
+            entry["name"],
+            entry.get("url"),
+            int(entry.get("capacity", default_capacity)),
+            bool(entry.get("draining", False)),
+        )
+        for entry in json.loads(spec)
+    ]
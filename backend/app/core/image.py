@@ -0,0 +1,110 @@
+"""
+Runtime image for user containers.
+
+The standard package set is installed into an image built from the runtime/
+directory instead of running pip in every new container. The image is tagged
+with a hash of its build context, so it is only rebuilt when the Dockerfile,
+the package manifest or the base image changes.
+"""
+
+import hashlib
+import os
+import threading
+
+import docker
+
+
+def manifest_hash(context_dir: str, base_image: str):
+    """Hash the files of the build context together with the base image."""
+    digest = hashlib.sha256(base_image.encode("utf-8"))
+    for root, dirs, files in os.walk(context_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, context_dir).encode("utf-8"))
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def manifest_packages(context_dir: str):
+    """Package specifiers listed in the runtime requirements file."""
+    packages = []
+    with open(os.path.join(context_dir, "requirements.txt")) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                packages.append(line)
+    return packages
+
+
+class RuntimeImage:
+    """Builds the runtime image once and reports which image to run."""
+
+    def __init__(self, client, context_dir: str, repository: str, base_image: str):
+        self._client = client
+        self.context_dir = context_dir
+        self.repository = repository
+        self.base_image = base_image
+        self.tag = f"{repository}:{manifest_hash(context_dir, base_image)}"
+        self.ready = False
+        self.built = False
+        self.error = None
+        # Failed attempts since the last success
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def ensure(self):
+        """Make sure the image for the current manifest exists, building it if needed.
+
+        Blocks while a build is running. Returns True when the image is usable.
+        """
+        with self._lock:
+            if self.ready:
+                return True
+
+            try:
+                self._client.images.get(self.tag)
+            except docker.errors.ImageNotFound:
+                print(f"Building runtime image {self.tag}...")
+                try:
+                    self._client.images.build(
+                        path=self.context_dir,
+                        tag=self.tag,
+                        buildargs={"BASE_IMAGE": self.base_image},
+                        rm=True,
+                    )
+                except Exception as e:
+                    self.error = str(e)
+                    self.failures += 1
+                    print(f"Error building runtime image: {str(e)}")
+                    return False
+                self.built = True
+                print(f"Runtime image {self.tag} built")
+            except Exception as e:
+                self.error = str(e)
+                self.failures += 1
+                print(f"Error looking up runtime image: {str(e)}")
+                return False
+
+            self.ready = True
+            self.error = None
+            self.failures = 0
+            return True
+
+    def retry_delay(self, initial: float, maximum: float):
+        """Seconds to wait before calling ensure() again after it failed.
+
+        initial after the first failure, doubling with each further one.
+        """
+        return min(maximum, initial * 2 ** max(0, self.failures - 1))
+
+    def snapshot(self):
+        """Current image state."""
+        return {
+            "tag": self.tag,
+            "ready": self.ready,
+            "built": self.built,
+            "error": self.error,
+            "failures": self.failures,
+        }
@@ -0,0 +1,84 @@
+"""
+Minimal inotify binding for watching workspace directories.
+
+Only what WorkspaceSync needs: one non-blocking inotify instance whose file
+descriptor is read from the event loop. Linux only; ``available`` is False
+elsewhere.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import struct
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# struct inotify_event without the trailing name
+_EVENT = struct.Struct("iIII")
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+available = hasattr(_libc, "inotify_init1")
+
+
+class Inotify:
+    """A non-blocking inotify instance."""
+
+    def __init__(self):
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            _raise_errno()
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path: str, mask: int):
+        """Watch path for the events in mask; returns the watch descriptor."""
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            _raise_errno(path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        # Fails harmlessly if the kernel already dropped the watch
+        _libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        """Pending events as (wd, mask, cookie, name) tuples; [] if none."""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _raise_errno(path: str = None):
+    errno = ctypes.get_errno()
+    raise OSError(errno, os.strerror(errno), path)
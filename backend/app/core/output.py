@@ -0,0 +1,151 @@
+"""
+Coalescing websocket writer for terminal output.
+
+Sending every output chunk as its own websocket frame costs a syscall and a
+frame header per chunk, and decoding each chunk separately breaks multibyte
+characters split across chunks. OutputWriter sends output as raw binary
+frames and groups chunks that arrive close together into one frame: the first
+chunk after a quiet period goes out immediately (keystroke echo stays
+instant), while a burst of output (e.g. cat on a large log) is collected for
+up to one time window or until the frame size limit is reached.
+"""
+
+import asyncio
+import codecs
+import collections
+import time
+
+# Longest time output is held back to be merged into a frame (seconds)
+FRAME_WINDOW = 0.008
+
+# Largest frame; a full buffer is sent immediately
+FRAME_MAX_BYTES = 64 * 1024
+
+# Seconds of history used for the frames per second metric
+RATE_WINDOW = 10
+
+frame_stats = {"frames": 0, "bytes": 0, "chunks": 0}
+_frames_per_second = collections.deque(maxlen=RATE_WINDOW)
+
+
+def _count_frame(size: int):
+    frame_stats["frames"] += 1
+    frame_stats["bytes"] += size
+
+    second = int(time.monotonic())
+    if _frames_per_second and _frames_per_second[-1][0] == second:
+        _frames_per_second[-1][1] += 1
+    else:
+        _frames_per_second.append([second, 1])
+
+
+def frame_snapshot():
+    """Frame counters plus recent frames per second and average frame size."""
+    now = int(time.monotonic())
+    recent = sum(
+        count for second, count in _frames_per_second if now - second < RATE_WINDOW
+    )
+    stats = dict(frame_stats)
+    stats["frames_per_second"] = round(recent / RATE_WINDOW, 2)
+    stats["bytes_per_frame"] = (
+        round(stats["bytes"] / stats["frames"], 1) if stats["frames"] else None
+    )
+    stats["chunks_per_frame"] = (
+        round(stats["chunks"] / stats["frames"], 2) if stats["frames"] else None
+    )
+    return stats
+
+
+class OutputWriter:
+    """Buffers terminal output and sends it to a websocket in coalesced frames.
+
+    With binary=False frames are sent as text, decoded with an incremental
+    UTF-8 decoder so characters split across chunks are kept intact. When a
+    scrollback buffer is given, everything written is also recorded there.
+    """
+
+    def __init__(
+        self,
+        websocket,
+        scrollback=None,
+        binary: bool = True,
+        window: float = FRAME_WINDOW,
+        max_bytes: int = FRAME_MAX_BYTES,
+    ):
+        self._websocket = websocket
+        self._scrollback = scrollback
+        self.window = window
+        self.max_bytes = max_bytes
+        self._decoder = (
+            None if binary else codecs.getincrementaldecoder("utf-8")("replace")
+        )
+        self._buffer = bytearray()
+        self._lock = asyncio.Lock()
+        self._last_send = 0.0
+        self._timer = None
+        self._pending = None
+
+    async def write(self, data: bytes):
+        """Queue output; sends right away when idle or when the frame is full."""
+        if not data:
+            return
+        frame_stats["chunks"] += 1
+        if self._scrollback is not None:
+            self._scrollback.append(data)
+        self._buffer += data
+
+        loop = asyncio.get_running_loop()
+        since_last = loop.time() - self._last_send
+        if len(self._buffer) >= self.max_bytes or since_last >= self.window:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window - since_last, self._flush_later)
+
+    def replay(self, data: bytes):
+        """Queue output the client missed, without recording it again.
+
+        Synchronous so that nothing else can be written in between reading
+        the scrollback and queueing it; call flush() afterwards.
+        """
+        self._buffer += data
+
+    async def flush(self):
+        """Send everything buffered so far as one frame."""
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._buffer:
+                return
+
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            if self._decoder is None:
+                await self._websocket.send_bytes(data)
+            else:
+                text = self._decoder.decode(data)
+                if not text:
+                    return
+                await self._websocket.send_text(text)
+
+            self._last_send = asyncio.get_running_loop().time()
+            _count_frame(len(data))
+
+    async def close(self):
+        """Flush remaining output and stop the flush timer."""
+        await self.flush()
+        if self._decoder is not None:
+            tail = self._decoder.decode(b"", final=True)
+            if tail:
+                await self._websocket.send_text(tail)
+
+    def _flush_later(self):
+        self._timer = None
+        self._pending = asyncio.ensure_future(self.flush())
+        self._pending.add_done_callback(_ignore_result)
+
+
+def _ignore_result(task):
+    # Send errors surface on the next write; a closed socket is handled there
+    if not task.cancelled():
+        task.exception()
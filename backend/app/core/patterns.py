@@ -0,0 +1,122 @@
+"""
+Regular expression matching with a deadline.
+
+Searches can filter files with a user-supplied regular expression. Python's
+re module cannot be interrupted, and a pattern such as (a+)+$ backtracks for
+longer than anyone will wait on a line of a few dozen characters, so user
+patterns are matched in worker processes. A match that is still running at
+its deadline has its worker killed and replaced; the search fails instead of
+keeping a CPU busy indefinitely.
+
+Workers are started on first use and reused. A search waits for a free one,
+within the same deadline.
+"""
+
+import multiprocessing
+import queue
+import threading
+import time
+
+from .config import SEARCH_REGEX_TIMEOUT, SEARCH_REGEX_WORKERS
+
+
+class PatternTimeout(Exception):
+    """Raised when matching a pattern does not finish by its deadline."""
+
+
+def first_matches(pattern, bodies: list):
+    """For each body, (line number, position of the match) of matching lines."""
+    results = []
+    for body in bodies:
+        lines = []
+        for number, line in enumerate(body.splitlines(), 1):
+            match = pattern.search(line)
+            if match:
+                lines.append((number, match.start()))
+        results.append(lines)
+    return results
+
+
+def _serve(connection):
+    while True:
+        try:
+            pattern, bodies = connection.recv()
+        except EOFError:
+            return
+        connection.send(first_matches(pattern, bodies))
+
+
+class PatternMatcher:
+    """Matches patterns in a fixed number of killable worker processes."""
+
+    def __init__(self, workers: int):
+        # Not fork: the server has threads whose locks the child would inherit
+        self._context = multiprocessing.get_context("spawn")
+        # Idle workers as (process, connection); None is one not started yet
+        self._idle = queue.Queue()
+        for _ in range(workers):
+            self._idle.put(None)
+        self._lock = threading.Lock()
+        self.stats = {"matched": 0, "timeouts": 0, "started": 0}
+
+    def match(self, pattern, bodies: list, deadline: float = None):
+        """first_matches(pattern, bodies), run in a worker. Blocking.
+
+        deadline is a time.monotonic() value, by default SEARCH_REGEX_TIMEOUT
+        seconds from now. Raises PatternTimeout when it passes first.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + SEARCH_REGEX_TIMEOUT
+        try:
+            worker = self._idle.get(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            self._count(timeouts=1)
+            raise PatternTimeout("No pattern worker became free in time")
+        try:
+            if worker is None:
+                worker = self._start()
+            process, connection = worker
+            connection.send((pattern, bodies))
+            if not connection.poll(max(0, deadline - time.monotonic())):
+                self._count(timeouts=1)
+                raise PatternTimeout("Matching the pattern took too long")
+            results = connection.recv()
+        except BaseException:
+            # The worker may still be matching, or be gone; replace it
+            if worker is not None:
+                self._stop(worker)
+            worker = None
+            raise
+        finally:
+            self._idle.put(worker)
+        self._count(matched=1)
+        return results
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def _start(self):
+        ours, theirs = self._context.Pipe()
+        process = self._context.Process(
+            target=_serve, args=(theirs,), name="pattern-worker", daemon=True
+        )
+        process.start()
+        theirs.close()
+        self._count(started=1)
+        return process, ours
+
+    @staticmethod
+    def _stop(worker):
+        process, connection = worker
+        process.kill()
+        process.join()
+        connection.close()
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+
+pattern_matcher = PatternMatcher(SEARCH_REGEX_WORKERS)
@@ -0,0 +1,253 @@
+"""
+Pre-warmed container pool.
+
+Starting a container (and installing its packages) takes far longer than a
+user is willing to wait for a prompt, so the pool keeps a few idle containers
+running in the background. Each pooled container has its own empty workspace
+directory bind-mounted at /workspace. When a session claims a container, the
+user's project files are moved into that directory and the directory is
+renamed to the project's path, so the running container ends up serving the
+user's workspace without being restarted.
+"""
+
+import asyncio
+import collections
+import os
+import shutil
+import threading
+import time
+import uuid
+
+
+def adopt_workspace(slot_dir: str, workspace_dir: str):
+    """Turn a pooled container's slot directory into a project workspace.
+
+    Bind mounts follow the directory inode, so renaming the slot directory to
+    the workspace path keeps it mounted inside the container. Any existing
+    project files are moved into the slot first.
+    """
+    os.makedirs(os.path.dirname(workspace_dir), exist_ok=True)
+
+    moved = []
+    try:
+        if os.path.isdir(workspace_dir):
+            for entry in os.listdir(workspace_dir):
+                os.rename(
+                    os.path.join(workspace_dir, entry), os.path.join(slot_dir, entry)
+                )
+                moved.append(entry)
+            os.rmdir(workspace_dir)
+        os.rename(slot_dir, workspace_dir)
+    except OSError:
+        # Put back whatever was already moved before giving up
+        os.makedirs(workspace_dir, exist_ok=True)
+        for entry in moved:
+            os.rename(os.path.join(slot_dir, entry), os.path.join(workspace_dir, entry))
+        raise
+
+
+class ContainerPool:
+    """Keeps a bounded number of idle containers ready to be claimed."""
+
+    def __init__(
+        self,
+        factory,
+        executor,
+        pool_dir: str,
+        min_size: int,
+        max_size: int,
+        refill_concurrency: int,
+        refill_interval: float,
+        shrink_after: float,
+    ):
+        # factory(slot_dir) starts a container with slot_dir mounted at /workspace
+        self._factory = factory
+        self._executor = executor
+        self._pool_dir = pool_dir
+        self.min_size = min_size
+        self.max_size = max(min_size, max_size)
+        self.refill_concurrency = max(1, refill_concurrency)
+        self.refill_interval = refill_interval
+        self.shrink_after = shrink_after
+
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+        self._warming = 0
+        self._target = min_size
+        self._last_miss = 0.0
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+
+        self.stats = {
+            "claims": 0,
+            "hits": 0,
+            "misses": 0,
+            "started": 0,
+            "failed": 0,
+            "last_claim_ms": None,
+            "total_claim_ms": 0.0,
+        }
+
+    def claim(self, workspace_dir: str):
+        """Take an idle container and bind it to workspace_dir.
+
+        Returns None when the pool is empty so the caller can fall back to a
+        cold start.
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                container, slot_dir = self._idle.popleft()
+
+            try:
+                container.reload()
+                if container.status != "running":
+                    raise RuntimeError(f"container status is {container.status}")
+            except Exception as e:
+                print(f"Discarding pooled container: {str(e)}")
+                self._discard(container, slot_dir)
+                continue
+
+            try:
+                adopt_workspace(slot_dir, workspace_dir)
+            except OSError as e:
+                print(f"Could not adopt workspace {workspace_dir}: {str(e)}")
+                self._discard(container, slot_dir)
+                break
+
+            self._notify()
+            return container
+
+        with self._lock:
+            self._target = min(self.max_size, self._target + 1)
+            self._last_miss = time.monotonic()
+        self._notify()
+        return None
+
+    def record_claim(self, seconds: float, hit: bool):
+        """Record how long it took to hand a session its container."""
+        ms = seconds * 1000
+        with self._lock:
+            self.stats["claims"] += 1
+            self.stats["hits" if hit else "misses"] += 1
+            self.stats["last_claim_ms"] = round(ms, 2)
+            self.stats["total_claim_ms"] += ms
+
+    def snapshot(self):
+        """Current pool state and counters."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["idle"] = len(self._idle)
+            stats["warming"] = self._warming
+            stats["target"] = self._target
+        claims = stats.pop("total_claim_ms")
+        stats["avg_claim_ms"] = (
+            round(claims / stats["claims"], 2) if stats["claims"] else None
+        )
+        return stats
+
+    def start(self):
+        """Start the background refill task on the running event loop."""
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._refill_loop())
+
+    async def shutdown(self):
+        """Stop refilling and stop every idle container."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+
+        await asyncio.gather(
+            *(
+                self._executor.run("stop", self._discard, container, slot_dir)
+                for container, slot_dir in idle
+            ),
+            return_exceptions=True,
+        )
+
+    def _notify(self):
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _refill_loop(self):
+        while True:
+            self._wakeup.clear()
+
+            with self._lock:
+                if (
+                    self._target > self.min_size
+                    and time.monotonic() - self._last_miss > self.shrink_after
+                ):
+                    self._target -= 1
+                deficit = self._target - len(self._idle) - self._warming
+                batch = max(0, min(deficit, self.refill_concurrency))
+                self._warming += batch
+
+                surplus = []
+                while len(self._idle) > self._target:
+                    surplus.append(self._idle.pop())
+
+            if surplus:
+                await asyncio.gather(
+                    *(
+                        self._executor.run("stop", self._discard, container, slot_dir)
+                        for container, slot_dir in surplus
+                    ),
+                    return_exceptions=True,
+                )
+
+            if batch:
+                started = await asyncio.gather(
+                    *(
+                        self._executor.run("create", self._warm_one)
+                        for _ in range(batch)
+                    ),
+                    return_exceptions=True,
+                )
+                if all(result is True for result in started):
+                    continue
+                # Back off instead of hammering an unhealthy Docker daemon
+                await asyncio.sleep(self.refill_interval)
+                continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.refill_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _warm_one(self):
+        slot_dir = os.path.join(self._pool_dir, uuid.uuid4().hex)
+        try:
+            os.makedirs(slot_dir)
+            os.chmod(slot_dir, 0o777)
+            container = self._factory(slot_dir)
+        except Exception as e:
+            print(f"Error starting pooled container: {str(e)}")
+            shutil.rmtree(slot_dir, ignore_errors=True)
+            with self._lock:
+                self._warming -= 1
+                self.stats["failed"] += 1
+            return False
+
+        with self._lock:
+            self._warming -= 1
+            self.stats["started"] += 1
+            self._idle.append((container, slot_dir))
+        return True
+
+    def _discard(self, container, slot_dir: str):
+        try:
+            container.stop()
+        except Exception as e:
+            print(f"Error stopping pooled container: {str(e)}")
+        # Only remove the slot if it was never adopted as a workspace
+        if os.path.isdir(slot_dir) and os.path.dirname(slot_dir) == self._pool_dir:
+            shutil.rmtree(slot_dir, ignore_errors=True)
@@ -0,0 +1,430 @@
+"""
+Session registry shared between backend worker processes.
+
+Each worker keeps its own per-session state (shell socket, scrollback, the
+attached websocket), but which container serves a user/project key has to be
+agreed on by all of them, or every uvicorn worker starts its own container for
+the same project. The registry records, per key, the container ID, the
+Docker host it runs on, its lifecycle state and how many websockets are
+attached across all workers.
+
+Exactly one worker wins the claim to create a key's container; the others
+wait for the container ID to be published and then attach to the same
+container. State changes (pause, unpause, stop) are compare-and-set, so only
+one worker performs each Docker call.
+
+Nothing a worker records outlives it for long. A claim whose container was
+never published can be taken over after its lease; a "pausing" state not
+moved on within pause_lease seconds (the pausing worker died, maybe after
+freezing the container) becomes "paused", so the next client unpauses it; and
+websocket counts are kept per worker, counting only while the worker renews
+them with heartbeat() at least every worker_lease seconds.
+
+LocalRegistry keeps the records in process memory (a single worker).
+SQLiteRegistry keeps them in a SQLite file that all workers on the host open.
+"""
+
+import collections
+import os
+import sqlite3
+import threading
+import time
+
+
+def worker_id():
+    """Identifies this worker process in claims."""
+    return f"{os.uname().nodename}:{os.getpid()}"
+
+
+class LocalRegistry:
+    """Registry for a single worker process."""
+
+    backend = "memory"
+
+    def __init__(self, pause_lease: float = 60.0):
+        self.pause_lease = pause_lease
+        self._records = {}
+        self._draining = set()
+        self._lock = threading.Lock()
+
+    def claim(self, key: str, owner: str, lease: float):
+        """Claim the right to create key's container.
+
+        Returns the record with "claimed" set to True if the caller must
+        create the container, or the existing record with "claimed" False.
+        A claim whose container was not published within lease seconds (its
+        worker died or failed) can be taken over.
+        """
+        now = time.time()
+        with self._lock:
+            record = self._current(key, now)
+            if record is None or (
+                record["container_id"] is None and record["updated"] + lease < now
+            ):
+                record = _new_record(key, owner, now)
+                self._records[key] = record
+                return dict(record, claimed=True)
+            return dict(record, claimed=False)
+
+    def assign(self, key: str, host: str, capacity: int = None):
+        """Record the host a claimed key's container is being created on.
+
+        Returns False, recording nothing, if host already has capacity
+        sessions: placements made together cannot overfill it.
+        """
+        with self._lock:
+            if capacity is not None and (
+                sum(
+                    1
+                    for other in self._records.values()
+                    if other["host"] == host and other["key"] != key
+                )
+                >= capacity
+            ):
+                return False
+            record = self._records.get(key)
+            if record is not None:
+                record["host"] = host
+            return True
+
+    def publish(self, key: str, container_id: str):
+        """Record the container created for a claimed key."""
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None:
+                record.update(container_id=container_id, state="active")
+                record["updated"] = time.time()
+
+    def lookup(self, key: str):
+        with self._lock:
+            record = self._current(key, time.time())
+            return dict(record) if record is not None else None
+
+    def transition(self, key: str, container_id: str, old: str, new: str):
+        """Move key from state old to new; False if it was not in state old."""
+        with self._lock:
+            record = self._current(key, time.time())
+            if (
+                record is None
+                or record["container_id"] != container_id
+                or record["state"] != old
+            ):
+                return False
+            record["state"] = new
+            record["updated"] = time.time()
+            return True
+
+    def add_connections(self, key: str, delta: int, worker: str):
+        """Change the number of websockets worker has attached to key."""
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None:
+                record["connections"] = max(0, record["connections"] + delta)
+
+    def heartbeat(self, worker: str):
+        """Renew worker's websocket counts; those of silent workers expire.
+
+        Nothing to do with a single worker, whose counts die with it.
+        """
+
+    def release(self, key: str, container_id: str = None):
+        """Remove key's record; False if it was already gone or replaced."""
+        with self._lock:
+            record = self._records.get(key)
+            if record is None or record["container_id"] != container_id:
+                return False
+            del self._records[key]
+            return True
+
+    def set_draining(self, host: str, draining: bool):
+        """Stop (or resume) placing new sessions on host, in every worker."""
+        with self._lock:
+            if draining:
+                self._draining.add(host)
+            else:
+                self._draining.discard(host)
+
+    def draining_hosts(self):
+        """Hosts drained with set_draining()."""
+        with self._lock:
+            return set(self._draining)
+
+    def host_loads(self):
+        """Number of sessions placed on each host."""
+        with self._lock:
+            return dict(
+                collections.Counter(
+                    record["host"]
+                    for record in self._records.values()
+                    if record["host"] is not None
+                )
+            )
+
+    def snapshot(self):
+        with self._lock:
+            states = [record["state"] for record in self._records.values()]
+        return _count_states(self.backend, states)
+
+    def _current(self, key: str, now: float):
+        record = self._records.get(key)
+        if _stale_pause(record, now, self.pause_lease):
+            record.update(state="paused", updated=now)
+        return record
+
+
+class SQLiteRegistry:
+    """Registry shared by all workers through a SQLite database file."""
+
+    backend = "sqlite"
+
+    def __init__(
+        self, path: str, pause_lease: float = 60.0, worker_lease: float = 60.0
+    ):
+        self.path = path
+        self.pause_lease = pause_lease
+        self.worker_lease = worker_lease
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sessions (
+                    key TEXT PRIMARY KEY,
+                    container_id TEXT,
+                    owner TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    connections INTEGER NOT NULL DEFAULT 0,
+                    updated REAL NOT NULL,
+                    host TEXT
+                )
+                """
+            )
+            columns = [row["name"] for row in db.execute("PRAGMA table_info(sessions)")]
+            if "host" not in columns:
+                db.execute("ALTER TABLE sessions ADD COLUMN host TEXT")
+            # sessions.connections is no longer used: websockets are counted
+            # per worker, and a worker's counts only while it is alive
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS connections (
+                    key TEXT NOT NULL,
+                    worker TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (key, worker)
+                )
+                """
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS workers "
+                "(worker TEXT PRIMARY KEY, seen REAL NOT NULL)"
+            )
+            db.execute("CREATE TABLE IF NOT EXISTS draining (host TEXT PRIMARY KEY)")
+
+    def claim(self, key: str, owner: str, lease: float):
+        now = time.time()
+        with self._connect() as db:
+            # Take the write lock up front so the check and the insert are atomic
+            db.execute("BEGIN IMMEDIATE")
+            record = self._select(db, key)
+            if record is None or (
+                record["container_id"] is None and record["updated"] + lease < now
+            ):
+                record = _new_record(key, owner, now)
+                db.execute(
+                    "INSERT OR REPLACE INTO sessions "
+                    "(key, container_id, owner, state, connections, updated, host) "
+                    "VALUES (:key, :container_id, :owner, :state, :connections, "
+                    ":updated, :host)",
+                    record,
+                )
+                return dict(record, claimed=True)
+            return dict(record, claimed=False)
+
+    def assign(self, key: str, host: str, capacity: int = None):
+        with self._connect() as db:
+            # Count and update under the write lock
+            db.execute("BEGIN IMMEDIATE")
+            if capacity is not None:
+                (load,) = db.execute(
+                    "SELECT COUNT(*) FROM sessions WHERE host = ? AND key != ?",
+                    (host, key),
+                ).fetchone()
+                if load >= capacity:
+                    return False
+            db.execute("UPDATE sessions SET host = ? WHERE key = ?", (host, key))
+            return True
+
+    def publish(self, key: str, container_id: str):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE sessions SET container_id = ?, state = 'active', updated = ? "
+                "WHERE key = ?",
+                (container_id, time.time(), key),
+            )
+
+    def lookup(self, key: str):
+        with self._connect() as db:
+            return self._select(db, key)
+
+    def transition(self, key: str, container_id: str, old: str, new: str):
+        with self._connect() as db:
+            cursor = db.execute(
+                "UPDATE sessions SET state = ?, updated = ? "
+                "WHERE key = ? AND container_id = ? AND state = ?",
+                (new, time.time(), key, container_id, old),
+            )
+            return cursor.rowcount == 1
+
+    def add_connections(self, key: str, delta: int, worker: str):
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "INSERT INTO connections (key, worker, count) "
+                "VALUES (?, ?, MAX(0, ?)) "
+                "ON CONFLICT (key, worker) DO UPDATE SET count = MAX(0, count + ?)",
+                (key, worker, delta, delta),
+            )
+            db.execute(
+                "DELETE FROM connections WHERE key = ? AND worker = ? AND count = 0",
+                (key, worker),
+            )
+            self._seen(db, worker)
+
+    def heartbeat(self, worker: str):
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            self._seen(db, worker)
+            # Workers that stopped renewing are gone, and so are their clients
+            expired = time.time() - self.worker_lease
+            db.execute(
+                "DELETE FROM connections WHERE worker IN "
+                "(SELECT worker FROM workers WHERE seen < ?)",
+                (expired,),
+            )
+            db.execute("DELETE FROM workers WHERE seen < ?", (expired,))
+
+    def release(self, key: str, container_id: str = None):
+        with self._connect() as db:
+            cursor = db.execute(
+                "DELETE FROM sessions WHERE key = ? AND container_id IS ?",
+                (key, container_id),
+            )
+            if cursor.rowcount == 1:
+                db.execute("DELETE FROM connections WHERE key = ?", (key,))
+                return True
+            return False
+
+    def set_draining(self, host: str, draining: bool):
+        with self._connect() as db:
+            if draining:
+                db.execute("INSERT OR IGNORE INTO draining (host) VALUES (?)", (host,))
+            else:
+                db.execute("DELETE FROM draining WHERE host = ?", (host,))
+
+    def draining_hosts(self):
+        with self._connect() as db:
+            return {row[0] for row in db.execute("SELECT host FROM draining")}
+
+    def host_loads(self):
+        with self._connect() as db:
+            return dict(
+                db.execute(
+                    "SELECT host, COUNT(*) FROM sessions "
+                    "WHERE host IS NOT NULL GROUP BY host"
+                ).fetchall()
+            )
+
+    def snapshot(self):
+        with self._connect() as db:
+            states = [row[0] for row in db.execute("SELECT state FROM sessions")]
+        return _count_states(self.backend, states)
+
+    def _connect(self):
+        # One connection per thread; the context manager commits or rolls back
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return _Transaction(db)
+
+    def _select(self, db, key: str):
+        row = db.execute("SELECT * FROM sessions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        record = dict(row)
+        now = time.time()
+        if _stale_pause(record, now, self.pause_lease):
+            # The pausing worker died; whoever resumes it unpauses it
+            db.execute(
+                "UPDATE sessions SET state = 'paused', updated = ? "
+                "WHERE key = ? AND state = 'pausing' AND updated = ?",
+                (now, key, record["updated"]),
+            )
+            record.update(state="paused", updated=now)
+        record["connections"] = db.execute(
+            "SELECT COALESCE(SUM(count), 0) FROM connections "
+            "JOIN workers USING (worker) WHERE key = ? AND seen >= ?",
+            (key, now - self.worker_lease),
+        ).fetchone()[0]
+        return record
+
+    @staticmethod
+    def _seen(db, worker: str):
+        db.execute(
+            "INSERT INTO workers (worker, seen) VALUES (?, ?) "
+            "ON CONFLICT (worker) DO UPDATE SET seen = excluded.seen",
+            (worker, time.time()),
+        )
+
+
+class _Transaction:
+    """Runs statements in autocommit mode unless BEGIN was issued."""
+
+    def __init__(self, db):
+        self._db = db
+
+    def __enter__(self):
+        return self._db
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._db.in_transaction:
+            self._db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def _new_record(key: str, owner: str, now: float):
+    return {
+        "key": key,
+        "container_id": None,
+        "owner": owner,
+        "state": "creating",
+        "connections": 0,
+        "updated": now,
+        "host": None,
+    }
+
+
+def _stale_pause(record, now: float, pause_lease: float):
+    return (
+        record is not None
+        and record["state"] == "pausing"
+        and record["updated"] + pause_lease < now
+    )
+
+
+def _count_states(backend: str, states: list):
+    counts = {"backend": backend, "sessions": len(states)}
+    for state in states:
+        counts[state] = counts.get(state, 0) + 1
+    return counts
+
+
+def create_registry(
+    backend: str, path: str, pause_lease: float = 60.0, worker_lease: float = 60.0
+):
+    """Registry for the SESSION_REGISTRY setting ("memory" or "sqlite")."""
+    if backend == "sqlite":
+        return SQLiteRegistry(path, pause_lease, worker_lease)
+    if backend == "memory":
+        return LocalRegistry(pause_lease)
+    raise ValueError(f"Unknown session registry backend: {backend}")
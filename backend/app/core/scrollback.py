@@ -0,0 +1,101 @@
+"""
+Per-session scrollback ring buffer.
+
+Every byte of terminal output a session produces is also written to a
+fixed-size ring buffer and numbered with an absolute offset. A client that
+loses its websocket reconnects with the session's resume token and the offset
+it had reached, and gets back only the bytes it missed (as long as they are
+still in the buffer). All buffers share one global memory budget.
+"""
+
+import threading
+
+
+class ScrollbackBudget:
+    """Global limit on the memory all scrollback buffers may use."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, size: int):
+        """Reserve up to size bytes; returns the amount actually granted."""
+        with self._lock:
+            granted = max(0, min(size, self.total - self.used))
+            self.used += granted
+            return granted
+
+    def release(self, size: int):
+        with self._lock:
+            self.used -= size
+
+    def snapshot(self):
+        with self._lock:
+            return {"total": self.total, "used": self.used}
+
+
+class Scrollback:
+    """Ring buffer of the most recent `capacity` bytes of output.
+
+    The buffer grows on demand up to its capacity and then wraps around, so
+    idle sessions do not hold their full reservation.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buf = bytearray()
+        # Absolute offset of the byte after the last one written
+        self.end = 0
+
+    @property
+    def start(self):
+        """Offset of the oldest byte still held."""
+        return max(0, self.end - self.capacity)
+
+    def append(self, data: bytes):
+        size = len(data)
+        if not self.capacity:
+            self.end += size
+            return
+
+        if size >= self.capacity:
+            # Only the tail fits; lay it out so that it ends at the new end
+            data = data[-self.capacity :]
+            self.end += size
+            pos = self.end % self.capacity
+            self._buf = bytearray(data[-pos:] + data[:-pos] if pos else data)
+            return
+
+        if len(self._buf) < self.capacity:
+            # Still growing: the buffer is linear and its length equals end
+            head = data[: self.capacity - len(self._buf)]
+            self._buf += head
+            self.end += len(head)
+            data = data[len(head) :]
+
+        if data:
+            self._write_at(self.end % self.capacity, data)
+            self.end += len(data)
+
+    def read_from(self, offset: int):
+        """Bytes written since offset, and the offset they actually start at.
+
+        If offset is older than what the buffer still holds, the returned
+        data starts at the oldest byte available.
+        """
+        offset = min(max(offset, self.start), self.end)
+        size = self.end - offset
+        if not size:
+            return offset, b""
+
+        pos = offset % self.capacity
+        first = self._buf[pos : pos + size]
+        rest = self._buf[: size - len(first)]
+        return offset, bytes(first + rest)
+
+    def _write_at(self, pos: int, data: bytes):
+        first = min(len(data), self.capacity - pos)
+        self._buf[pos : pos + first] = data[:first]
+        if first < len(data):
+            self._buf[: len(data) - first] = data[first:]
@@ -0,0 +1,95 @@
+"""
+Persistent PTY shell attached to a session's container.
+
+Instead of starting a new exec for every command, a single interactive bash
+is started with a TTY and its exec socket is kept open for the lifetime of
+the session. Bytes typed in the browser are written to the socket as they
+arrive and the shell's output is read back as raw bytes, so shell state
+(cwd, variables, jobs) survives between commands and Ctrl-C and resizes work
+like in a local terminal.
+"""
+
+import asyncio
+import socket
+
+# Bytes read from the shell per websocket frame
+PTY_READ_SIZE = 65536
+
+
+class PtyShell:
+    """An interactive bash running under a TTY in a container."""
+
+    def __init__(self, api, exec_id: str, sock):
+        self._api = api
+        self.exec_id = exec_id
+        # docker-py wraps the attach socket; reads and writes go to the raw one
+        self._sock = getattr(sock, "_sock", sock)
+        # Plain sockets are driven by the event loop directly. Others (e.g. TLS
+        # connections to a remote daemon) fall back to blocking calls on a thread.
+        self._native = type(self._sock) is socket.socket
+        if self._native:
+            self._sock.setblocking(False)
+        self.closed = False
+
+    @classmethod
+    def open(cls, api, container_id: str, environment: dict, rows: int, cols: int):
+        """Start the shell. Blocking; run it through the Docker executor."""
+        exec_id = api.exec_create(
+            container_id,
+            ["/bin/bash", "-l"],
+            stdin=True,
+            tty=True,
+            environment=environment,
+            workdir="/workspace",
+        )["Id"]
+        sock = api.exec_start(exec_id, tty=True, socket=True)
+        shell = cls(api, exec_id, sock)
+        shell.resize(rows, cols)
+        return shell
+
+    async def read(self):
+        """Read the next chunk of output. Returns b"" once the shell has exited."""
+        if self.closed:
+            return b""
+        try:
+            if self._native:
+                return await asyncio.get_running_loop().sock_recv(
+                    self._sock, PTY_READ_SIZE
+                )
+            return await asyncio.to_thread(self._sock.recv, PTY_READ_SIZE)
+        except OSError:
+            return b""
+
+    async def write(self, data: bytes):
+        """Send input to the shell."""
+        if self._native:
+            await asyncio.get_running_loop().sock_sendall(self._sock, data)
+        else:
+            await asyncio.to_thread(self._sock.sendall, data)
+
+    async def interrupt(self):
+        """Send Ctrl-C; the TTY turns it into SIGINT for the foreground job."""
+        await self.write(b"\x03")
+
+    def resize(self, rows: int, cols: int):
+        """Change the TTY size. Blocking."""
+        self._api.exec_resize(self.exec_id, height=rows, width=cols)
+
+    def is_running(self):
+        """Whether the shell process is still alive. Blocking."""
+        if self.closed:
+            return False
+        try:
+            return self._api.exec_inspect(self.exec_id)["Running"]
+        except Exception:
+            return False
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
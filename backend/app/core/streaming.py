@@ -0,0 +1,165 @@
+"""
+Bounded bridge between blocking Docker output streams and async consumers.
+
+A reader thread pulls chunks from a blocking iterator (for example an
+ExecOutput reading an exec's attach socket) and hands them to the event loop
+through a bounded queue. When the consumer is slow, e.g. a websocket client on
+a bad connection, the queue fills up and the reader thread waits instead of
+buffering output in memory without limit.
+"""
+
+import asyncio
+import concurrent.futures
+import socket
+import threading
+
+from docker.utils.socket import demux_adaptor, frames_iter
+
+# readers is the number of reader threads still running
+stream_stats = {"streams": 0, "readers": 0, "chunks": 0, "bytes": 0, "throttled": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            stream_stats[key] += value
+
+
+def _chunk_size(chunk):
+    if isinstance(chunk, tuple):
+        return sum(len(part) for part in chunk if part)
+    return len(chunk) if chunk else 0
+
+
+def _close(stream):
+    close = getattr(stream, "close", None)
+    if close is not None:
+        close()
+
+
+def _cancel(stream):
+    cancel = getattr(stream, "cancel", None)
+    if cancel is None:
+        return
+    try:
+        cancel()
+    except Exception as e:
+        # Never hide the error that made the pump stop
+        print(f"Error cancelling stream: {e}")
+
+
+class ExecOutput:
+    """Demultiplexed output of a non-TTY exec, read from its attach socket.
+
+    Iterating yields (stdout, stderr) tuples like exec_start(demux=True).
+    Unlike the generator that exec_start(stream=True) returns, the stream can
+    be cancelled from another thread: cancel() shuts the socket down, which
+    ends a read that is blocked waiting for output.
+    """
+
+    def __init__(self, sock):
+        # docker-py wraps the attach socket; shut down and close the raw one
+        self._sock = getattr(sock, "_sock", sock)
+        self._frames = frames_iter(self._sock, tty=False)
+
+    def __iter__(self):
+        for frame in self._frames:
+            yield demux_adaptor(*frame)
+
+    def cancel(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        self.cancel()
+        self._sock.close()
+
+
+async def pump(executor, op: str, open_stream, on_chunk, queue_size: int):
+    """Feed chunks from a blocking stream to an async callback.
+
+    open_stream() is run through executor as operation op and must return an
+    iterator of chunks. The stream is then read on a thread of its own rather
+    than the executor's: a command may run for hours (a dev server, tail -f)
+    without hitting op's timeout or holding one of its concurrency slots. The
+    stream's close(), if any, is called on that thread once reading ends. A
+    cancel() that may be called from another thread (like ExecOutput's) lets a
+    pump that stops early, because it was cancelled or on_chunk raised, wake a
+    reader blocked waiting for output; without one the reader stops at the
+    next chunk. Each chunk is passed to
+    ``await on_chunk(chunk)`` on the event loop, in order. At most queue_size
+    chunks are buffered between the two.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    stream = await executor.run(op, open_stream)
+    reader = loop.create_future()
+
+    def finish(error):
+        if reader.done():
+            return
+        if error is None:
+            reader.set_result(None)
+        else:
+            reader.set_exception(error)
+
+    def read():
+        error = None
+        try:
+            for chunk in stream:
+                if stop.is_set():
+                    return
+                if queue.full():
+                    _count(throttled=1)
+
+                put = asyncio.run_coroutine_threadsafe(queue.put(chunk), loop)
+                while True:
+                    try:
+                        put.result(timeout=0.5)
+                        break
+                    except concurrent.futures.TimeoutError:
+                        if stop.is_set():
+                            put.cancel()
+                            return
+        except Exception as e:
+            error = e
+        finally:
+            _close(stream)
+            _count(readers=-1)
+            try:
+                loop.call_soon_threadsafe(finish, error)
+            except RuntimeError:
+                # The loop is already closed; nothing is waiting on it
+                pass
+
+    _count(streams=1, readers=1)
+    threading.Thread(target=read, name="stream-reader", daemon=True).start()
+    try:
+        while True:
+            get = asyncio.ensure_future(queue.get())
+            await asyncio.wait({get, reader}, return_when=asyncio.FIRST_COMPLETED)
+            if not get.done():
+                get.cancel()
+                break
+            chunk = get.result()
+            _count(chunks=1, bytes=_chunk_size(chunk))
+            await on_chunk(chunk)
+
+        # The reader is finished; deliver whatever it queued before exiting
+        while not queue.empty():
+            chunk = queue.get_nowait()
+            _count(chunks=1, bytes=_chunk_size(chunk))
+            await on_chunk(chunk)
+
+        await reader
+    finally:
+        stop.set()
+        if not reader.done():
+            # Wakes the reader thread if it is blocked waiting for output.
+            # Only the reader closes the stream: a generator cannot be closed
+            # while another thread is inside next()
+            _cancel(stream)
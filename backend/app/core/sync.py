@@ -0,0 +1,791 @@
+"""
+Two-way sync between the files table and project workspaces.
+
+The editor works on rows of the files table (bodies in the blob store), the
+terminal on DATA_DIR/<user>/<project>, which the container sees as /workspace.
+WorkspaceSync keeps the two in step incrementally, in both directions:
+
+- Database to workspace: the file repositories write every committed change
+  through to the workspace (write_through).
+- Workspace to database: while a project has a session, its workspace is
+  watched with inotify. Changed paths are debounced, hashed into the blob store
+  and written to the database in one transaction per batch, then published
+  to the project's change feed (core/changes.py).
+
+Each row records the mtime of its workspace copy when the two last matched
+(files.synced_mtime_ns). Events caused by our own writes match it and are
+ignored, and when a watch starts only files whose mtime differs are read, so
+neither side is ever rescanned in full. A file changed on both sides since it
+was last in sync is a conflict: the incoming change wins and the other version
+is kept next to it as "<name>.conflict", which is then synced like any file.
+
+inotify only sees changes made through this machine's kernel, so workspaces of
+containers on remote Docker hosts are synced from the database side only.
+"""
+
+import asyncio
+import hashlib
+import os
+import stat
+import tempfile
+import threading
+import uuid
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from ..db import models, search
+from ..db.database import SessionLocal
+from . import inotify
+from .blobs import CHUNK_SIZE, blob_store
+from .changes import deleted_event, file_changes, file_event
+from .config import (
+    DATA_DIR,
+    SYNC_DEBOUNCE,
+    SYNC_IGNORE,
+    SYNC_MAX_DELAY,
+    SYNC_MAX_FILE_SIZE,
+    WORKSPACE_SYNC,
+)
+
+# Directory events that can change which files exist or what they hold
+WATCH_MASK = (
+    inotify.IN_CLOSE_WRITE
+    | inotify.IN_CREATE
+    | inotify.IN_DELETE
+    | inotify.IN_MOVED_FROM
+    | inotify.IN_MOVED_TO
+    | inotify.IN_ONLYDIR
+    | inotify.IN_DONT_FOLLOW
+)
+
+# Temporary files of write-throughs; renamed into place, never synced
+TMP_PREFIX = ".sync-"
+
+EMPTY_HASH = hashlib.sha256(b"").hexdigest()
+
+# Paths per IN (...) query when loading rows for a batch
+QUERY_BATCH_SIZE = 500
+
+
+def workspace_relpath(path: str):
+    """A file row's path relative to the workspace, or None if it would escape."""
+    rel = os.path.normpath(path.strip("/"))
+    if rel in ("", ".") or rel == ".." or rel.startswith("../"):
+        return None
+    return rel
+
+
+def _under(rel: str, prefix: str):
+    return prefix == "" or rel == prefix or rel.startswith(prefix + "/")
+
+
+def _file_hash(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class WorkspaceSync:
+    """Syncs file rows and workspace files of each project."""
+
+    def __init__(
+        self,
+        data_dir: str,
+        debounce: float = 0.5,
+        max_delay: float = 2.0,
+        max_file_size: int = 50 * 1024 * 1024,
+        ignore: tuple = (),
+        enabled: bool = True,
+    ):
+        self.data_dir = data_dir
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.max_file_size = max_file_size
+        self.ignore = set(ignore)
+        self.enabled = enabled
+        self._inotify = None
+        self._loop = None
+        self._lock = threading.Lock()
+        # Watched projects: project ID -> {"root", "state", "wds"}, where state
+        # maps relative paths to their (mtime_ns, hash) when last in sync
+        self._projects = {}
+        # Watch descriptor -> (project ID, directory relative to the workspace)
+        self._watches = {}
+        # Project ID -> relative paths with events since the last flush
+        self._pending = {}
+        # Project ID -> {row path: mtime_ns} of write-throughs to record
+        self._synced = {}
+        # Project ID -> [debounce timer, loop time of the first pending change]
+        self._timers = {}
+        self._flushing = set()
+        self.stats = {
+            "events": 0,
+            "flushes": 0,
+            "to_database": 0,
+            "to_workspace": 0,
+            "conflicts": 0,
+            "skipped": 0,
+            "errors": 0,
+        }
+
+    def workspace_dir(self, user_id: str, project_id: str):
+        return os.path.join(self.data_dir, user_id, project_id)
+
+    def start(self):
+        """Start receiving workspace events on the running loop."""
+        self._loop = asyncio.get_running_loop()
+        if not self.enabled:
+            return
+        if not inotify.available:
+            print("inotify is not available; workspaces are synced one way only")
+            return
+        self._inotify = inotify.Inotify()
+        self._loop.add_reader(self._inotify.fileno(), self._on_events)
+
+    async def stop(self):
+        """Flush pending changes and stop watching."""
+        if self._inotify is not None:
+            self._loop.remove_reader(self._inotify.fileno())
+        for timer, _ in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for project_id in set(self._pending) | set(self._synced):
+            paths = self._pending.pop(project_id, set())
+            with self._lock:
+                synced = self._synced.pop(project_id, {})
+            await asyncio.to_thread(self._flush, project_id, paths, synced)
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        # Later write-throughs record their mtimes synchronously
+        self._loop = None
+
+    async def watch(self, user_id: str, project_id: str):
+        """Watch a project's workspace while it has a session.
+
+        Files edited or added while it was not watched are picked up first;
+        files missing from it are written back from the database.
+        """
+        if self._inotify is None:
+            return
+        with self._lock:
+            if project_id in self._projects:
+                return
+            self._projects[project_id] = {
+                "root": self.workspace_dir(user_id, project_id),
+                "state": {},
+                "wds": set(),
+            }
+        try:
+            await asyncio.to_thread(self._start_watch, user_id, project_id)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Could not watch workspace of project {project_id}: {e}")
+
+    def unwatch(self, project_id: str):
+        """Stop watching a project's workspace. Thread-safe."""
+        with self._lock:
+            project = self._projects.pop(project_id, None)
+            if project is None:
+                return
+            for wd in project["wds"]:
+                self._watches.pop(wd, None)
+        if self._inotify is not None:
+            for wd in project["wds"]:
+                self._inotify.rm_watch(wd)
+
+    def write_through(self, user_id: str, project_id: str, changes: list):
+        """Apply committed file changes to the project's workspace. Blocking.
+
+        changes holds ("write", path, content_hash), ("mkdir", path),
+        ("delete", path) and ("move", old_path, new_path) tuples. Failures are
+        logged rather than raised; the database stays the source of truth.
+        """
+        if not self.enabled:
+            return
+        root = self.workspace_dir(user_id, project_id)
+        written = False
+        for change in changes:
+            try:
+                synced = self._apply(root, project_id, change)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Could not sync {change[1]} to the workspace: {e}")
+                continue
+            if synced:
+                # The new mtimes are recorded in the database with the next
+                # batch; until then later changes check against them here
+                with self._lock:
+                    self._synced.setdefault(project_id, {}).update(synced)
+                written = True
+        if not written:
+            return
+
+        if self._loop is None:
+            with self._lock:
+                synced = self._synced.pop(project_id, {})
+            self._flush(project_id, set(), synced)
+        else:
+            self._loop.call_soon_threadsafe(self._arm, project_id)
+
+    def snapshot(self):
+        with self._lock:
+            watched = len(self._projects)
+            watches = len(self._watches)
+        return dict(
+            self.stats,
+            enabled=self.enabled and self._inotify is not None,
+            watched=watched,
+            watches=watches,
+            pending=sum(len(paths) for paths in self._pending.values()),
+        )
+
+    # Database to workspace
+
+    def _apply(self, root: str, project_id: str, change: tuple):
+        kind, path = change[0], change[1]
+        rel = workspace_relpath(path)
+        if rel is None:
+            return {}
+        target = os.path.join(root, rel)
+
+        if kind == "mkdir":
+            os.makedirs(target, exist_ok=True)
+            return {}
+
+        if kind == "write":
+            content_hash = change[2] or EMPTY_HASH
+            self._set_aside_unsynced(project_id, rel, path, target, content_hash)
+            mtime = self._write_file(target, change[2])
+            self._remember(project_id, rel, (mtime, content_hash))
+            self.stats["to_workspace"] += 1
+            return {path: mtime}
+
+        if kind == "delete":
+            if os.path.isdir(target) and not os.path.islink(target):
+                try:
+                    os.rmdir(target)
+                except OSError:
+                    # Files the database does not know about are left alone
+                    pass
+            elif not self._set_aside_unsynced(project_id, rel, path, target, None):
+                try:
+                    os.unlink(target)
+                except FileNotFoundError:
+                    pass
+            self._forget(project_id, rel)
+            self.stats["to_workspace"] += 1
+            return {}
+
+        if kind == "move":
+            new_rel = workspace_relpath(change[2])
+            if new_rel is None:
+                return {}
+            new_target = os.path.join(root, new_rel)
+            if not os.path.lexists(target):
+                return {}
+            if os.path.lexists(new_target):
+                # Only a file the database does not know about can be here
+                os.replace(new_target, new_target + ".conflict")
+                self.stats["conflicts"] += 1
+            os.makedirs(os.path.dirname(new_target), exist_ok=True)
+            os.rename(target, new_target)
+            self._move_state(project_id, rel, new_rel, change[1], change[2])
+            self.stats["to_workspace"] += 1
+            return {}
+
+        raise ValueError(f"Unknown workspace change: {kind}")
+
+    def _set_aside_unsynced(
+        self, project_id: str, rel: str, path: str, target: str, content_hash
+    ):
+        """Keep a workspace file changed since its last sync as <name>.conflict.
+
+        Returns True if the file was set aside. A file that already holds
+        content_hash is not a conflict.
+        """
+        try:
+            st = os.lstat(target)
+        except FileNotFoundError:
+            return False
+        if not stat.S_ISREG(st.st_mode):
+            return False
+
+        with self._lock:
+            project = self._projects.get(project_id)
+            known = project["state"].get(rel) if project is not None else None
+            # Recorded by a write-through whose batch is not flushed yet
+            synced_mtime = self._synced.get(project_id, {}).get(path)
+        if known is not None:
+            synced_mtime = known[0]
+        elif synced_mtime is None:
+            db = SessionLocal()
+            try:
+                synced_mtime = (
+                    db.query(models.File.synced_mtime_ns)
+                    .filter(
+                        models.File.project_id == project_id, models.File.path == path
+                    )
+                    .scalar()
+                )
+            finally:
+                db.close()
+        if synced_mtime == st.st_mtime_ns:
+            return False
+        if content_hash is not None and _file_hash(target) == content_hash:
+            return False
+
+        os.replace(target, target + ".conflict")
+        self.stats["conflicts"] += 1
+        print(f"Sync conflict on {target}; workspace copy kept as .conflict")
+        return True
+
+    def _write_file(self, target: str, content_hash):
+        """Write a blob to target atomically; returns the new mtime."""
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=TMP_PREFIX, dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if content_hash is not None:
+                    for chunk in blob_store.iter_chunks(content_hash):
+                        f.write(chunk)
+            # Writable by the container's user, like the rest of the workspace
+            os.chmod(tmp_path, 0o666)
+            os.replace(tmp_path, target)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return os.stat(target).st_mtime_ns
+
+    # project["state"] is read and written by the inotify handler, flushes in
+    # worker threads and write-throughs; every access holds self._lock
+
+    def _known(self, project: dict, rel: str):
+        """The (mtime_ns, hash) of rel when last in sync, or None."""
+        with self._lock:
+            return project["state"].get(rel)
+
+    def _remember(self, project_id: str, rel: str, state: tuple):
+        with self._lock:
+            project = self._projects.get(project_id)
+            if project is not None:
+                project["state"][rel] = state
+
+    def _forget(self, project_id: str, rel: str):
+        with self._lock:
+            project = self._projects.get(project_id)
+            if project is not None:
+                for known in [k for k in project["state"] if _under(k, rel)]:
+                    del project["state"][known]
+
+    def _move_state(
+        self, project_id: str, rel: str, new_rel: str, path: str, new_path: str
+    ):
+        with self._lock:
+            # Unflushed mtimes are keyed by row path, which moved with the row
+            synced = self._synced.get(project_id, {})
+            for known in [k for k in synced if _under(k, path)]:
+                synced[new_path + known[len(path) :]] = synced.pop(known)
+            project = self._projects.get(project_id)
+            if project is None:
+                return
+            state = project["state"]
+            for known in [k for k in state if _under(k, rel)]:
+                state[new_rel + known[len(rel) :]] = state.pop(known)
+
+    # Workspace to database
+
+    def _start_watch(self, user_id: str, project_id: str):
+        project = self._projects[project_id]
+        root = project["root"]
+        os.makedirs(root, exist_ok=True)
+
+        db = SessionLocal()
+        try:
+            rows = (
+                db.query(
+                    models.File.path,
+                    models.File.is_directory,
+                    models.File.content_hash,
+                    models.File.synced_mtime_ns,
+                )
+                .filter(models.File.project_id == project_id)
+                .all()
+            )
+        finally:
+            db.close()
+
+        # Files missing from the workspace are written to it from the
+        # database, whether they were never synced or the workspace was
+        # emptied, unmounted or recreated. Only delete events seen while
+        # watching delete rows; the database is the source of truth.
+        missing = []
+        with self._lock:
+            unflushed = dict(self._synced.get(project_id, {}))
+        for path, is_directory, content_hash, synced_mtime in rows:
+            synced_mtime = unflushed.get(path, synced_mtime)
+            rel = workspace_relpath(path)
+            if rel is None:
+                continue
+            if is_directory:
+                missing.append(("mkdir", path))
+                continue
+            if not os.path.lexists(os.path.join(root, rel)):
+                missing.append(("write", path, content_hash))
+            elif synced_mtime is not None:
+                with self._lock:
+                    project["state"][rel] = (synced_mtime, content_hash or EMPTY_HASH)
+        if missing:
+            self.write_through(user_id, project_id, missing)
+
+        changed = self._watch_tree(project_id, project, "")
+        if changed:
+            self._loop.call_soon_threadsafe(self._enqueue, project_id, changed)
+
+    def _watch_tree(self, project_id: str, project: dict, rel_dir: str):
+        """Watch rel_dir and the directories below it. Blocking.
+
+        Returns the files under it whose mtime differs from their last sync.
+        """
+        root = project["root"]
+        changed = set()
+        for dirpath, dirnames, filenames in os.walk(os.path.join(root, rel_dir)):
+            dirnames[:] = [name for name in dirnames if name not in self.ignore]
+            rel = os.path.relpath(dirpath, root)
+            rel = "" if rel == "." else rel
+            try:
+                wd = self._inotify.add_watch(dirpath, WATCH_MASK)
+            except OSError:
+                continue
+            with self._lock:
+                if self._projects.get(project_id) is not project:
+                    # Unwatched meanwhile
+                    self._inotify.rm_watch(wd)
+                    return set()
+                self._watches[wd] = (project_id, rel)
+                project["wds"].add(wd)
+
+            for name in filenames:
+                if name.startswith(TMP_PREFIX):
+                    continue
+                file_rel = os.path.join(rel, name) if rel else name
+                try:
+                    st = os.lstat(os.path.join(dirpath, name))
+                except FileNotFoundError:
+                    continue
+                known = self._known(project, file_rel)
+                if stat.S_ISREG(st.st_mode) and (
+                    known is None or known[0] != st.st_mtime_ns
+                ):
+                    changed.add(file_rel)
+        return changed
+
+    def _drop_watches(self, project: dict, rel: str):
+        with self._lock:
+            wds = [
+                wd
+                for wd in project["wds"]
+                if wd in self._watches and _under(self._watches[wd][1], rel)
+            ]
+            for wd in wds:
+                del self._watches[wd]
+                project["wds"].discard(wd)
+        for wd in wds:
+            self._inotify.rm_watch(wd)
+
+    def _on_events(self):
+        """Queue the paths named by pending inotify events. Runs on the loop."""
+        for wd, mask, _, name in self._inotify.read():
+            if mask & inotify.IN_Q_OVERFLOW:
+                # Events were dropped; look at every watched workspace again
+                with self._lock:
+                    project_ids = list(self._projects)
+                for project_id in project_ids:
+                    self._enqueue(project_id, {""})
+                continue
+            if mask & inotify.IN_IGNORED:
+                with self._lock:
+                    watch = self._watches.pop(wd, None)
+                    project = self._projects.get(watch[0]) if watch else None
+                    if project is not None:
+                        project["wds"].discard(wd)
+                continue
+
+            watch = self._watches.get(wd)
+            if watch is None or not name:
+                continue
+            if name.startswith(TMP_PREFIX) or name in self.ignore:
+                continue
+            project_id, rel_dir = watch
+            self.stats["events"] += 1
+            self._enqueue(
+                project_id, {os.path.join(rel_dir, name) if rel_dir else name}
+            )
+
+    def _enqueue(self, project_id: str, paths: set):
+        self._pending.setdefault(project_id, set()).update(paths)
+        self._arm(project_id)
+
+    def _arm(self, project_id: str):
+        """(Re)start project_id's debounce timer. Runs on the loop.
+
+        A batch is flushed once no change arrived for debounce seconds, but no
+        later than max_delay after its first change.
+        """
+        now = self._loop.time()
+        timer = self._timers.get(project_id)
+        if timer is None:
+            first = now
+        else:
+            timer[0].cancel()
+            first = timer[1]
+        delay = min(self.debounce, max(first + self.max_delay - now, 0))
+        handle = self._loop.call_later(delay, self._fire, project_id)
+        self._timers[project_id] = [handle, first]
+
+    def _fire(self, project_id: str):
+        self._timers.pop(project_id, None)
+        if project_id in self._flushing:
+            # Picked up again when the running flush finishes
+            return
+        paths = self._pending.pop(project_id, set())
+        with self._lock:
+            synced = self._synced.pop(project_id, {})
+        if not paths and not synced:
+            return
+
+        self._flushing.add(project_id)
+        task = self._loop.create_task(
+            asyncio.to_thread(self._flush, project_id, paths, synced)
+        )
+        task.add_done_callback(lambda _: self._flushed(project_id))
+
+    def _flushed(self, project_id: str):
+        self._flushing.discard(project_id)
+        if self._pending.get(project_id) or self._synced.get(project_id):
+            self._arm(project_id)
+
+    def _flush(self, project_id: str, paths: set, synced: dict):
+        """Write one batch of changes to the database. Blocking."""
+        try:
+            project = self._projects.get(project_id)
+            changes = {}
+            if project is not None and paths:
+                changes = self._collect(project_id, project, paths)
+            if changes or synced:
+                self._commit(project_id, project, changes, synced)
+                self.stats["flushes"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Workspace sync of project {project_id} failed: {e}")
+
+    def _collect(self, project_id: str, project: dict, paths: set):
+        """Work out what changed at paths. Returns {relative path: change}.
+
+        Changes are ("upsert", hash, size, mtime_ns), ("touched", mtime_ns)
+        for a new mtime with the same content, and ("delete",).
+        """
+        root = project["root"]
+        changes = {}
+        files = set()
+        for rel in paths:
+            try:
+                st = os.lstat(os.path.join(root, rel))
+            except FileNotFoundError:
+                st = None
+            if st is None or stat.S_ISDIR(st.st_mode):
+                # Files that were under a removed (or rescanned) directory
+                with self._lock:
+                    known_paths = list(project["state"])
+                for known in known_paths:
+                    if _under(known, rel) and not os.path.lexists(
+                        os.path.join(root, known)
+                    ):
+                        changes[known] = ("delete",)
+            if st is None:
+                self._drop_watches(project, rel)
+            elif stat.S_ISDIR(st.st_mode):
+                files |= self._watch_tree(project_id, project, rel)
+            elif stat.S_ISREG(st.st_mode):
+                files.add(rel)
+
+        for rel in files:
+            change = self._read_file(project, rel)
+            if change is not None:
+                changes[rel] = change
+        return changes
+
+    def _read_file(self, project: dict, rel: str):
+        """Hash a changed workspace file into the blob store."""
+        path = os.path.join(project["root"], rel)
+        known = self._known(project, rel)
+        try:
+            st = os.lstat(path)
+            if not stat.S_ISREG(st.st_mode):
+                return None
+            if known is not None and known[0] == st.st_mtime_ns:
+                # Our own write-through, or nothing changed
+                return None
+            if st.st_size > self.max_file_size:
+                self.stats["skipped"] += 1
+                return None
+            writer = blob_store.writer()
+            try:
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                        writer.write(chunk)
+                content_hash, size = writer.commit()
+            except BaseException:
+                writer.abort()
+                raise
+        except FileNotFoundError:
+            # Deleted meanwhile; its own event follows
+            return None
+        if known is not None and known[1] == content_hash:
+            return ("touched", st.st_mtime_ns)
+        return ("upsert", content_hash, size, st.st_mtime_ns)
+
+    def _commit(self, project_id: str, project, changes: dict, synced: dict):
+        db = SessionLocal()
+        try:
+            for attempt in range(2):
+                try:
+                    state, changed = self._apply_to_database(
+                        db, project_id, project, changes, synced
+                    )
+                    db.commit()
+                    break
+                except IntegrityError:
+                    # Another worker created one of the files first
+                    db.rollback()
+                    if attempt:
+                        raise
+
+            # Load the versions the updates incremented, in one query per batch
+            modified = [row.id for kind, row in changed if kind == "modified"]
+            for start in range(0, len(modified), QUERY_BATCH_SIZE):
+                db.query(models.File).filter(
+                    models.File.id.in_(modified[start : start + QUERY_BATCH_SIZE])
+                ).all()
+            events = [
+                deleted_event(*row) if kind == "deleted" else file_event(kind, row)
+                for kind, row in changed
+            ]
+        finally:
+            db.close()
+        file_changes.publish(project_id, events)
+
+        if project is not None:
+            with self._lock:
+                for rel, known in state.items():
+                    if known is None:
+                        project["state"].pop(rel, None)
+                    else:
+                        project["state"][rel] = known
+
+    def _apply_to_database(
+        self, db, project_id: str, project, changes: dict, synced: dict
+    ):
+        """Stage one batch in db's transaction.
+
+        Returns the new sync state and the changes made, as (kind, row) pairs.
+        """
+        rows = {}
+        candidates = [path for rel in changes for path in (rel, "/" + rel)]
+        for start in range(0, len(candidates), QUERY_BATCH_SIZE):
+            for row in db.query(models.File).filter(
+                models.File.project_id == project_id,
+                models.File.path.in_(candidates[start : start + QUERY_BATCH_SIZE]),
+            ):
+                rows[workspace_relpath(row.path)] = row
+
+        state = {}
+        changed = []
+        texts = []
+        for rel, change in changes.items():
+            row = rows.get(rel)
+            if change[0] == "delete":
+                if row is not None and not row.is_directory:
+                    db.delete(row)
+                    changed.append(("deleted", (row.id, row.path)))
+                    texts.append((row.id, None))
+                state[rel] = None
+            elif change[0] == "touched":
+                known = self._known(project, rel)
+                if row is not None:
+                    synced[row.path] = change[1]
+                if known is not None:
+                    state[rel] = (change[1], known[1])
+            else:
+                _, content_hash, size, mtime = change
+                known = self._known(project, rel)
+                if row is None:
+                    row = models.File(
+                        id=str(uuid.uuid4()),
+                        name=os.path.basename(rel),
+                        path=rel,
+                        content_hash=content_hash,
+                        size=size,
+                        synced_mtime_ns=mtime,
+                        project_id=project_id,
+                    )
+                    db.add(row)
+                    changed.append(("created", row))
+                    texts.append((row.id, search.blob_text(content_hash, size)))
+                elif (row.content_hash or EMPTY_HASH) != content_hash:
+                    if (
+                        known is not None
+                        and (row.content_hash or EMPTY_HASH) != known[1]
+                    ):
+                        # The row was changed too since the last sync
+                        self._keep_conflict(project, rel, row.content_hash)
+                    row.content_hash = content_hash
+                    row.size = size
+                    row.version = models.File.version + 1
+                    row.synced_mtime_ns = mtime
+                    changed.append(("modified", row))
+                    texts.append((row.id, search.blob_text(content_hash, size)))
+                else:
+                    synced[row.path] = mtime
+                state[rel] = (mtime, content_hash)
+
+        # Sync bookkeeping is not a change to the file
+        for path, mtime in synced.items():
+            db.execute(
+                update(models.File)
+                .where(models.File.project_id == project_id, models.File.path == path)
+                .values(synced_mtime_ns=mtime, updated_at=models.File.updated_at)
+            )
+        search.index_files(db, project_id, texts)
+        if changed:
+            db.execute(
+                update(models.Project)
+                .where(models.Project.id == project_id)
+                .values(files_version=models.Project.files_version + 1)
+            )
+            self.stats["to_database"] += len(changed)
+        return state, changed
+
+    def _keep_conflict(self, project: dict, rel: str, content_hash):
+        """Write the database's version of rel to the workspace as .conflict."""
+        target = os.path.join(project["root"], rel) + ".conflict"
+        self._write_file(target, content_hash)
+        self.stats["conflicts"] += 1
+        print(f"Sync conflict on {target}; database copy kept as .conflict")
+
+
+workspace_sync = WorkspaceSync(
+    DATA_DIR,
+    SYNC_DEBOUNCE,
+    SYNC_MAX_DELAY,
+    SYNC_MAX_FILE_SIZE,
+    SYNC_IGNORE,
+    WORKSPACE_SYNC,
+)
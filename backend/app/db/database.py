@@ -1,18 +1,90 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
+from ..core.config import (
+    DB_BUSY_TIMEOUT,
+    DB_MAX_OVERFLOW,
+    DB_MMAP_SIZE,
+    DB_POOL_SIZE,
+    DB_PROFILE,
+    DB_STATEMENT_CACHE,
+)
+
 # For a POC project, we'll use a simple SQLite database
 # stored in the project directory
 SQLALCHEMY_DATABASE_URL = "sqlite:///./web_terminal.db"
 
+# The same database through aiosqlite, for async code paths
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./web_terminal.db"
+
+
+def sqlite_pragmas(profile: str):
+    """PRAGMAs set on every new connection for a tuning profile."""
+    if profile == "default":
+        return {"busy_timeout": DB_BUSY_TIMEOUT}
+    if profile == "wal":
+        return {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": DB_MMAP_SIZE,
+            "busy_timeout": DB_BUSY_TIMEOUT,
+            "temp_store": "MEMORY",
+        }
+    raise ValueError(f"Unknown database profile: {profile}")
+
+
+def sql_casefold(text):
+    """str.casefold() as the SQL function casefold().
+
+    SQLite's lower() only folds ASCII; search terms are folded in Python, so
+    the bodies they are counted in must be folded the same way.
+    """
+    return text.casefold() if text is not None else None
+
+
+def make_engine(url: str, profile: str = DB_PROFILE, is_async: bool = False):
+    """Create an engine whose connections are tuned with profile's PRAGMAs.
+
+    Connections also get the casefold() SQL function.
+    """
+    pragmas = sqlite_pragmas(profile)
+    options = dict(
+        # check_same_thread is needed for SQLite to work with FastAPI
+        connect_args={
+            "check_same_thread": False,
+            "cached_statements": DB_STATEMENT_CACHE,
+        },
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+    )
+    if is_async:
+        engine = create_async_engine(url, **options)
+        sync_engine = engine.sync_engine
+    else:
+        engine = sync_engine = create_engine(url, **options)
+
+    @event.listens_for(sync_engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+        dbapi_connection.create_function(
+            "casefold", 1, sql_casefold, deterministic=True
+        )
+
+    return engine
+
+
 # Create SQLite engine
-# check_same_thread is needed for SQLite to work with FastAPI
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
 
-# Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Create session factory. Objects are not expired on commit, so repositories
+# can return what they wrote without reading it back.
+SessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+)
 
 
 # Create a function to get DB session
@@ -22,3 +94,19 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Async engine and session factory. Objects are not expired on commit, so
+# handlers can still read them afterwards (an async session cannot reload
+# attributes lazily).
+async_engine = make_engine(ASYNC_DATABASE_URL, is_async=True)
+
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
+
+# Create a function to get an async DB session
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,6 +1,19 @@
 import datetime
 
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, String, Text
+from sqlalchemy import (
+    DDL,
+    BigInteger,
+    Boolean,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+    event,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -37,7 +50,10 @@ class Project(Base):
     updated_at = Column(
         DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow
     )
-    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    user_id = Column(String, ForeignKey("users.id"), nullable=False, index=True)
+    # Incremented whenever one of the project's files is created, changed or
+    # deleted; file listings are cached against it
+    files_version = Column(Integer, nullable=False, default=0)
 
     # Relationships
     user = relationship("User", back_populates="projects")
@@ -49,10 +65,22 @@ class Project(Base):
 
 class File(Base):
     __tablename__ = "files"
+    # Also serves lookups by project_id alone, its leading column
+    __table_args__ = (
+        Index("ix_files_project_id_path", "project_id", "path", unique=True),
+    )
 
     id = Column(String, primary_key=True)
     name = Column(String, nullable=False)
-    content = Column(Text, nullable=True)
+    # The body lives in the blob store (core/blobs.py) under this SHA-256;
+    # None for directories and files created without content
+    content_hash = Column(String(64), nullable=True)
+    size = Column(Integer, nullable=False, default=0)
+    # Incremented on every content change; saves can be made conditional on it
+    version = Column(Integer, nullable=False, default=1)
+    # mtime (ns) of the workspace copy when it last matched this row; None if
+    # it was never written to the workspace (see core/sync.py)
+    synced_mtime_ns = Column(BigInteger, nullable=True)
     path = Column(String, nullable=False)
     is_directory = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -66,3 +94,94 @@ class File(Base):
 
     def __repr__(self):
         return f"<File(id={self.id}, path={self.path}, project_id={self.project_id})>"
+
+
+class FileChange(Base):
+    """A file change event, as sent to subscribed clients (see core/changes.py)."""
+
+    __tablename__ = "file_changes"
+    # AUTOINCREMENT, so ids are never reused once old events are pruned
+    __table_args__ = (
+        Index("ix_file_changes_project_id_id", "project_id", "id"),
+        {"sqlite_autoincrement": True},
+    )
+
+    # The event's seq: every worker numbers events the same way
+    id = Column(Integer, primary_key=True)
+    project_id = Column(String, nullable=False)
+    # The event as JSON
+    event = Column(Text, nullable=False)
+    # Unix time, for pruning
+    created_at = Column(Float, nullable=False)
+
+    def __repr__(self):
+        return f"<FileChange(id={self.id}, project_id={self.project_id})>"
+
+
+class SearchDocument(Base):
+    """The searchable text and path of a file (see db/search.py)."""
+
+    __tablename__ = "search_documents"
+
+    # Each project's documents are numbered within a range of ids of its own,
+    # which searches restrict the index to. INTEGER, so it is the rowid.
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    file_id = Column(String, nullable=False, unique=True)
+    project_id = Column(String, nullable=False, index=True)
+    # Empty for files without searchable text, which are found by path only
+    body = Column(Text, nullable=False)
+    # A copy of the file's path, kept up to date by a trigger on files
+    path = Column(String, nullable=False, server_default="")
+
+    def __repr__(self):
+        return f"<SearchDocument(id={self.id}, file_id={self.file_id})>"
+
+
+# FTS5 indexes over search_documents.body and .path, kept in step by
+# triggers. The trigram tokenizer matches any substring of three or more
+# characters, ignoring case. Paths have an index of their own, so moving a
+# file never re-indexes its body.
+SEARCH_INDEX_DDL = (
+    "CREATE VIRTUAL TABLE search_index USING fts5("
+    "body, content='search_documents', content_rowid='id', tokenize='trigram')",
+    "CREATE VIRTUAL TABLE search_paths USING fts5("
+    "path, content='search_documents', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER search_documents_insert AFTER INSERT ON search_documents BEGIN "
+    "INSERT INTO search_index(rowid, body) VALUES (new.id, new.body); "
+    "INSERT INTO search_paths(rowid, path) VALUES (new.id, new.path); END",
+    "CREATE TRIGGER search_documents_delete AFTER DELETE ON search_documents BEGIN "
+    "INSERT INTO search_index(search_index, rowid, body) "
+    "VALUES ('delete', old.id, old.body); "
+    "INSERT INTO search_paths(search_paths, rowid, path) "
+    "VALUES ('delete', old.id, old.path); END",
+    "CREATE TRIGGER search_documents_update AFTER UPDATE OF body "
+    "ON search_documents BEGIN "
+    "INSERT INTO search_index(search_index, rowid, body) "
+    "VALUES ('delete', old.id, old.body); "
+    "INSERT INTO search_index(rowid, body) VALUES (new.id, new.body); END",
+    "CREATE TRIGGER search_documents_move AFTER UPDATE OF path "
+    "ON search_documents BEGIN "
+    "INSERT INTO search_paths(search_paths, rowid, path) "
+    "VALUES ('delete', old.id, old.path); "
+    "INSERT INTO search_paths(rowid, path) VALUES (new.id, new.path); END",
+)
+
+# Copies a moved file's path into its document
+SEARCH_PATH_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS files_move_search_document "
+    "AFTER UPDATE OF path ON files "
+    "WHEN new.path IS NOT old.path BEGIN "
+    "UPDATE search_documents SET path = new.path WHERE file_id = new.id; END"
+)
+
+for statement in SEARCH_INDEX_DDL:
+    event.listen(SearchDocument.__table__, "after_create", DDL(statement))
+# On files, once both tables exist
+event.listen(Base.metadata, "after_create", DDL(SEARCH_PATH_TRIGGER))
+for statement in (
+    "DROP TABLE IF EXISTS search_index",
+    "DROP TABLE IF EXISTS search_paths",
+    # The trigger is on files, which outlives search_documents
+    "DROP TRIGGER IF EXISTS files_move_search_document",
+):
+    event.listen(SearchDocument.__table__, "after_drop", DDL(statement))
@@ -1,10 +1,438 @@
+import asyncio
+import datetime
+import time
+import types
 import uuid
 from typing import Optional
 
 import bcrypt
+from sqlalchemy import (
+    and_,
+    bindparam,
+    delete,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from . import models
+from ..core.auth_cache import auth_cache
+from ..core.blobs import blob_store
+from ..core.changes import deleted_event, file_changes, file_event, file_metadata
+from ..core.config import SEARCH_REGEX_TIMEOUT
+from ..core.sync import EMPTY_HASH, workspace_relpath, workspace_sync
+from ..utils.delta import apply_edits
+from . import models, search
+
+# Columns returned by file listings that leave out content
+FILE_METADATA_COLUMNS = (
+    models.File.id,
+    models.File.name,
+    models.File.path,
+    models.File.is_directory,
+    models.File.size,
+    models.File.version,
+    models.File.updated_at,
+)
+
+
+class VersionConflict(Exception):
+    """Raised when a file changed since the version a save was based on."""
+
+    def __init__(self, version: int):
+        super().__init__(f"File is at version {version}")
+        self.version = version
+
+
+class BatchRejected(Exception):
+    """Raised when a batch of file operations was not applied.
+
+    results holds one {"status", "error"} entry per operation; operations that
+    were fine themselves have status 424.
+    """
+
+    def __init__(self, results: list):
+        super().__init__("Batch was not applied")
+        self.results = results
+        self.status = next(r["status"] for r in results if r["status"] != 424)
+
+
+class ImportIncomplete(Exception):
+    """Raised when an import failed after some of its batches were committed.
+
+    counts holds the counts of FileRepository.import_files for the entries
+    written before the failure, applied their number; the rest were not.
+    """
+
+    def __init__(self, counts: dict):
+        self.counts = counts
+        self.applied = sum(counts.values())
+        super().__init__(f"Import failed after {self.applied} entries")
+
+
+# Columns of the file rows a batch reads
+FILE_BATCH_COLUMNS = (
+    *FILE_METADATA_COLUMNS,
+    models.File.content_hash,
+)
+
+# Ids or paths per IN (...) query when loading a batch's files
+BATCH_QUERY_SIZE = 500
+
+
+def _batch_contents(operations: list):
+    """Store the content of a batch's creates and updates; (hash, size) or None each."""
+    return [
+        blob_store.put(op.content.encode("utf-8")) if op.content is not None else None
+        for op in operations
+    ]
+
+
+def _renamed_path(path: str, name: str):
+    parts = path.split("/")
+    parts[-1] = name
+    return "/".join(parts)
+
+
+def _stage_file_batch(db: Session, project_id: str, operations: list, blobs: list):
+    """Validate a batch of file operations and stage them in db's transaction.
+
+    Operations are FileOperation-like objects (see schemas.projects), applied
+    in order. The whole batch is checked against the files it touches before
+    anything is written; any failing operation raises BatchRejected. Writes
+    are then a handful of executemany statements, whatever the batch size.
+
+    Returns the per-operation results plus the workspace changes and change
+    events to send once the transaction commits.
+    """
+    # Load every file the batch refers to by id, then every path it claims
+    files = {}
+    ids = sorted({op.id for op in operations if op.id})
+    for start in range(0, len(ids), BATCH_QUERY_SIZE):
+        for row in db.execute(
+            select(*FILE_BATCH_COLUMNS).where(
+                models.File.project_id == project_id,
+                models.File.id.in_(ids[start : start + BATCH_QUERY_SIZE]),
+            )
+        ):
+            files[row.id] = types.SimpleNamespace(**row._mapping)
+
+    claimed = {op.path for op in operations if op.op == "create" and op.path}
+    claimed.update(
+        _renamed_path(files[op.id].path, op.name)
+        for op in operations
+        if op.op == "rename" and op.id in files and op.name
+    )
+    claimed = sorted(claimed)
+    taken = set()
+    for start in range(0, len(claimed), BATCH_QUERY_SIZE):
+        taken.update(
+            db.scalars(
+                select(models.File.path).where(
+                    models.File.project_id == project_id,
+                    models.File.path.in_(claimed[start : start + BATCH_QUERY_SIZE]),
+                )
+            )
+        )
+
+    now = datetime.datetime.utcnow()
+    results, changes, events, texts = [], [], [], []
+    inserts, updates, renames, deletes = [], {}, {}, []
+
+    def fail(status: int, error: str):
+        results.append({"status": status, "error": error})
+
+    for op, blob in zip(operations, blobs):
+        if op.op == "create":
+            if not op.name or not op.path:
+                fail(400, "Name and path are required")
+                continue
+            if op.path in taken:
+                fail(400, "File with this path already exists")
+                continue
+            content_hash, size = blob or (None, 0)
+            file = types.SimpleNamespace(
+                id=str(uuid.uuid4()),
+                name=op.name,
+                path=op.path,
+                is_directory=op.is_directory,
+                content_hash=content_hash,
+                size=size,
+                version=1,
+                updated_at=now,
+            )
+            taken.add(op.path)
+            inserts.append(dict(vars(file), project_id=project_id, created_at=now))
+            results.append({"status": 201, "file": file_metadata(file)})
+            changes.append(
+                ("mkdir", op.path)
+                if op.is_directory
+                else ("write", op.path, content_hash)
+            )
+            events.append(file_event("created", file))
+            if not op.is_directory:
+                texts.append((file.id, search.searchable(op.content or "", size)))
+            continue
+
+        file = files.get(op.id) if op.id else None
+        if file is None:
+            fail(404, "File not found")
+        elif op.op == "update":
+            if file.is_directory or op.content is None:
+                fail(400, "Only files can have content")
+            elif op.base_version is not None and op.base_version != file.version:
+                fail(409, f"File is at version {file.version}")
+            else:
+                # Only the last update of a file is written; the version
+                # check is against the version loaded above
+                expected = updates.get(file.id, {}).get("b_version", file.version)
+                file.content_hash, file.size = blob
+                file.version += 1
+                file.updated_at = now
+                updates[file.id] = {
+                    "b_id": file.id,
+                    "b_version": expected,
+                    "content_hash": file.content_hash,
+                    "size": file.size,
+                    "version": file.version,
+                    "updated_at": now,
+                }
+                results.append({"status": 200, "file": file_metadata(file)})
+                changes.append(("write", file.path, file.content_hash))
+                events.append(file_event("modified", file))
+                texts.append((file.id, search.searchable(op.content, file.size)))
+        elif op.op == "rename":
+            new_path = _renamed_path(file.path, op.name) if op.name else None
+            if not new_path:
+                fail(400, "Name cannot be empty")
+            elif file.is_directory:
+                # Their files would have to move too; see move_path
+                fail(400, "Directories are renamed with the move endpoint")
+            elif new_path != file.path and new_path in taken:
+                fail(400, "File with this name already exists in the same directory")
+            else:
+                old_path = file.path
+                taken.discard(old_path)
+                taken.add(new_path)
+                file.name, file.path, file.updated_at = op.name, new_path, now
+                renames[file.id] = {
+                    "b_id": file.id,
+                    "name": file.name,
+                    "path": file.path,
+                    "updated_at": now,
+                }
+                results.append({"status": 200, "file": file_metadata(file)})
+                changes.append(("move", old_path, new_path))
+                events.append(file_event("renamed", file, old_path=old_path))
+        elif op.op == "delete":
+            del files[file.id]
+            taken.discard(file.path)
+            updates.pop(file.id, None)
+            renames.pop(file.id, None)
+            deletes.append(file.id)
+            results.append({"status": 204})
+            changes.append(("delete", file.path))
+            events.append(deleted_event(file.id, file.path))
+            texts.append((file.id, None))
+        else:
+            fail(400, f"Unknown operation: {op.op}")
+
+    if any(result["status"] >= 400 for result in results):
+        for result in results:
+            if result["status"] < 400:
+                result["status"], result["error"] = 424, "Not applied"
+                result.pop("file", None)
+        raise BatchRejected(results)
+
+    # Deletes first so their paths can be reused by renames and creates
+    table = models.File.__table__
+    connection = db.connection()
+    try:
+        for start in range(0, len(deletes), BATCH_QUERY_SIZE):
+            connection.execute(
+                delete(table).where(
+                    table.c.id.in_(deletes[start : start + BATCH_QUERY_SIZE])
+                )
+            )
+        if renames:
+            connection.execute(
+                update(table)
+                .where(table.c.id == bindparam("b_id"))
+                .values(
+                    name=bindparam("name"),
+                    path=bindparam("path"),
+                    updated_at=bindparam("updated_at"),
+                ),
+                list(renames.values()),
+            )
+        if inserts:
+            connection.execute(insert(table), inserts)
+        if updates:
+            result = connection.execute(
+                update(table)
+                .where(
+                    table.c.id == bindparam("b_id"),
+                    table.c.version == bindparam("b_version"),
+                )
+                .values(
+                    content_hash=bindparam("content_hash"),
+                    size=bindparam("size"),
+                    version=bindparam("version"),
+                    updated_at=bindparam("updated_at"),
+                ),
+                list(updates.values()),
+            )
+            if result.rowcount != len(updates):
+                raise BatchRejected(
+                    [{"status": 409, "error": "Files changed meanwhile"}] * len(results)
+                )
+        search.index_files(db, project_id, texts)
+    except IntegrityError:
+        raise BatchRejected(
+            [{"status": 409, "error": "Paths changed meanwhile"}] * len(results)
+        )
+    if results:
+        FileRepository.touch_project(db, project_id)
+    return results, changes, events
+
+
+def _at_or_under(path: str):
+    """Criteria for the file at path and the files under it.
+
+    The descendants are the range [path/, path0) of the (project_id, path)
+    index: "0" is the character after "/".
+    """
+    return or_(
+        models.File.path == path,
+        and_(models.File.path >= path + "/", models.File.path < path + "0"),
+    )
+
+
+def _move_statements(project_id: str, path: str, new_path: str):
+    """UPDATEs moving the file at path and everything under it to new_path."""
+    return (
+        # The row itself, if the path has one, is kept in step in the session
+        update(models.File)
+        .where(models.File.project_id == project_id, models.File.path == path)
+        .values(path=new_path, name=new_path.rsplit("/", 1)[-1])
+        .execution_options(synchronize_session="fetch"),
+        update(models.File)
+        .where(
+            models.File.project_id == project_id,
+            models.File.path >= path + "/",
+            models.File.path < path + "0",
+        )
+        .values(path=literal(new_path) + func.substr(models.File.path, len(path) + 1))
+        .execution_options(synchronize_session=False),
+    )
+
+
+def _moved_events(rows, path: str, new_path: str):
+    return [
+        file_event("renamed", row, old_path=path + row.path[len(new_path) :])
+        for row in rows
+    ]
+
+
+def _content_update(file_id: str, content_hash: str, size: int, base_version):
+    query = update(models.File).where(models.File.id == file_id)
+    if base_version is not None:
+        query = query.where(models.File.version == base_version)
+    return query.values(
+        content_hash=content_hash, size=size, version=models.File.version + 1
+    ).execution_options(synchronize_session="fetch")
+
+
+def _stage_import(db: Session, project_id: str, entries: list):
+    """Stage imported files in db's transaction; see FileRepository.import_files.
+
+    Returns the counts plus the workspace changes and change events to send
+    once the transaction commits.
+    """
+    # Rows may be stored with or without a leading slash
+    files = {}
+    candidates = [path for path, *_ in entries for path in (path, "/" + path)]
+    for start in range(0, len(candidates), BATCH_QUERY_SIZE):
+        for row in db.execute(
+            select(*FILE_BATCH_COLUMNS).where(
+                models.File.project_id == project_id,
+                models.File.path.in_(candidates[start : start + BATCH_QUERY_SIZE]),
+            )
+        ):
+            files.setdefault(workspace_relpath(row.path), row)
+
+    now = datetime.datetime.utcnow()
+    counts = {"created": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+    inserts, updates, changes, events, texts = [], [], [], [], []
+    for path, is_directory, content_hash, size in entries:
+        row = files.get(path)
+        if row is not None:
+            if row.is_directory != is_directory:
+                counts["skipped"] += 1
+            elif is_directory or (row.content_hash or EMPTY_HASH) == content_hash:
+                counts["unchanged"] += 1
+            else:
+                file = types.SimpleNamespace(**row._mapping)
+                file.content_hash, file.size = content_hash, size
+                file.version += 1
+                file.updated_at = now
+                updates.append(
+                    {
+                        "b_id": file.id,
+                        "content_hash": content_hash,
+                        "size": size,
+                        "updated_at": now,
+                    }
+                )
+                counts["updated"] += 1
+                changes.append(("write", file.path, content_hash))
+                events.append(file_event("modified", file))
+                texts.append((file.id, search.blob_text(content_hash, size)))
+            continue
+        file = types.SimpleNamespace(
+            id=str(uuid.uuid4()),
+            name=path.rsplit("/", 1)[-1],
+            path=path,
+            is_directory=is_directory,
+            content_hash=content_hash,
+            size=size,
+            version=1,
+            updated_at=now,
+        )
+        inserts.append(dict(vars(file), project_id=project_id, created_at=now))
+        counts["created"] += 1
+        changes.append(
+            ("mkdir", path) if is_directory else ("write", path, content_hash)
+        )
+        events.append(file_event("created", file))
+        if not is_directory:
+            texts.append((file.id, search.blob_text(content_hash, size)))
+
+    table = models.File.__table__
+    connection = db.connection()
+    if inserts:
+        connection.execute(insert(table), inserts)
+    if updates:
+        connection.execute(
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values(
+                content_hash=bindparam("content_hash"),
+                size=bindparam("size"),
+                version=table.c.version + 1,
+                updated_at=bindparam("updated_at"),
+            ),
+            updates,
+        )
+    search.index_files(db, project_id, texts)
+    if inserts or updates:
+        FileRepository.touch_project(db, project_id)
+    return counts, changes, events
 
 
 class UserRepository:
@@ -42,7 +470,6 @@ class UserRepository:
         )
         db.add(db_user)
         db.commit()
-        db.refresh(db_user)
         return db_user
 
     @staticmethod
@@ -57,6 +484,21 @@ class UserRepository:
 
         return None
 
+    @staticmethod
+    def update_user(db: Session, user_id: str, **fields):
+        """Set columns of a user, e.g. is_active=False to deactivate them.
+
+        Drops the user's cached tokens and principal once committed.
+        """
+        user = UserRepository.get_user(db, user_id)
+        if user is None:
+            return None
+        for field, value in fields.items():
+            setattr(user, field, value)
+        db.commit()
+        auth_cache.invalidate_user(user_id)
+        return user
+
 
 class ProjectRepository:
     @staticmethod
@@ -77,7 +519,6 @@ class ProjectRepository:
         )
         db.add(db_project)
         db.commit()
-        db.refresh(db_project)
         return db_project
 
     @staticmethod
@@ -87,16 +528,54 @@ class ProjectRepository:
         )
         if project:
             db.delete(project)
+            search.unindex_project(db, project_id)
             db.commit()
             return True
         return False
 
 
 class FileRepository:
+    @staticmethod
+    def touch_project(db: Session, project_id: str):
+        """Bump the project's files_version as part of the current transaction."""
+        db.execute(
+            update(models.Project)
+            .where(models.Project.id == project_id)
+            .values(files_version=models.Project.files_version + 1)
+        )
+
+    @staticmethod
+    def sync_workspace(db: Session, project_id: str, changes: list):
+        """Write committed changes through to the project's workspace (core.sync)."""
+        if not workspace_sync.enabled:
+            return
+        project = db.get(models.Project, project_id)
+        if project:
+            workspace_sync.write_through(project.user_id, project_id, changes)
+
     @staticmethod
     def get_project_files(db: Session, project_id: str):
         return db.query(models.File).filter(models.File.project_id == project_id).all()
 
+    @staticmethod
+    def get_project_file_page(
+        db: Session,
+        project_id: str,
+        after_path: Optional[str],
+        limit: int,
+        with_content: bool = False,
+    ):
+        """Metadata of up to limit files ordered by path, starting after after_path.
+
+        Only the listed columns are read, plus content_hash if with_content;
+        file rows are not loaded as objects.
+        """
+        columns = FILE_BATCH_COLUMNS if with_content else FILE_METADATA_COLUMNS
+        query = select(*columns).where(models.File.project_id == project_id)
+        if after_path is not None:
+            query = query.where(models.File.path > after_path)
+        return db.execute(query.order_by(models.File.path).limit(limit)).all()
+
     @staticmethod
     def get_file(db: Session, file_id: str):
         return db.query(models.File).filter(models.File.id == file_id).first()
@@ -119,35 +598,115 @@ class FileRepository:
         is_directory: bool = False,
     ):
         file_id = str(uuid.uuid4())
+        content_hash, size = None, 0
+        if content is not None:
+            content_hash, size = blob_store.put(content.encode("utf-8"))
         db_file = models.File(
             id=file_id,
             name=name,
             path=path,
-            content=content,
+            content_hash=content_hash,
+            size=size,
             is_directory=is_directory,
             project_id=project_id,
         )
         db.add(db_file)
+        if not is_directory:
+            search.index_files(
+                db, project_id, [(file_id, search.searchable(content or "", size))]
+            )
+        FileRepository.touch_project(db, project_id)
         db.commit()
-        db.refresh(db_file)
+        FileRepository.sync_workspace(
+            db,
+            project_id,
+            [("mkdir", path) if is_directory else ("write", path, content_hash)],
+        )
+        file_changes.publish(project_id, [file_event("created", db_file)])
         return db_file
 
     @staticmethod
-    def update_file_content(db: Session, file_id: str, content: str):
+    def update_file_content(
+        db: Session, file_id: str, content: str, base_version: Optional[int] = None
+    ):
+        content_hash, size = blob_store.put(content.encode("utf-8"))
+        return FileRepository.set_file_blob(
+            db, file_id, content_hash, size, base_version, content
+        )
+
+    @staticmethod
+    def patch_file_content(db: Session, file_id: str, base_version: int, edits: list):
+        """Apply edits (see utils.delta) to the file's content at base_version."""
         db_file = db.query(models.File).filter(models.File.id == file_id).first()
-        if db_file:
-            db_file.content = content
-            db.commit()
-            db.refresh(db_file)
-            return db_file
-        return None
+        if not db_file:
+            return None
+        if db_file.version != base_version:
+            raise VersionConflict(db_file.version)
+        content = apply_edits(FileRepository.get_file_content(db_file) or "", edits)
+        return FileRepository.update_file_content(db, file_id, content, base_version)
+
+    @staticmethod
+    def set_file_blob(
+        db: Session,
+        file_id: str,
+        content_hash: str,
+        size: int,
+        base_version: Optional[int] = None,
+        content: Optional[str] = None,
+    ):
+        """Point a file at a blob that is already in the blob store.
+
+        With base_version the change is only made if the file is still at that
+        version; otherwise VersionConflict is raised. content is the blob's
+        text, if the caller has it; otherwise it is read back for the search
+        index.
+        """
+        db_file = db.query(models.File).filter(models.File.id == file_id).first()
+        if not db_file:
+            return None
+        if content is not None:
+            text = search.searchable(content, size)
+        else:
+            text = search.blob_text(content_hash, size)
+        result = db.execute(_content_update(file_id, content_hash, size, base_version))
+        if result.rowcount != 1:
+            db.rollback()
+            version = db.scalar(
+                select(models.File.version).where(models.File.id == file_id)
+            )
+            if version is None:
+                return None
+            raise VersionConflict(version)
+        search.index_files(db, db_file.project_id, [(file_id, text)])
+        FileRepository.touch_project(db, db_file.project_id)
+        db.commit()
+        FileRepository.sync_workspace(
+            db, db_file.project_id, [("write", db_file.path, content_hash)]
+        )
+        file_changes.publish(db_file.project_id, [file_event("modified", db_file)])
+        return db_file
+
+    @staticmethod
+    def get_file_content(db_file: models.File):
+        """The file's body as text, or None if it has none."""
+        if db_file.content_hash is None:
+            return None
+        return blob_store.read_text(db_file.content_hash)
 
     @staticmethod
     def delete_file(db: Session, file_id: str):
         db_file = db.query(models.File).filter(models.File.id == file_id).first()
         if db_file:
             db.delete(db_file)
+            search.index_files(db, db_file.project_id, [(file_id, None)])
+            FileRepository.touch_project(db, db_file.project_id)
             db.commit()
+            FileRepository.sync_workspace(
+                db, db_file.project_id, [("delete", db_file.path)]
+            )
+            file_changes.publish(
+                db_file.project_id, [deleted_event(db_file.id, db_file.path)]
+            )
             return True
         return False
 
@@ -157,9 +716,524 @@ class FileRepository:
     ):
         db_file = db.query(models.File).filter(models.File.id == file_id).first()
         if db_file:
+            old_path = db_file.path
             db_file.name = new_name
             db_file.path = new_path
+            FileRepository.touch_project(db, db_file.project_id)
             db.commit()
-            db.refresh(db_file)
+            FileRepository.sync_workspace(
+                db, db_file.project_id, [("move", old_path, new_path)]
+            )
+            file_changes.publish(
+                db_file.project_id,
+                [file_event("renamed", db_file, old_path=old_path)],
+            )
+            return db_file
+        return None
+
+    @staticmethod
+    def path_taken(db: Session, project_id: str, path: str):
+        """Whether a file exists at path or under it."""
+        query = select(models.File.id).where(
+            models.File.project_id == project_id, _at_or_under(path)
+        )
+        return db.scalar(query.limit(1)) is not None
+
+    @staticmethod
+    def move_path(db: Session, project_id: str, path: str, new_path: str):
+        """Move the file or directory at path, and everything under it, to new_path.
+
+        Two UPDATE statements, however many files are under path; directories
+        need not have rows of their own. A trigger gives the search documents
+        of the files their new paths. Returns the number of files moved, or
+        None if new_path was taken meanwhile.
+        """
+        moved = 0
+        try:
+            for statement in _move_statements(project_id, path, new_path):
+                moved += db.execute(statement).rowcount
+        except IntegrityError:
+            db.rollback()
+            return None
+        if not moved:
+            db.rollback()
+            return 0
+        FileRepository.touch_project(db, project_id)
+        db.commit()
+
+        rows = db.execute(
+            select(*FILE_METADATA_COLUMNS).where(
+                models.File.project_id == project_id, _at_or_under(new_path)
+            )
+        ).all()
+        FileRepository.sync_workspace(db, project_id, [("move", path, new_path)])
+        file_changes.publish(project_id, _moved_events(rows, path, new_path))
+        return moved
+
+    @staticmethod
+    def apply_batch(db: Session, project_id: str, operations: list):
+        """Apply create, update, rename and delete operations in one transaction.
+
+        Returns one result per operation; raises BatchRejected, having applied
+        nothing, if any of them fails.
+        """
+        blobs = _batch_contents(operations)
+        try:
+            results, changes, events = _stage_file_batch(
+                db, project_id, operations, blobs
+            )
+        except BatchRejected:
+            db.rollback()
+            raise
+        db.commit()
+        FileRepository.sync_workspace(db, project_id, changes)
+        file_changes.publish(project_id, events)
+        return results
+
+    @staticmethod
+    def import_files(db: Session, project_id: str, entries: list, batch_size: int):
+        """Create or update the project's files from imported entries.
+
+        entries are (path, is_directory, content_hash, size) tuples with paths
+        relative to the project and contents already in the blob store; the
+        last entry for a path wins. New paths become files, files whose
+        content differs are updated, and paths taken by a file where the
+        entry is a directory, or the reverse, are skipped. Entries are written
+        batch_size at a time, one transaction each, so other writers are not
+        locked out for the length of a large import.
+
+        Returns the number of files "created", "updated", "unchanged" and
+        "skipped". If a batch fails, the batches before it stay applied:
+        raises ImportIncomplete with their counts.
+        """
+        entries = list({entry[0]: entry for entry in entries}.values())
+        counts = {"created": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+        for start in range(0, len(entries), batch_size):
+            try:
+                batch, changes, events = _stage_import(
+                    db, project_id, entries[start : start + batch_size]
+                )
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                raise ImportIncomplete(counts) from e
+            FileRepository.sync_workspace(db, project_id, changes)
+            file_changes.publish(project_id, events)
+            for key, value in batch.items():
+                counts[key] += value
+        return counts
+
+    @staticmethod
+    def search_files(
+        db: Session,
+        project_id: str,
+        query: str,
+        pattern=None,
+        limit: int = 50,
+        max_lines: int = 5,
+    ):
+        """The project's files containing every term of query, best first.
+
+        pattern, a compiled regular expression, further restricts the results
+        to files with a matching line. Raises search.InvalidQuery.
+        """
+        phrases, terms = search.parse_query(query)
+        ranked = search.rank(db, project_id, phrases, terms)
+        # Without a pattern every candidate is a result
+        page_size = limit if pattern is None else search.CANDIDATE_PAGE_SIZE
+        # One time limit for matching the pattern against all pages
+        deadline = time.monotonic() + SEARCH_REGEX_TIMEOUT
+        results = []
+        for start in range(0, len(ranked), page_size):
+            candidates = search.candidates(db, ranked[start : start + page_size])
+            results += search.search_results(
+                candidates, terms, pattern, max_lines, deadline
+            )
+            if len(results) >= limit:
+                break
+        return results[:limit]
+
+
+# Async versions of the repositories above, for use from async routes. They
+# take an AsyncSession (see database.get_async_db) so database I/O never
+# blocks the event loop.
+
+
+class AsyncUserRepository:
+    @staticmethod
+    async def get_user(db: AsyncSession, user_id: str):
+        return await db.get(models.User, user_id)
+
+    @staticmethod
+    async def get_user_by_email(db: AsyncSession, email: str):
+        result = await db.execute(select(models.User).where(models.User.email == email))
+        return result.scalars().first()
+
+    @staticmethod
+    async def create_user(
+        db: AsyncSession,
+        name: str,
+        email: str,
+        password: str,
+        username: Optional[str] = None,
+    ):
+        # Hashing is deliberately slow; keep it off the event loop
+        password_hash = (
+            await asyncio.to_thread(
+                bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt()
+            )
+        ).decode("utf-8")
+
+        db_user = models.User(
+            id=str(uuid.uuid4()),
+            username=username or email.split("@")[0],
+            email=email,
+            name=name,
+            password_hash=password_hash,
+        )
+        db.add(db_user)
+        await db.commit()
+        return db_user
+
+    @staticmethod
+    async def authenticate_user(db: AsyncSession, email: str, password: str):
+        user = await AsyncUserRepository.get_user_by_email(db, email)
+        if not user:
+            return None
+
+        if await asyncio.to_thread(
+            bcrypt.checkpw, password.encode("utf-8"), user.password_hash.encode("utf-8")
+        ):
+            return user
+
+        return None
+
+    @staticmethod
+    async def update_user(db: AsyncSession, user_id: str, **fields):
+        user = await AsyncUserRepository.get_user(db, user_id)
+        if user is None:
+            return None
+        for field, value in fields.items():
+            setattr(user, field, value)
+        await db.commit()
+        auth_cache.invalidate_user(user_id)
+        return user
+
+
+class AsyncProjectRepository:
+    @staticmethod
+    async def get_project(db: AsyncSession, project_id: str):
+        return await db.get(models.Project, project_id)
+
+    @staticmethod
+    async def get_user_projects(db: AsyncSession, user_id: str):
+        result = await db.execute(
+            select(models.Project).where(models.Project.user_id == user_id)
+        )
+        return result.scalars().all()
+
+    @staticmethod
+    async def create_project(
+        db: AsyncSession, name: str, user_id: str, description: Optional[str] = None
+    ):
+        db_project = models.Project(
+            id=str(uuid.uuid4()), name=name, description=description, user_id=user_id
+        )
+        db.add(db_project)
+        await db.commit()
+        return db_project
+
+    @staticmethod
+    async def delete_project(db: AsyncSession, project_id: str):
+        project = await db.get(models.Project, project_id)
+        if project:
+            await db.delete(project)
+            await db.run_sync(search.unindex_project, project_id)
+            await db.commit()
+            return True
+        return False
+
+
+class AsyncFileRepository:
+    @staticmethod
+    async def touch_project(db: AsyncSession, project_id: str):
+        await db.execute(
+            update(models.Project)
+            .where(models.Project.id == project_id)
+            .values(files_version=models.Project.files_version + 1)
+        )
+
+    @staticmethod
+    async def sync_workspace(db: AsyncSession, project_id: str, changes: list):
+        if not workspace_sync.enabled:
+            return
+        project = await db.get(models.Project, project_id)
+        if project:
+            await asyncio.to_thread(
+                workspace_sync.write_through, project.user_id, project_id, changes
+            )
+
+    @staticmethod
+    async def get_project_files(db: AsyncSession, project_id: str):
+        result = await db.execute(
+            select(models.File).where(models.File.project_id == project_id)
+        )
+        return result.scalars().all()
+
+    @staticmethod
+    async def get_project_file_page(
+        db: AsyncSession, project_id: str, after_path: Optional[str], limit: int
+    ):
+        query = select(*FILE_METADATA_COLUMNS).where(
+            models.File.project_id == project_id
+        )
+        if after_path is not None:
+            query = query.where(models.File.path > after_path)
+        result = await db.execute(query.order_by(models.File.path).limit(limit))
+        return result.all()
+
+    @staticmethod
+    async def get_file(db: AsyncSession, file_id: str):
+        return await db.get(models.File, file_id)
+
+    @staticmethod
+    async def get_file_by_path(db: AsyncSession, project_id: str, path: str):
+        result = await db.execute(
+            select(models.File).where(
+                models.File.project_id == project_id, models.File.path == path
+            )
+        )
+        return result.scalars().first()
+
+    @staticmethod
+    async def create_file(
+        db: AsyncSession,
+        project_id: str,
+        name: str,
+        path: str,
+        content: Optional[str] = None,
+        is_directory: bool = False,
+    ):
+        # Blob writes are file I/O; keep them off the event loop
+        content_hash, size = None, 0
+        if content is not None:
+            content_hash, size = await asyncio.to_thread(
+                blob_store.put, content.encode("utf-8")
+            )
+        db_file = models.File(
+            id=str(uuid.uuid4()),
+            name=name,
+            path=path,
+            content_hash=content_hash,
+            size=size,
+            is_directory=is_directory,
+            project_id=project_id,
+        )
+        db.add(db_file)
+        if not is_directory:
+            await db.run_sync(
+                search.index_files,
+                project_id,
+                [(db_file.id, search.searchable(content or "", size))],
+            )
+        await AsyncFileRepository.touch_project(db, project_id)
+        await db.commit()
+        await AsyncFileRepository.sync_workspace(
+            db,
+            project_id,
+            [("mkdir", path) if is_directory else ("write", path, content_hash)],
+        )
+        file_changes.publish(project_id, [file_event("created", db_file)])
+        return db_file
+
+    @staticmethod
+    async def update_file_content(
+        db: AsyncSession,
+        file_id: str,
+        content: str,
+        base_version: Optional[int] = None,
+    ):
+        content_hash, size = await asyncio.to_thread(
+            blob_store.put, content.encode("utf-8")
+        )
+        return await AsyncFileRepository.set_file_blob(
+            db, file_id, content_hash, size, base_version, content
+        )
+
+    @staticmethod
+    async def patch_file_content(
+        db: AsyncSession, file_id: str, base_version: int, edits: list
+    ):
+        db_file = await db.get(models.File, file_id)
+        if not db_file:
+            return None
+        if db_file.version != base_version:
+            raise VersionConflict(db_file.version)
+
+        # Reading the base and applying the edits is file I/O plus a pass over
+        # the whole text; both stay off the event loop
+        def patched():
+            content = FileRepository.get_file_content(db_file) or ""
+            return apply_edits(content, edits)
+
+        content = await asyncio.to_thread(patched)
+        return await AsyncFileRepository.update_file_content(
+            db, file_id, content, base_version
+        )
+
+    @staticmethod
+    async def set_file_blob(
+        db: AsyncSession,
+        file_id: str,
+        content_hash: str,
+        size: int,
+        base_version: Optional[int] = None,
+        content: Optional[str] = None,
+    ):
+        db_file = await db.get(models.File, file_id)
+        if not db_file:
+            return None
+        # Read before the update, so the write lock is not held meanwhile
+        if content is not None:
+            text = search.searchable(content, size)
+        else:
+            text = await asyncio.to_thread(search.blob_text, content_hash, size)
+        result = await db.execute(
+            _content_update(file_id, content_hash, size, base_version)
+        )
+        if result.rowcount != 1:
+            await db.rollback()
+            version = await db.scalar(
+                select(models.File.version).where(models.File.id == file_id)
+            )
+            if version is None:
+                return None
+            raise VersionConflict(version)
+        await db.run_sync(search.index_files, db_file.project_id, [(file_id, text)])
+        await AsyncFileRepository.touch_project(db, db_file.project_id)
+        await db.commit()
+        await AsyncFileRepository.sync_workspace(
+            db, db_file.project_id, [("write", db_file.path, content_hash)]
+        )
+        file_changes.publish(db_file.project_id, [file_event("modified", db_file)])
+        return db_file
+
+    @staticmethod
+    async def get_file_content(db_file: models.File):
+        if db_file.content_hash is None:
+            return None
+        return await asyncio.to_thread(blob_store.read_text, db_file.content_hash)
+
+    @staticmethod
+    async def delete_file(db: AsyncSession, file_id: str):
+        db_file = await db.get(models.File, file_id)
+        if db_file:
+            await db.delete(db_file)
+            await db.run_sync(search.index_files, db_file.project_id, [(file_id, None)])
+            await AsyncFileRepository.touch_project(db, db_file.project_id)
+            await db.commit()
+            await AsyncFileRepository.sync_workspace(
+                db, db_file.project_id, [("delete", db_file.path)]
+            )
+            file_changes.publish(
+                db_file.project_id, [deleted_event(db_file.id, db_file.path)]
+            )
+            return True
+        return False
+
+    @staticmethod
+    async def update_file_name_and_path(
+        db: AsyncSession, file_id: str, new_name: str, new_path: str
+    ):
+        db_file = await db.get(models.File, file_id)
+        if db_file:
+            old_path = db_file.path
+            db_file.name = new_name
+            db_file.path = new_path
+            await AsyncFileRepository.touch_project(db, db_file.project_id)
+            await db.commit()
+            await AsyncFileRepository.sync_workspace(
+                db, db_file.project_id, [("move", old_path, new_path)]
+            )
+            file_changes.publish(
+                db_file.project_id,
+                [file_event("renamed", db_file, old_path=old_path)],
+            )
             return db_file
         return None
+
+    @staticmethod
+    async def path_taken(db: AsyncSession, project_id: str, path: str):
+        query = select(models.File.id).where(
+            models.File.project_id == project_id, _at_or_under(path)
+        )
+        return await db.scalar(query.limit(1)) is not None
+
+    @staticmethod
+    async def move_path(db: AsyncSession, project_id: str, path: str, new_path: str):
+        moved = 0
+        try:
+            for statement in _move_statements(project_id, path, new_path):
+                moved += (await db.execute(statement)).rowcount
+        except IntegrityError:
+            await db.rollback()
+            return None
+        if not moved:
+            await db.rollback()
+            return 0
+        await AsyncFileRepository.touch_project(db, project_id)
+        await db.commit()
+
+        result = await db.execute(
+            select(*FILE_METADATA_COLUMNS).where(
+                models.File.project_id == project_id, _at_or_under(new_path)
+            )
+        )
+        rows = result.all()
+        await AsyncFileRepository.sync_workspace(
+            db, project_id, [("move", path, new_path)]
+        )
+        file_changes.publish(project_id, _moved_events(rows, path, new_path))
+        return moved
+
+    @staticmethod
+    async def apply_batch(db: AsyncSession, project_id: str, operations: list):
+        blobs = await asyncio.to_thread(_batch_contents, operations)
+        try:
+            results, changes, events = await db.run_sync(
+                _stage_file_batch, project_id, operations, blobs
+            )
+        except BatchRejected:
+            await db.rollback()
+            raise
+        await db.commit()
+        await AsyncFileRepository.sync_workspace(db, project_id, changes)
+        file_changes.publish(project_id, events)
+        return results
+
+    @staticmethod
+    async def search_files(
+        db: AsyncSession,
+        project_id: str,
+        query: str,
+        pattern=None,
+        limit: int = 50,
+        max_lines: int = 5,
+    ):
+        phrases, terms = search.parse_query(query)
+        ranked = await db.run_sync(search.rank, project_id, phrases, terms)
+        page_size = limit if pattern is None else search.CANDIDATE_PAGE_SIZE
+        deadline = time.monotonic() + SEARCH_REGEX_TIMEOUT
+        results = []
+        for start in range(0, len(ranked), page_size):
+            candidates = await db.run_sync(
+                search.candidates, ranked[start : start + page_size]
+            )
+            # Matching lines, against a pattern in particular, is CPU work
+            # over whole bodies
+            results += await asyncio.to_thread(
+                search.search_results, candidates, terms, pattern, max_lines, deadline
+            )
+            if len(results) >= limit:
+                break
+        return results[:limit]
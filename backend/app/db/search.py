@@ -0,0 +1,386 @@
+"""
+Full-text search over file contents.
+
+Finding text in a project used to mean downloading every file. Now every file
+has a row in search_documents with its path and, if it has searchable text
+(UTF-8, no NUL bytes, at most SEARCH_MAX_FILE_SIZE bytes), its body. The
+search_index and search_paths FTS5 tables index the two with the trigram
+tokenizer: like grep, any substring of three or more characters can be looked
+up, ignoring case. A file matches a term found in either. The file
+repositories and WorkspaceSync update a file's document in the same
+transaction as the file itself, so the index never lags behind the files
+table.
+
+Documents are keyed by file id. A trigger on files copies a new path into the
+file's document, which re-indexes the path but not the body, so renames and
+moves stay cheap. Each project's documents take their ids from a partition of
+their own, [p << 32, (p + 1) << 32), and a search restricts the index to the
+project's partition: its cost depends on the size of the project, not of the
+whole database. SQLite picks a new document's id, and the partition of a
+project's first document, within the INSERT itself, so concurrent writers
+never pick the same one.
+
+FTS5's own bm25() is not used for ranking: it counts each term's matches over
+the whole index, which would make every search as slow as the largest
+project. Instead the SEARCH_MAX_CANDIDATES newest matching documents of the
+project are scored in one query, BM25-style, from the number of times each
+term occurs in them, with a bonus for terms in the file's path. A regular
+expression, if given, is then applied to their bodies in rank order, in a
+worker process that is killed if it takes too long (see core/patterns.py).
+"""
+
+import re
+from typing import Optional
+
+from sqlalchemy import (
+    Integer,
+    bindparam,
+    column,
+    delete,
+    func,
+    intersect,
+    literal_column,
+    select,
+    table,
+    text,
+    union,
+    update,
+)
+from sqlalchemy.orm import Session
+
+from ..core.blobs import BlobNotFound, blob_store
+from ..core.config import SEARCH_MAX_CANDIDATES, SEARCH_MAX_FILE_SIZE
+from ..core.patterns import PatternTimeout, pattern_matcher
+from . import models
+
+# Document ids are (partition << PARTITION_BITS) + number within the partition
+PARTITION_BITS = 32
+
+# Ids per IN (...) query
+QUERY_SIZE = 500
+
+# Bodies read per query while filtering candidates with a pattern
+CANDIDATE_PAGE_SIZE = 200
+
+# Term frequency saturation and length normalisation of the BM25 score, and
+# the score of a term found in the file's path
+BM25_K1 = 1.2
+BM25_B = 0.75
+PATH_WEIGHT = 2.0
+
+# Characters of a matching line returned, around its first match
+LINE_LENGTH = 200
+
+QUERY_TERM = re.compile(r'"([^"]+)"|(\S+)')
+
+documents = models.SearchDocument.__table__
+search_index = table("search_index", column("rowid", Integer))
+search_paths = table("search_paths", column("rowid", Integer))
+
+# Inserts a document after the last one in its project's partition, or first
+# in a new partition after the last one (0 is never used). Reading and
+# writing in one statement, under SQLite's write lock, keeps the id unique
+# whatever else was written since the transaction began.
+INSERT_DOCUMENT = text(
+    f"""
+    INSERT INTO search_documents (id, file_id, project_id, body, path)
+    SELECT COALESCE(
+        (
+            SELECT MAX(id) + 1 FROM search_documents
+            WHERE id >= slot.start AND id < slot.start + {1 << PARTITION_BITS}
+        ),
+        slot.start
+    ), :file_id, :project_id, :body, (SELECT path FROM files WHERE id = :file_id)
+    FROM (
+        SELECT COALESCE(
+            (
+                SELECT id >> {PARTITION_BITS} << {PARTITION_BITS}
+                FROM search_documents WHERE project_id = :project_id LIMIT 1
+            ),
+            (
+                (SELECT COALESCE(MAX(id), 0) FROM search_documents)
+                >> {PARTITION_BITS}
+            ) + 1 << {PARTITION_BITS}
+        ) AS start
+    ) AS slot
+    """
+)
+
+
+class InvalidQuery(ValueError):
+    """Raised for a search that the index cannot answer."""
+
+
+def searchable(content: str, size: int):
+    """content as it is indexed: empty if it is not searchable."""
+    if size > SEARCH_MAX_FILE_SIZE or "\0" in content:
+        return ""
+    return content
+
+
+def blob_text(content_hash: Optional[str], size: int):
+    """The searchable text of a blob, or "". Blocking; reads the blob store."""
+    if content_hash is None or size > SEARCH_MAX_FILE_SIZE:
+        return ""
+    try:
+        data = blob_store.read(content_hash)
+    except BlobNotFound:
+        return ""
+    if b"\0" in data:
+        return ""
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return ""
+
+
+def index_files(db: Session, project_id: str, texts: list):
+    """Stage the documents of files in db's transaction.
+
+    texts holds (file id, text) pairs; a text of None removes the file's
+    document, as for a deleted file. The last text of a file wins. Documents
+    take the path of their file, so pending files are flushed first.
+    """
+    texts = dict(texts)
+    if not texts:
+        return
+    db.flush()
+    connection = db.connection()
+    file_ids = list(texts)
+    existing = {}
+    for start in range(0, len(file_ids), QUERY_SIZE):
+        existing.update(
+            connection.execute(
+                select(documents.c.file_id, documents.c.id).where(
+                    documents.c.file_id.in_(file_ids[start : start + QUERY_SIZE])
+                )
+            ).all()
+        )
+
+    removed = [
+        existing[f] for f, text in texts.items() if f in existing and text is None
+    ]
+    for start in range(0, len(removed), QUERY_SIZE):
+        connection.execute(
+            delete(documents).where(
+                documents.c.id.in_(removed[start : start + QUERY_SIZE])
+            )
+        )
+    changed = [
+        {"b_id": existing[f], "b_body": text}
+        for f, text in texts.items()
+        if f in existing and text is not None
+    ]
+    if changed:
+        connection.execute(
+            update(documents)
+            .where(documents.c.id == bindparam("b_id"))
+            .values(body=bindparam("b_body")),
+            changed,
+        )
+    added = [
+        {"file_id": f, "project_id": project_id, "body": text}
+        for f, text in texts.items()
+        if f not in existing and text is not None
+    ]
+    if added:
+        connection.execute(INSERT_DOCUMENT, added)
+
+
+def unindex_project(db: Session, project_id: str):
+    """Stage the removal of all of a project's documents."""
+    db.execute(delete(documents).where(documents.c.project_id == project_id))
+
+
+def _partition(connection, project_id: str):
+    """The project's partition, or None if it has no documents."""
+    first = connection.scalar(
+        select(documents.c.id).where(documents.c.project_id == project_id).limit(1)
+    )
+    return None if first is None else first >> PARTITION_BITS
+
+
+def parse_query(query: str):
+    """FTS5 phrases for query's indexed terms, and all its terms folded.
+
+    Terms are separated by whitespace; "double quotes" keep one with spaces
+    together. Files must contain every term, in their body or path. Terms of
+    fewer than three characters cannot be looked up in the index and are only
+    checked against the files it returns.
+    """
+    terms = [quoted or bare for quoted, bare in QUERY_TERM.findall(query)]
+    indexed = [term for term in terms if len(term) >= 3]
+    if not indexed:
+        raise InvalidQuery("Search for at least 3 characters")
+    phrases = ['"' + term.replace('"', '""') + '"' for term in indexed]
+    return phrases, [term.casefold() for term in terms]
+
+
+def matching_lines(body: str, terms: list, matches: Optional[list] = None):
+    """(line number, text) of body's lines that contain any term.
+
+    matches, (line number, position) pairs of a pattern's matches in body,
+    selects the lines instead.
+    """
+    if matches is not None:
+        positions = dict(matches)
+    lines = []
+    for number, line in enumerate(body.splitlines(), 1):
+        if matches is not None:
+            position = positions.get(number, -1)
+        else:
+            folded = line.casefold()
+            position = min(
+                (i for i in (folded.find(term) for term in terms) if i >= 0),
+                default=-1,
+            )
+        if position < 0:
+            continue
+        if len(line) > LINE_LENGTH:
+            start = max(0, min(position - LINE_LENGTH // 4, len(line) - LINE_LENGTH))
+            line = line[start : start + LINE_LENGTH]
+        lines.append((number, line))
+    return lines
+
+
+def _hits(index, phrase: str, start: int):
+    """Ids of the documents in the partition at start whose index has phrase."""
+    return select(index.c.rowid).where(
+        literal_column(index.name).match(phrase),
+        index.c.rowid >= start,
+        index.c.rowid < start + (1 << PARTITION_BITS),
+    )
+
+
+def rank(db: Session, project_id: str, phrases: list, terms: list):
+    """(document id, score) of the project's matches for phrases, best first.
+
+    A document matches a phrase found in its body or its path. Only the
+    SEARCH_MAX_CANDIDATES newest matches are ranked. Documents without every
+    term of fewer than three characters are left out.
+    """
+    connection = db.connection()
+    partition = _partition(connection, project_id)
+    if partition is None:
+        return []
+    start = partition << PARTITION_BITS
+    # Each phrase's matches in either index; SQLite cannot nest compound
+    # selects, so the unions are intersected as subqueries
+    matches = [
+        union(_hits(search_index, phrase, start), _hits(search_paths, phrase, start))
+        for phrase in phrases
+    ]
+    matches = [select(match.subquery().c.rowid) for match in matches]
+    found = (intersect(*matches) if len(matches) > 1 else matches[0]).subquery()
+    hits = (
+        select(found.c.rowid)
+        .order_by(found.c.rowid.desc())
+        .limit(SEARCH_MAX_CANDIDATES)
+        .subquery()
+    )
+    # Occurrences of each term, counted by SQLite without reading the bodies
+    # into Python. Bodies are folded like the terms (casefold(), see
+    # database.py), not with lower(), which leaves non-ASCII letters alone.
+    body = documents.c.body
+    folded = func.casefold(body)
+    counts = [
+        (func.length(folded) - func.length(func.replace(folded, term, ""))) / len(term)
+        for term in terms
+    ]
+    rows = connection.execute(
+        select(documents.c.id, models.File.path, func.length(body), *counts)
+        .select_from(hits)
+        .join(documents, documents.c.id == hits.c.rowid)
+        .join(models.File, models.File.id == documents.c.file_id)
+        .where(models.File.project_id == project_id)
+    ).all()
+    short = [i for i, term in enumerate(terms) if len(term) < 3]
+    rows = [
+        row
+        for row in rows
+        if all(row[3 + i] or terms[i] in row[1].casefold() for i in short)
+    ]
+    if not rows:
+        return []
+
+    average = sum(row[2] for row in rows) / len(rows) or 1
+    scored = []
+    for document_id, path, length, *tfs in rows:
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average)
+        score = sum(tf * (BM25_K1 + 1) / (tf + norm) for tf in tfs if tf)
+        score += PATH_WEIGHT * sum(term in path.casefold() for term in terms)
+        scored.append((-score, path, document_id))
+    # Ties in path order
+    scored.sort()
+    return [(document_id, -score) for score, _, document_id in scored]
+
+
+def candidates(db: Session, ranked: list):
+    """Metadata and body of the files of ranked (document id, score) pairs.
+
+    The ids come from rank(), which already checked the project; filtering on
+    it again here would make SQLite start from the project's files.
+    """
+    rows = db.execute(
+        select(
+            documents.c.id.label("document_id"),
+            models.File.id,
+            models.File.name,
+            models.File.path,
+            models.File.is_directory,
+            models.File.size,
+            models.File.version,
+            models.File.updated_at,
+            documents.c.body,
+        )
+        .join(models.File, models.File.id == documents.c.file_id)
+        .where(documents.c.id.in_([document_id for document_id, _ in ranked]))
+    ).all()
+    by_id = {row.document_id: row for row in rows}
+    return [(by_id[d], score) for d, score in ranked if d in by_id]
+
+
+def search_results(
+    candidates: list,
+    terms: list,
+    pattern: Optional[re.Pattern],
+    max_lines: int,
+    deadline: Optional[float] = None,
+):
+    """Results for the (row, score) candidates that match pattern, if any.
+
+    Each is the file's metadata plus "score", "matches" (the number of
+    matching lines) and up to max_lines of those lines. CPU-bound. Raises
+    InvalidQuery if matching pattern is not done by deadline (a
+    time.monotonic() value).
+    """
+    matches = [None] * len(candidates)
+    if pattern is not None:
+        try:
+            matches = pattern_matcher.match(
+                pattern, [row.body for row, _ in candidates], deadline
+            )
+        except PatternTimeout:
+            raise InvalidQuery("The regex takes too long to match; simplify it")
+    results = []
+    for (row, score), found in zip(candidates, matches):
+        lines = matching_lines(row.body, terms, found)
+        if pattern is not None and not lines:
+            continue
+        results.append(
+            {
+                "id": row.id,
+                "name": row.name,
+                "path": row.path,
+                "is_directory": row.is_directory,
+                "size": row.size,
+                "version": row.version,
+                "updated_at": row.updated_at,
+                "score": round(score, 3),
+                "matches": len(lines),
+                "lines": [
+                    {"line": number, "text": text} for number, text in lines[:max_lines]
+                ],
+            }
+        )
+    return results
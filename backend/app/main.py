@@ -6,16 +6,29 @@ Contains the FastAPI application definition and all route configurations.
 import asyncio
 import os
 
-import docker
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from .core.changes import file_changes
+from .core.config import (
+    DOCKER_HEALTH_CHECK_INTERVAL,
+    RUNTIME_IMAGE_RETRY_INTERVAL,
+    RUNTIME_IMAGE_RETRY_MAX,
+)
+from .core.docker import container_pools, docker_executor, docker_hosts, runtime_images
+from .core.sync import workspace_sync
+
 # Import database modules
-from .db.database import engine
-from .db.models import Base
+from .db.database import async_engine
 
 # Import route handlers
-from .routes import auth, files, health, projects, terminal
+from .routes import admin, auth, files, health, projects, terminal
+from .utils.cleanup import (
+    cleanup_inactive_sessions,
+    cleanup_unused_blobs,
+    renew_registry_lease,
+)
+from .utils.migration import run_migrations
 
 # Application version
 APP_VERSION = "1.0.0"
@@ -39,6 +52,8 @@ def create_app() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        # Lets the browser client read ETags for conditional requests
+        expose_headers=["ETag"],
     )
 
     # Set data directory based on environment
@@ -58,217 +73,83 @@ def create_app() -> FastAPI:
     # Create data directory if it doesn't exist
     os.makedirs(DATA_DIR, exist_ok=True)
 
-    global docker_client, user_sessions
-    docker_client = docker.from_env()
-    user_sessions = {}
-
-    # Create database tables at startup
+    # Bring the database schema up to date at startup
     @app.on_event("startup")
-    async def create_tables():
-        Base.metadata.create_all(bind=engine)
-        print("Database tables created")
+    async def migrate_database():
+        await asyncio.to_thread(run_migrations)
+        print("Database migrations applied")
 
     # Include route modules
     app.include_router(files.router, prefix="/api")
     app.include_router(auth.router, prefix="/api/auth")
     app.include_router(projects.router, prefix="/api")
     app.include_router(terminal.router, prefix="/api")
+    # The web client connects to /ws/{user_id}/{project_id} without the prefix
+    app.include_router(terminal.router)
     app.include_router(health.router)
+    app.include_router(admin.router, prefix="/admin")
 
     @app.get("/")
     def read_root():
         return {"message": "Web Terminal API is running", "version": APP_VERSION}
 
-    @app.websocket("/ws/{user_id}/{project_id}")
-    async def terminal_ws(websocket: WebSocket, user_id: str, project_id: str):
-        await websocket.accept()
-
-        try:
-            # Send a welcome message to confirm connection
-            await websocket.send_text("Connected to terminal. Starting container...\n")
-
-            # Create user and project directory if it doesn't exist
-            user_project_dir = os.path.join(DATA_DIR, user_id, project_id)
-            os.makedirs(user_project_dir, exist_ok=True)
-
-            # Get absolute path for Docker volume mount
-            # This is critical for Docker Desktop on macOS
-            host_path = os.path.abspath(user_project_dir)
-            if os.environ.get("HOST_DATA_DIR"):
-                # If running in Docker, we need to map the container path to host path
-                container_path = os.path.join(DATA_DIR, user_id, project_id)
-                host_path = container_path.replace(
-                    DATA_DIR, os.environ.get("HOST_DATA_DIR")
-                )
-                print(
-                    f"Mounting volume: Container path {container_path} -> Host path {host_path}"
-                )
-
-            # Ensure everyone can read/write to this directory
-            os.system(f"chmod -R 777 {user_project_dir}")
-
-            # Create a unique session key from user_id and project_id
-            session_key = f"{user_id}:{project_id}"
-
-            # Create or get user session
-            if session_key not in user_sessions:
-                # Create a new Docker container for this session with volume mount
-                print(f"Creating container with volume mount: {host_path}:/workspace")
-                container = docker_client.containers.run(
-                    "python:3.12-slim",
-                    command="bash",
-                    stdin_open=True,
-                    tty=True,
-                    detach=True,
-                    remove=True,  # Auto-remove when stopped
-                    volumes={host_path: {"bind": "/workspace", "mode": "rw"}},
-                    working_dir="/workspace",
-                    environment={
-                        "USER_ID": user_id,
-                        "PROJECT_ID": project_id,
-                        "TERM": "xterm-256color",
-                    },
-                )
-                container.exec_run("pip install numpy pandas scipy")
-
-                # Store session info
-                user_sessions[session_key] = {
-                    "container": container,
-                    "container_id": container.id,
-                    "last_active": asyncio.get_event_loop().time(),
-                }
-
-                await websocket.send_text(
-                    f"Container started with ID: {container.id[:12]}\n"
+    # On every host that takes new sessions, build the runtime image if its
+    # manifest changed, then keep the pool of pre-warmed containers topped up
+    # in the background. A failed build is retried with backoff; meanwhile
+    # containers start from the base image and install the packages.
+    @app.on_event("startup")
+    async def start_container_pool():
+        async def prepare_runtime(name):
+            image = runtime_images[name]
+            ready = await docker_executor.run("build", image.ensure)
+            container_pools[name].start()
+            while not ready:
+                await asyncio.sleep(
+                    image.retry_delay(
+                        RUNTIME_IMAGE_RETRY_INTERVAL, RUNTIME_IMAGE_RETRY_MAX
+                    )
                 )
+                ready = await docker_executor.run("build", image.ensure)
 
-            session = user_sessions[session_key]
-            container = session["container"]
-            # Update last active timestamp
-            session["last_active"] = asyncio.get_event_loop().time()
-
-            # Function to execute commands and stream output
-            async def execute_command(cmd):
-                exec_result = container.exec_run(cmd, stream=True, demux=True)
+        for name, host in docker_hosts.hosts.items():
+            if not host.draining:
+                asyncio.create_task(prepare_runtime(name))
 
-                for chunk in exec_result.output:
-                    stdout, stderr = chunk
-                    if stdout:
-                        await websocket.send_text(
-                            stdout.decode("utf-8", errors="ignore")
-                        )
-                    if stderr:
-                        await websocket.send_text(
-                            stderr.decode("utf-8", errors="ignore")
-                        )
-
-            # Send initial container info and prompt
-            await execute_command(
-                "echo 'Web Terminal ready. Type commands and press Enter. Your files are stored in /workspace'"
+    @app.on_event("startup")
+    async def start_host_health_checks():
+        asyncio.create_task(
+            docker_hosts.run_health_checks(
+                docker_executor, DOCKER_HEALTH_CHECK_INTERVAL
             )
-            await websocket.send_text("\n$ ")
-
-            # Process commands from the client
-            while True:
-                cmd = await websocket.receive_text()
-                # Update last active timestamp
-                session["last_active"] = asyncio.get_event_loop().time()
-
-                if cmd.strip().lower() in ["exit", "quit"]:
-                    await websocket.send_text("Closing session...\n")
-                    break
-
-                if cmd.strip():
-                    # Log command for debugging
-                    print(f"Executing command: {cmd}")
-
-                    try:
-                        # Execute the command without streaming for more reliable output
-                        exec_result = container.exec_run(
-                            cmd=f"/bin/bash -c '{cmd}'",
-                            demux=True,  # Split stdout and stderr
-                        )
-
-                        # Output the results
-                        exit_code = exec_result.exit_code
-                        stdout, stderr = exec_result.output
-
-                        print(f"Command exit code: {exit_code}")
-
-                        if stdout:
-                            stdout_text = stdout.decode("utf-8", errors="ignore")
-                            print(f"STDOUT: {stdout_text}")
-                            await websocket.send_text(stdout_text)
-
-                        if stderr:
-                            stderr_text = stderr.decode("utf-8", errors="ignore")
-                            print(f"STDERR: {stderr_text}")
-                            await websocket.send_text(stderr_text)
-
-                        if not stdout and not stderr:
-                            print("No output from command")
-
-                    except Exception as e:
-                        error_msg = f"Error executing command: {str(e)}\n"
-                        print(error_msg)
-                        await websocket.send_text(error_msg)
+        )
 
-                    # Send a new prompt
-                    await websocket.send_text("$ ")
+    @app.on_event("shutdown")
+    async def stop_container_pool():
+        await asyncio.gather(*(pool.shutdown() for pool in container_pools.values()))
+        docker_executor.shutdown()
 
-        except WebSocketDisconnect:
-            # Clean up resources
-            session_key = f"{user_id}:{project_id}"
-            if session_key in user_sessions:
-                try:
-                    session = user_sessions[session_key]
-                    session["container"].stop()
-                    del user_sessions[session_key]
-                except Exception as e:
-                    print(f"Error cleaning up: {str(e)}")
+    # Sync project workspaces with the files table while they have sessions,
+    # and publish file changes to subscribed clients
+    @app.on_event("startup")
+    async def start_workspace_sync():
+        file_changes.start()
+        workspace_sync.start()
 
-        except Exception as e:
-            # Handle other exceptions
-            try:
-                await websocket.send_text(f"Error: {str(e)}\n")
-            except:
-                pass
+    @app.on_event("shutdown")
+    async def stop_workspace_sync():
+        await workspace_sync.stop()
+        file_changes.stop()
 
-            # Clean up
-            session_key = f"{user_id}:{project_id}"
-            if session_key in user_sessions:
-                try:
-                    session = user_sessions[session_key]
-                    session["container"].stop()
-                    del user_sessions[session_key]
-                except:
-                    pass
+    @app.on_event("shutdown")
+    async def close_database():
+        await async_engine.dispose()
 
     # Start a background task to clean up inactive sessions
     @app.on_event("startup")
     async def start_cleanup_task():
         asyncio.create_task(cleanup_inactive_sessions())
-
-    async def cleanup_inactive_sessions():
-        while True:
-            current_time = asyncio.get_event_loop().time()
-            to_remove = []
-
-            for session_key, session in user_sessions.items():
-                # If session is inactive for more than 30 minutes
-                if current_time - session["last_active"] > 1800:  # 30 minutes
-                    try:
-                        session["container"].stop()
-                        to_remove.append(session_key)
-                    except Exception as e:
-                        print(f"Error stopping container: {str(e)}")
-
-            # Remove stopped sessions
-            for session_key in to_remove:
-                del user_sessions[session_key]
-
-            # Check every 5 minutes
-            await asyncio.sleep(300)
+        asyncio.create_task(cleanup_unused_blobs())
+        asyncio.create_task(renew_registry_lease())
 
     return app
 
@@ -0,0 +1,48 @@
+import secrets
+
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+
+from ..core.config import ADMIN_TOKEN
+from ..core.docker import docker_hosts, session_registry
+
+router = APIRouter()
+
+
+def require_admin(authorization: str = Header(None)):
+    """Accept requests carrying "Bearer <ADMIN_TOKEN>".
+
+    Without an ADMIN_TOKEN the admin API is disabled.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin API is disabled")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(
+        token.encode(), ADMIN_TOKEN.encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid admin token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+def set_draining(name: str, draining: bool):
+    if name not in docker_hosts.hosts:
+        raise HTTPException(status_code=404, detail="Unknown Docker host")
+    session_registry.set_draining(name, draining)
+    return {"host": name, "draining": draining}
+
+
+@router.put("/hosts/{name}/drain", dependencies=[Depends(require_admin)])
+def drain_host(name: str):
+    """Stop placing new sessions on a Docker host; its sessions keep running."""
+    return set_draining(name, True)
+
+
+@router.delete("/hosts/{name}/drain", dependencies=[Depends(require_admin)])
+def undrain_host(name: str):
+    """Place new sessions on a drained Docker host again.
+
+    A host drained in DOCKER_HOSTS stays drained.
+    """
+    return set_draining(name, False)
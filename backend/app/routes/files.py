@@ -1,33 +1,252 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import json
+import re
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..db.database import get_db
-from ..db.repository import FileRepository, ProjectRepository
-from ..schemas.projects import File, FileCreate
+from ..core.blobs import BlobNotFound, blob_store
+from ..core.changes import SNAPSHOT, file_changes
+from ..core.config import FEED_KEEPALIVE
+from ..db.database import AsyncSessionLocal, get_async_db
+from ..db.repository import (
+    AsyncFileRepository,
+    AsyncProjectRepository,
+    BatchRejected,
+    VersionConflict,
+)
+from ..db.search import InvalidQuery
+from ..schemas.projects import (
+    File,
+    FileBatch,
+    FileBatchResult,
+    FileCreate,
+    FileMetadata,
+    FileMove,
+    FileMoveResult,
+    FilePage,
+    FilePatch,
+    SearchResults,
+)
+from ..utils.delta import InvalidDelta
 
 router = APIRouter()
 
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+
+# Files per page of a metadata listing, by default and at most
+FILE_PAGE_SIZE = 200
+MAX_FILE_PAGE_SIZE = 1000
+
+# Operations accepted in one batch request
+MAX_BATCH_OPERATIONS = 5000
+
+# Files per search, by default and at most
+SEARCH_RESULTS = 50
+MAX_SEARCH_RESULTS = 200
+
+
+async def file_response(file):
+    """The file as returned by the API, with its body read from the blob store."""
+    return {
+        "id": file.id,
+        "project_id": file.project_id,
+        "name": file.name,
+        "path": file.path,
+        "is_directory": file.is_directory,
+        "size": file.size,
+        "version": file.version,
+        "created_at": file.created_at,
+        "updated_at": file.updated_at,
+        "content": await AsyncFileRepository.get_file_content(file),
+    }
+
 
 @router.get("/projects/{project_id}/files", response_model=List[File])
-def get_project_files(project_id: str, db: Session = Depends(get_db)):
+async def get_project_files(project_id: str, db: AsyncSession = Depends(get_async_db)):
     """Get all files for a project"""
     # Check if project exists
-    project = ProjectRepository.get_project(db, project_id)
+    project = await AsyncProjectRepository.get_project(db, project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    files = await AsyncFileRepository.get_project_files(db, project_id)
+    return await asyncio.gather(*(file_response(file) for file in files))
+
+
+def encode_cursor(path: str):
+    return base64.urlsafe_b64encode(path.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    try:
+        return base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+    except (binascii.Error, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def listing_etag(project, cursor: str, limit: int):
+    """Strong ETag of one page of a project's file listing.
+
+    It changes whenever any of the project's files does, so it can be checked
+    against the project row alone.
+    """
+    key = f"{project.id}:{project.files_version}:{cursor or ''}:{limit}"
+    return f'"{hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]}"'
+
+
+def version_conflict(error: VersionConflict):
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail={"message": "File has changed", "version": error.version},
+    )
+
+
+@router.get("/projects/{project_id}/files/metadata", response_model=FilePage)
+async def get_project_file_metadata(
+    project_id: str,
+    response: Response,
+    cursor: str = Query(None),
+    limit: int = Query(FILE_PAGE_SIZE, ge=1, le=MAX_FILE_PAGE_SIZE),
+    if_none_match: str = Header(None),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """List a project's files without their content, ordered by path.
+
+    Pages are linked by next_cursor. Content is fetched per file from
+    GET /files/{file_id}.
+    """
+    project = await AsyncProjectRepository.get_project(db, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
-    return FileRepository.get_project_files(db, project_id)
+    # Clients revalidate with If-None-Match; unchanged projects are answered
+    # without reading the files table
+    etag = listing_etag(project, cursor, limit)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    after_path = decode_cursor(cursor) if cursor else None
+    rows = await AsyncFileRepository.get_project_file_page(
+        db, project_id, after_path, limit + 1
+    )
+    next_cursor = encode_cursor(rows[limit - 1].path) if len(rows) > limit else None
+    response.headers.update(headers)
+    return {
+        "files": [row._asdict() for row in rows[:limit]],
+        "next_cursor": next_cursor,
+    }
+
+
+def sse(event: str, data, event_id: int = None):
+    """One server-sent event."""
+    if event_id is None:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def tree_snapshot(project_id: str):
+    """Metadata of all of a project's files, for a subscriber that fell behind."""
+    # Events up to seq were committed before the tree is read
+    seq = file_changes.position
+    files = []
+    after_path = None
+    async with AsyncSessionLocal() as db:
+        while True:
+            rows = await AsyncFileRepository.get_project_file_page(
+                db, project_id, after_path, MAX_FILE_PAGE_SIZE
+            )
+            files.extend(jsonable_encoder(row._asdict()) for row in rows)
+            if len(rows) < MAX_FILE_PAGE_SIZE:
+                break
+            after_path = rows[-1].path
+    return {"seq": seq, "files": files}
+
+
+@router.get("/projects/{project_id}/files/events")
+async def stream_file_events(
+    project_id: str,
+    last_event_id: str = Header(None),
+):
+    """Stream changes to a project's files as server-sent events.
+
+    A "ready" event is sent first. Each change is then sent as a "change"
+    event (see core/changes.py); a client that falls behind is sent one
+    "snapshot" event with the whole file tree instead. Events carry their seq
+    as id; a client reconnecting with Last-Event-ID is first sent the changes
+    it missed, or a snapshot.
+    """
+    # Not a request-scoped session: that would hold a pooled connection for
+    # as long as the stream stays open
+    async with AsyncSessionLocal() as db:
+        project = await AsyncProjectRepository.get_project(db, project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    async def events():
+        # Subscribe before reading the backlog, so nothing falls in between;
+        # events sent already are skipped by their seq
+        subscription = file_changes.subscribe(project_id)
+        try:
+            last = file_changes.position
+            backlog = []
+            if last_event_id is not None:
+                try:
+                    last = int(last_event_id)
+                    backlog = await file_changes.backlog(project_id, last)
+                except ValueError:
+                    backlog = SNAPSHOT
+            yield sse("ready", {"seq": last}, last)
+            batch = backlog
+            while True:
+                if batch is SNAPSHOT:
+                    snapshot = await tree_snapshot(project_id)
+                    last = snapshot["seq"]
+                    yield sse("snapshot", snapshot, last)
+                elif batch:
+                    batch = [event for event in batch if event["seq"] > last]
+                    if batch:
+                        last = batch[-1]["seq"]
+                        yield "".join(
+                            sse("change", event, event["seq"]) for event in batch
+                        )
+                batch = await subscription.get(FEED_KEEPALIVE)
+                if not batch:
+                    # Keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+        finally:
+            file_changes.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get("/files/{file_id}", response_model=File)
-def get_file(file_id: str, db: Session = Depends(get_db)):
+async def get_file(file_id: str, db: AsyncSession = Depends(get_async_db)):
     """Get file details"""
-    file = FileRepository.get_file(db, file_id)
+    file = await AsyncFileRepository.get_file(db, file_id)
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
-    return file
+    return await file_response(file)
 
 
 @router.post(
@@ -35,21 +254,25 @@ def get_file(file_id: str, db: Session = Depends(get_db)):
     response_model=File,
     status_code=status.HTTP_201_CREATED,
 )
-def create_file(project_id: str, file: FileCreate, db: Session = Depends(get_db)):
+async def create_file(
+    project_id: str, file: FileCreate, db: AsyncSession = Depends(get_async_db)
+):
     """Create a new file for a project"""
     # Check if project exists
-    project = ProjectRepository.get_project(db, project_id)
+    project = await AsyncProjectRepository.get_project(db, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
     # Check if file with the same path already exists
-    existing_file = FileRepository.get_file_by_path(db, project_id, file.path)
+    existing_file = await AsyncFileRepository.get_file_by_path(
+        db, project_id, file.path
+    )
     if existing_file:
         raise HTTPException(
             status_code=400, detail="File with this path already exists"
         )
 
-    return FileRepository.create_file(
+    db_file = await AsyncFileRepository.create_file(
         db,
         project_id=project_id,
         name=file.name,
@@ -57,22 +280,244 @@ def create_file(project_id: str, file: FileCreate, db: Session = Depends(get_db)
         content=file.content,
         is_directory=file.is_directory,
     )
+    return await file_response(db_file)
+
+
+@router.post("/projects/{project_id}/files/batch", response_model=FileBatchResult)
+async def apply_file_batch(
+    project_id: str, batch: FileBatch, db: AsyncSession = Depends(get_async_db)
+):
+    """Create, update, rename and delete files in one transaction.
+
+    Operations are applied in order and all or none of them take effect. If
+    any fails, the response has the status of the first failure and a result
+    per operation in its detail.
+    """
+    if len(batch.operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_OPERATIONS} operations per batch",
+        )
+    project = await AsyncProjectRepository.get_project(db, project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    try:
+        results = await AsyncFileRepository.apply_batch(
+            db, project_id, batch.operations
+        )
+    except BatchRejected as e:
+        raise HTTPException(
+            status_code=e.status,
+            detail={"message": "No operations were applied", "results": e.results},
+        )
+    return {"results": results}
+
+
+@router.post("/projects/{project_id}/files/move", response_model=FileMoveResult)
+async def move_files(
+    project_id: str, move: FileMove, db: AsyncSession = Depends(get_async_db)
+):
+    """Move a file or a directory with everything under it to a new path.
+
+    A directory needs no row of its own: every file whose path starts with
+    "<path>/" moves. The workspace copy is moved with a single rename.
+    """
+    project = await AsyncProjectRepository.get_project(db, project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    path, new_path = move.path.rstrip("/"), move.new_path.rstrip("/")
+    if not path or not new_path:
+        raise HTTPException(status_code=400, detail="Paths cannot be empty")
+    if new_path == path or new_path.startswith(path + "/"):
+        raise HTTPException(status_code=400, detail="Cannot move a path into itself")
+    if await AsyncFileRepository.path_taken(db, project_id, new_path):
+        moved = None
+    else:
+        moved = await AsyncFileRepository.move_path(db, project_id, path, new_path)
+    if moved is None:
+        raise HTTPException(status_code=400, detail="Destination already exists")
+    if not moved:
+        raise HTTPException(status_code=404, detail="File not found")
+    return {"moved": moved}
+
+
+@router.get("/projects/{project_id}/search", response_model=SearchResults)
+async def search_files(
+    project_id: str,
+    q: str = Query(..., min_length=1, max_length=1000),
+    regex: str = Query(None, max_length=1000),
+    limit: int = Query(SEARCH_RESULTS, ge=1, le=MAX_SEARCH_RESULTS),
+    lines: int = Query(5, ge=0, le=100),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Search the contents of a project's files.
+
+    Files must contain every term of q in their content or path
+    (case-insensitive substrings of at least three characters; quote a term
+    to include spaces). With regex, only files with a line matching it are
+    returned, and those are the lines shown; a regex that takes longer than
+    SEARCH_REGEX_TIMEOUT seconds to match fails the search with 400.
+    """
+    project = await AsyncProjectRepository.get_project(db, project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    pattern = None
+    if regex:
+        try:
+            pattern = re.compile(regex)
+        except re.error as e:
+            raise HTTPException(status_code=400, detail=f"Invalid regex: {e}")
+    try:
+        results = await AsyncFileRepository.search_files(
+            db, project_id, q, pattern, limit, lines
+        )
+    except InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"results": results}
 
 
 @router.put("/files/{file_id}/content", response_model=File)
-def update_file_content(file_id: str, content: dict, db: Session = Depends(get_db)):
-    """Update file content"""
-    file = FileRepository.get_file(db, file_id)
+async def update_file_content(
+    file_id: str, content: dict, db: AsyncSession = Depends(get_async_db)
+):
+    """Update file content
+
+    If the body has a base_version, the update is rejected with 409 when the
+    file has changed since that version.
+    """
+    file = await AsyncFileRepository.get_file(db, file_id)
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
 
-    return FileRepository.update_file_content(db, file_id, content.get("content", ""))
+    try:
+        file = await AsyncFileRepository.update_file_content(
+            db, file_id, content.get("content", ""), content.get("base_version")
+        )
+    except VersionConflict as e:
+        raise version_conflict(e)
+    return await file_response(file)
+
+
+@router.patch("/files/{file_id}/content", response_model=FileMetadata)
+async def patch_file_content(
+    file_id: str, patch: FilePatch, db: AsyncSession = Depends(get_async_db)
+):
+    """Apply edits to the file's content at patch.base_version
+
+    Only the changed ranges are sent, instead of the whole file. A patch
+    against a version other than the current one is rejected with 409; the
+    client then has to catch up on the newer content first.
+    """
+    file = await AsyncFileRepository.get_file(db, file_id)
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+    if file.is_directory:
+        raise HTTPException(status_code=400, detail="Directories have no content")
+
+    edits = [(edit.start, edit.end, edit.text) for edit in patch.edits]
+    try:
+        file = await AsyncFileRepository.patch_file_content(
+            db, file_id, patch.base_version, edits
+        )
+    except VersionConflict as e:
+        raise version_conflict(e)
+    except InvalidDelta as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+    return file
+
+
+@router.put("/files/{file_id}/blob", response_model=File)
+async def upload_file_blob(
+    file_id: str, request: Request, db: AsyncSession = Depends(get_async_db)
+):
+    """Replace a file's content with the raw request body, streamed to disk"""
+    file = await AsyncFileRepository.get_file(db, file_id)
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+    if file.is_directory:
+        raise HTTPException(status_code=400, detail="Directories have no content")
+
+    writer = await asyncio.to_thread(blob_store.writer)
+    try:
+        async for chunk in request.stream():
+            await asyncio.to_thread(writer.write, chunk)
+        content_hash, size = await asyncio.to_thread(writer.commit)
+    except BaseException:
+        await asyncio.to_thread(writer.abort)
+        raise
+
+    file = await AsyncFileRepository.set_file_blob(db, file_id, content_hash, size)
+    if not file:
+        # Deleted while the body was uploading
+        raise HTTPException(status_code=404, detail="File not found")
+    # The body may be large or binary; fetch it from the blob endpoint
+    return dict(await file_response(file), content=None)
+
+
+@router.get("/files/{file_id}/blob")
+async def download_file_blob(
+    file_id: str,
+    range_header: str = Header(None, alias="Range"),
+    if_none_match: str = Header(None),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Stream a file's raw content. Supports a single byte range."""
+    file = await AsyncFileRepository.get_file(db, file_id)
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    etag = f'"{file.content_hash}"'
+    headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+    if if_none_match == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if file.content_hash is None:
+        return Response(b"", media_type="application/octet-stream", headers=headers)
+
+    start, end = 0, file.size
+    status_code = status.HTTP_200_OK
+    match = RANGE_PATTERN.match(range_header or "")
+    if match and any(match.groups()):
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last) + 1, file.size) if last else file.size
+        else:
+            # bytes=-n is the last n bytes
+            start = max(file.size - int(last), 0)
+        if start >= end:
+            raise HTTPException(
+                status_code=416,
+                headers={"Content-Range": f"bytes */{file.size}"},
+            )
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{file.size}"
+
+    try:
+        chunks = await asyncio.to_thread(
+            blob_store.iter_chunks, file.content_hash, start, end
+        )
+    except BlobNotFound:
+        raise HTTPException(status_code=404, detail="File content not found")
+    headers["Content-Length"] = str(end - start)
+    return StreamingResponse(
+        chunks,
+        status_code=status_code,
+        media_type="application/octet-stream",
+        headers=headers,
+    )
 
 
 @router.put("/files/{file_id}/rename", response_model=File)
-def rename_file(file_id: str, name_data: dict, db: Session = Depends(get_db)):
+async def rename_file(
+    file_id: str, name_data: dict, db: AsyncSession = Depends(get_async_db)
+):
     """Rename a file"""
-    file = FileRepository.get_file(db, file_id)
+    file = await AsyncFileRepository.get_file(db, file_id)
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
 
@@ -85,8 +530,27 @@ def rename_file(file_id: str, name_data: dict, db: Session = Depends(get_db)):
     path_parts[-1] = new_name
     new_path = "/".join(path_parts)
 
+    if file.is_directory:
+        if new_path == file.path:
+            return await file_response(file)
+        # Everything under the directory moves along with it
+        if await AsyncFileRepository.path_taken(db, file.project_id, new_path):
+            moved = None
+        else:
+            moved = await AsyncFileRepository.move_path(
+                db, file.project_id, file.path, new_path
+            )
+        if moved is None:
+            raise HTTPException(
+                status_code=400,
+                detail="File with this name already exists in the same directory",
+            )
+        return await file_response(file)
+
     # Check if new path already exists
-    existing_file = FileRepository.get_file_by_path(db, file.project_id, new_path)
+    existing_file = await AsyncFileRepository.get_file_by_path(
+        db, file.project_id, new_path
+    )
     if existing_file and existing_file.id != file_id:
         raise HTTPException(
             status_code=400,
@@ -94,17 +558,20 @@ def rename_file(file_id: str, name_data: dict, db: Session = Depends(get_db)):
         )
 
     # Update file name and path
-    return FileRepository.update_file_name_and_path(db, file_id, new_name, new_path)
+    file = await AsyncFileRepository.update_file_name_and_path(
+        db, file_id, new_name, new_path
+    )
+    return await file_response(file)
 
 
 @router.delete("/files/{file_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_file(file_id: str, db: Session = Depends(get_db)):
+async def delete_file(file_id: str, db: AsyncSession = Depends(get_async_db)):
     """Delete a file"""
-    file = FileRepository.get_file(db, file_id)
+    file = await AsyncFileRepository.get_file(db, file_id)
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
 
-    result = FileRepository.delete_file(db, file_id)
+    result = await AsyncFileRepository.delete_file(db, file_id)
     if not result:
         raise HTTPException(status_code=500, detail="Failed to delete file")
     return None
@@ -1,9 +1,65 @@
 from fastapi import APIRouter
 
+from ..core.auth_cache import auth_cache
+from ..core.blobs import blob_store
+from ..core.changes import file_changes
+from ..core.docker import (
+    WORKER_ID,
+    container_pools,
+    docker_executor,
+    docker_hosts,
+    runtime_images,
+    scrollback_budget,
+    session_admission,
+    session_expiry,
+    session_registry,
+    session_snapshot,
+)
+from ..core.output import frame_snapshot
+from ..core.patterns import pattern_matcher
+from ..core.streaming import stream_stats
+from ..core.sync import workspace_sync
+
 router = APIRouter()
 
 
 @router.get("/health")
 def health_check():
-    """Health check endpoint."""
+    """Health check endpoint.
+
+    "degraded" while a host's runtime image cannot be built: its containers
+    start from the base image and install the packages until a retry works.
+    """
+    errors = {
+        name: image.error for name, image in runtime_images.items() if image.error
+    }
+    if errors:
+        return {"status": "degraded", "runtime_image_errors": errors}
     return {"status": "healthy"}
+
+
+@router.get("/metrics")
+def metrics():
+    """Runtime metrics for the terminal backend."""
+    return {
+        "hosts": docker_hosts.snapshot(
+            session_registry.host_loads(), session_registry.draining_hosts()
+        ),
+        "pool": {name: pool.snapshot() for name, pool in container_pools.items()},
+        "runtime_image": {
+            name: image.snapshot() for name, image in runtime_images.items()
+        },
+        "docker": docker_executor.snapshot(),
+        "exec_streams": dict(stream_stats),
+        "output_frames": frame_snapshot(),
+        "scrollback": scrollback_budget.snapshot(),
+        "session_expiry": session_expiry.snapshot(),
+        "sessions": session_snapshot(),
+        "admission": session_admission.snapshot(),
+        "registry": dict(session_registry.snapshot(), worker=WORKER_ID),
+        "blobs": blob_store.snapshot(),
+        "workspace_sync": workspace_sync.snapshot(),
+        "file_changes": file_changes.snapshot(),
+        "auth_cache": auth_cache.snapshot(),
+        "search_regex": pattern_matcher.snapshot(),
+    }
@@ -1,14 +1,18 @@
+import asyncio
 import os
-from typing import List
+import re
+from typing import List, Literal, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..core import archive
 from ..core.auth import get_current_user
-from ..db.database import get_db
+from ..db.database import get_async_db
 from ..db.models import User
-from ..db.repository import ProjectRepository
-from ..schemas.projects import Project, ProjectCreate
+from ..db.repository import AsyncProjectRepository, ImportIncomplete
+from ..schemas.projects import Project, ProjectCreate, ProjectImportResult
 
 router = APIRouter()
 
@@ -22,21 +26,22 @@ DATA_DIR = os.environ.get("DATA_DIR") or os.path.join(
 # Projects endpoints with authentication
 @router.get("/projects", response_model=List[Project])
 async def get_user_projects(
-    current_user: User = Depends(get_current_user), db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Get all projects for the current authenticated user"""
-    return ProjectRepository.get_user_projects(db, current_user.id)
+    return await AsyncProjectRepository.get_user_projects(db, current_user.id)
 
 
 @router.post("/projects", response_model=Project, status_code=status.HTTP_201_CREATED)
 async def create_project(
     project: ProjectCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Create a new project for the current authenticated user"""
     # Create project in database
-    created_project = ProjectRepository.create_project(
+    created_project = await AsyncProjectRepository.create_project(
         db, name=project.name, user_id=current_user.id, description=project.description
     )
 
@@ -51,10 +56,10 @@ async def create_project(
 async def get_project(
     project_id: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Get project details for the current authenticated user"""
-    project = ProjectRepository.get_project(db, project_id)
+    project = await AsyncProjectRepository.get_project(db, project_id)
 
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
@@ -72,11 +77,11 @@ async def get_project(
 async def delete_project(
     project_id: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Delete a project for the current authenticated user"""
     # First check if project exists and belongs to user
-    project = ProjectRepository.get_project(db, project_id)
+    project = await AsyncProjectRepository.get_project(db, project_id)
 
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
@@ -87,7 +92,74 @@ async def delete_project(
         )
 
     # Delete the project
-    ProjectRepository.delete_project(db, project_id)
+    await AsyncProjectRepository.delete_project(db, project_id)
 
     # For POC we'll keep files on disk as backup
     # In production you might want to delete them as well
+
+
+async def owned_project(db: AsyncSession, project_id: str, user: User):
+    project = await AsyncProjectRepository.get_project(db, project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if project.user_id != user.id:
+        raise HTTPException(
+            status_code=403, detail="Not authorized to access this project"
+        )
+    return project
+
+
+@router.get("/projects/{project_id}/export")
+async def export_project(
+    project_id: str,
+    archive_format: Literal["tar", "tar.gz", "zip"] = Query("zip", alias="format"),
+    source: Literal["database", "workspace"] = "database",
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Download the project as an archive, built while it is sent"""
+    project = await owned_project(db, project_id, current_user)
+    chunks = archive.export_archive(project.user_id, project_id, archive_format, source)
+    filename = re.sub(r"[^\w.-]+", "_", project.name).strip("._") or project_id
+    # No Content-Length: the size is not known until the archive is built
+    return StreamingResponse(
+        chunks,
+        media_type=archive.FORMATS[archive_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}.{archive_format}"'
+        },
+    )
+
+
+@router.post("/projects/{project_id}/import", response_model=ProjectImportResult)
+async def import_project(
+    project_id: str,
+    request: Request,
+    archive_format: Optional[Literal["tar", "tar.gz", "zip"]] = Query(
+        None, alias="format"
+    ),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Add the files of an archive, sent as the request body, to the project"""
+    await owned_project(db, project_id, current_user)
+    # The archive is parsed in a worker thread as the body arrives
+    stream = archive.StreamReader(request.stream(), asyncio.get_running_loop())
+    try:
+        return await asyncio.to_thread(
+            archive.import_archive, project_id, stream, archive_format
+        )
+    except archive.ArchiveTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except archive.InvalidArchive as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ImportIncomplete as e:
+        print(f"Import into project {project_id} failed: {e.__cause__}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "message": "Import failed partway; the entries counted were applied",
+                "applied": e.applied,
+                **e.counts,
+            },
+        )
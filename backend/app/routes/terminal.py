@@ -1,43 +1,150 @@
 import asyncio
+import json
 
-from fastapi import APIRouter, Depends, Query, WebSocket, WebSocketDisconnect
-from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Query, WebSocket, WebSocketDisconnect
 
-from ..core.auth import ALGORITHM, SECRET_KEY
-from ..core.docker import execute_command, get_session, stop_session
-from ..db.database import get_db
-from ..db.repository import ProjectRepository, UserRepository
+from ..core.auth import get_principal, verify_token
+from ..core.docker import (
+    activate_session_async,
+    attach_session,
+    detach_session,
+    get_session_async,
+    open_shell_async,
+    resize_shell_async,
+    stop_session_async,
+    stream_command_async,
+)
+from ..core.output import OutputWriter
+from ..db.database import AsyncSessionLocal
+from ..db.repository import AsyncProjectRepository
 
 router = APIRouter()
 
 
+async def read_shell(session: dict, shell):
+    """Read the shell's output for as long as it runs.
+
+    Output goes to the currently attached client, if any, and always into the
+    session's scrollback so a client that reconnects can catch up.
+    """
+    while True:
+        data = await shell.read()
+        if not data:
+            break
+
+        writer = session.get("writer")
+        if writer is None:
+            session["scrollback"].append(data)
+            continue
+        try:
+            await writer.write(data)
+        except Exception:
+            # The client went away mid-send; the data is already recorded
+            if session.get("writer") is writer:
+                session["writer"] = None
+
+    writer = session.get("writer")
+    if writer is not None:
+        try:
+            await writer.close()
+        except Exception:
+            pass
+
+
+async def run_pty(
+    websocket: WebSocket, writer: OutputWriter, session: dict, rows: int, cols: int
+):
+    """Bridge the websocket to the session's PTY shell until either side ends.
+
+    Binary frames from the client are written to the shell as keystrokes and
+    the shell's output is sent back through writer. Text frames carry JSON
+    control messages: {"type": "resize", "rows": r, "cols": c},
+    {"type": "interrupt"} or {"type": "input", "data": "..."}. Text that is
+    not a control message is treated as input.
+    """
+    shell = await open_shell_async(session, rows, cols)
+
+    # One reader per shell, kept running while no client is attached
+    reader = session.get("shell_reader")
+    if reader is None or reader.done():
+        reader = asyncio.create_task(read_shell(session, shell))
+        session["shell_reader"] = reader
+
+    async def forward_input():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            await activate_session_async(session)
+
+            if message.get("bytes") is not None:
+                await shell.write(message["bytes"])
+                continue
+
+            text = message.get("text") or ""
+            try:
+                control = json.loads(text)
+            except ValueError:
+                control = None
+            if not isinstance(control, dict) or "type" not in control:
+                await shell.write(text.encode("utf-8"))
+            elif control["type"] == "resize":
+                await resize_shell_async(
+                    shell, int(control["rows"]), int(control["cols"])
+                )
+            elif control["type"] == "interrupt":
+                await shell.interrupt()
+            elif control["type"] == "input":
+                await shell.write(control.get("data", "").encode("utf-8"))
+
+    receiver = asyncio.create_task(forward_input())
+    try:
+        done, _ = await asyncio.wait(
+            {receiver, reader}, return_when=asyncio.FIRST_COMPLETED
+        )
+        if receiver in done:
+            receiver.result()
+    finally:
+        receiver.cancel()
+        if session.get("writer") is writer:
+            session["writer"] = None
+
+    # The shell exited on its own (e.g. the user typed exit)
+    await websocket.send_text("Shell exited.\n")
+    await websocket.close()
+
+
 @router.websocket("/ws/{user_id}/{project_id}")
 async def terminal_ws(
     websocket: WebSocket,
     user_id: str,
     project_id: str,
     token: str = Query(None),
-    db: Session = Depends(get_db),
+    mode: str = Query("line"),
+    encoding: str = Query("binary"),
+    rows: int = Query(24),
+    cols: int = Query(80),
+    resume: str = Query(None),
+    offset: int = Query(None),
 ):
     await websocket.accept()
+    attached = False
 
     try:
         # Verify the authentication token if provided
         if token:
-            try:
-                payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-                token_user_id = payload.get("sub")
-                if token_user_id != user_id:
-                    await websocket.send_text(
-                        "Authentication error: Token user ID doesn't match path user ID\n"
-                    )
-                    await websocket.close()
-                    return
-            except JWTError:
+            token_user_id = verify_token(token)
+            if token_user_id is None:
                 await websocket.send_text("Authentication error: Invalid token\n")
                 await websocket.close()
                 return
+            if token_user_id != user_id:
+                await websocket.send_text(
+                    "Authentication error: Token user ID doesn't match path user ID\n"
+                )
+                await websocket.close()
+                return
         else:
             # For development, we'll still allow connections without a token
             # but display a warning. In production, you would want to enforce tokens.
@@ -48,50 +155,102 @@ async def terminal_ws(
         # Send a welcome message to confirm connection
         await websocket.send_text("Connected to terminal. Checking project access...\n")
 
-        # Validate that the user and project exist in the database
-        user = UserRepository.get_user(db, user_id)
-        if not user:
-            await websocket.send_text("Error: User not found\n")
-            await websocket.close()
-            return
+        # Validate that the user and project exist in the database. The DB
+        # session is only held for these checks, not for the whole connection.
+        async with AsyncSessionLocal() as db:
+            user = await get_principal(db, user_id)
+            if not user or user.is_active is False:
+                await websocket.send_text("Error: User not found\n")
+                await websocket.close()
+                return
 
-        # Check if the project exists for this user
-        project = ProjectRepository.get_project(db, project_id)
-        if not project:
-            # For POC purposes, we'll create a default project if it doesn't exist
-            project = ProjectRepository.create_project(
-                db,
-                name=f"Project {project_id[:8]}",
-                user_id=user_id,
-                description="Auto-created project",
-            )
-            await websocket.send_text(f"Created new project: {project.name}\n")
-        elif project.user_id != user_id:
-            # Check project ownership
-            await websocket.send_text("Error: You don't have access to this project\n")
-            await websocket.close()
-            return
+            # Check if the project exists for this user
+            project = await AsyncProjectRepository.get_project(db, project_id)
+            if not project:
+                # For POC purposes, we'll create a default project if it doesn't exist
+                project = await AsyncProjectRepository.create_project(
+                    db,
+                    name=f"Project {project_id[:8]}",
+                    user_id=user_id,
+                    description="Auto-created project",
+                )
+                await websocket.send_text(f"Created new project: {project.name}\n")
+            elif project.user_id != user_id:
+                # Check project ownership
+                await websocket.send_text(
+                    "Error: You don't have access to this project\n"
+                )
+                await websocket.close()
+                return
 
         await websocket.send_text("Starting container...\n")
 
-        # Get or create session
-        session = get_session(user_id, project_id)
+        # While new sessions are at capacity the client is told its place in
+        # the queue instead of waiting silently
+        async def send_queue_position(position: int):
+            await websocket.send_text(
+                json.dumps({"type": "queue", "position": position})
+            )
+
+        # Get or create session. A session whose websocket dropped is kept for
+        # a grace period, so a reconnecting client gets the same container.
+        session = await get_session_async(user_id, project_id, send_queue_position)
         container = session["container"]
+        attach_session(session)
+        attached = True
 
-        # Update last active timestamp
-        session["last_active"] = asyncio.get_event_loop().time()
+        # Terminal output is sent as coalesced binary frames unless the
+        # client asks for text, and is recorded in the session's scrollback
+        scrollback = session["scrollback"]
+        writer = OutputWriter(websocket, scrollback, binary=encoding != "text")
 
-        # Send initial container info and prompt
+        # A client presenting the session's resume token gets the output it
+        # missed since the given offset. Queue it and attach the writer before
+        # anything else can produce output.
+        resumed = resume == session["resume_token"] and offset is not None
+        if resumed:
+            stream_offset, missed = scrollback.read_from(offset)
+            writer.replay(missed)
+        else:
+            stream_offset = scrollback.end
+        if mode == "pty":
+            session["writer"] = writer
+
+        # Tell the client how to resume: the binary output that follows starts
+        # at stream_offset in the session's output
         await websocket.send_text(
-            "Web Terminal ready. Type commands and press Enter. Your files are stored in /workspace\n"
+            json.dumps(
+                {
+                    "type": "session",
+                    "resume_token": session["resume_token"],
+                    "offset": stream_offset,
+                }
+            )
         )
-        await websocket.send_text("\n$ ")
+        await writer.flush()
+
+        # In PTY mode the websocket is attached to one long-lived shell
+        if mode == "pty":
+            if not resumed:
+                await websocket.send_text(
+                    "Web Terminal ready. Your files are stored in /workspace\n"
+                )
+            await run_pty(websocket, writer, session, rows, cols)
+            return
+
+        # Send initial container info and prompt
+        if not resumed:
+            await websocket.send_text(
+                "Web Terminal ready. Type commands and press Enter. Your files are stored in /workspace\n"
+            )
+            await writer.write(b"\n$ ")
+            await writer.flush()
 
         # Process commands from the client
         while True:
             cmd = await websocket.receive_text()
             # Update last active timestamp
-            session["last_active"] = asyncio.get_event_loop().time()
+            await activate_session_async(session)
 
             if cmd.strip().lower() in ["exit", "quit"]:
                 await websocket.send_text("Closing session...\n")
@@ -101,36 +260,35 @@ async def terminal_ws(
                 # Log command for debugging
                 print(f"Executing command: {cmd}")
 
+                async def send_output(stdout, stderr):
+                    if stdout:
+                        await writer.write(stdout)
+                    if stderr:
+                        await writer.write(stderr)
+
                 try:
-                    # Execute the command
-                    exit_code, (stdout, stderr) = execute_command(container, cmd)
+                    # Execute the command, streaming its output as it arrives
+                    exit_code = await stream_command_async(
+                        container, cmd, send_output, session["environment"]
+                    )
 
                     print(f"Command exit code: {exit_code}")
 
-                    if stdout:
-                        stdout_text = stdout.decode("utf-8", errors="ignore")
-                        print(f"STDOUT: {stdout_text}")
-                        await websocket.send_text(stdout_text)
-
-                    if stderr:
-                        stderr_text = stderr.decode("utf-8", errors="ignore")
-                        print(f"STDERR: {stderr_text}")
-                        await websocket.send_text(stderr_text)
-
-                    if not stdout and not stderr:
-                        print("No output from command")
+                except WebSocketDisconnect:
+                    raise
 
                 except Exception as e:
                     error_msg = f"Error executing command: {str(e)}\n"
                     print(error_msg)
-                    await websocket.send_text(error_msg)
+                    await writer.write(error_msg.encode("utf-8"))
 
-                # Send a new prompt
-                await websocket.send_text("$ ")
+                # Send a new prompt together with the rest of the output
+                await writer.write(b"$ ")
+                await writer.flush()
 
     except WebSocketDisconnect:
-        # Clean up resources
-        stop_session(user_id, project_id)
+        # The session is released below; it survives a short grace period
+        pass
 
     except Exception as e:
         # Handle other exceptions
@@ -140,4 +298,8 @@ async def terminal_ws(
             pass
 
         # Clean up
-        stop_session(user_id, project_id)
+        await stop_session_async(user_id, project_id)
+
+    finally:
+        if attached:
+            detach_session(user_id, project_id)
@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Literal, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class ProjectBase(BaseModel):
@@ -37,8 +37,111 @@ class FileCreate(FileBase):
 class File(FileBase):
     id: str
     project_id: str
+    size: int = 0
+    version: int = 1
     created_at: datetime
     updated_at: datetime
 
     class Config:
         orm_mode = True
+
+
+class FileMetadata(BaseModel):
+    id: str
+    name: str
+    path: str
+    is_directory: bool
+    size: int
+    version: int
+    updated_at: datetime
+
+    class Config:
+        orm_mode = True
+
+
+class FilePage(BaseModel):
+    files: List[FileMetadata]
+    # Pass as ?cursor= to get the next page; None on the last page
+    next_cursor: Optional[str] = None
+
+
+class FileEdit(BaseModel):
+    # Replace the range [start, end) with text; offsets in UTF-16 code units
+    start: int = Field(ge=0)
+    end: int = Field(ge=0)
+    text: str = ""
+
+
+class FilePatch(BaseModel):
+    # The version the edits were made against
+    base_version: int
+    edits: List[FileEdit]
+
+
+class FileOperation(BaseModel):
+    op: Literal["create", "update", "rename", "delete"]
+    # The file to update, rename or delete
+    id: Optional[str] = None
+    # create: name and path of the new file; rename: its new name
+    name: Optional[str] = None
+    path: Optional[str] = None
+    is_directory: bool = False
+    # create and update
+    content: Optional[str] = None
+    # update: reject the batch if the file is no longer at this version
+    base_version: Optional[int] = None
+
+
+class FileBatch(BaseModel):
+    operations: List[FileOperation]
+
+
+class FileOperationResult(BaseModel):
+    # 201 created, 200 updated or renamed, 204 deleted; 424 for an operation
+    # not applied because another one in the batch failed
+    status: int
+    file: Optional[FileMetadata] = None
+    error: Optional[str] = None
+
+
+class FileBatchResult(BaseModel):
+    results: List[FileOperationResult]
+
+
+class FileMove(BaseModel):
+    # A file or directory, and its new path
+    path: str
+    new_path: str
+
+
+class FileMoveResult(BaseModel):
+    # Files moved, including those under a directory
+    moved: int
+
+
+class SearchLine(BaseModel):
+    # 1-based line number, and the line (or the part of it around the match)
+    line: int
+    text: str
+
+
+class SearchMatch(FileMetadata):
+    # Higher is a better match
+    score: float
+    # Matching lines in the file; up to ?lines= of them are returned
+    matches: int
+    lines: List[SearchLine]
+
+
+class SearchResults(BaseModel):
+    results: List[SearchMatch]
+
+
+class ProjectImportResult(BaseModel):
+    # Files of the archive by what became of them. skipped counts links,
+    # unsafe paths, and paths where the project has a file and the archive a
+    # directory or the reverse
+    created: int
+    updated: int
+    unchanged: int
+    skipped: int
@@ -1,27 +1,62 @@
 import asyncio
 
-from ..core.config import CLEANUP_INTERVAL, SESSION_TIMEOUT
-from ..core.docker import user_sessions
+from ..core.blobs import blob_store
+from ..core.config import (
+    BLOB_GC_GRACE_PERIOD,
+    BLOB_GC_INTERVAL,
+    REGISTRY_HEARTBEAT_INTERVAL,
+)
+from ..core.docker import WORKER_ID, session_expiry, session_registry
+from ..db import models
+from ..db.database import SessionLocal
 
 
 async def cleanup_inactive_sessions():
-    """Background task to clean up inactive sessions."""
+    """Background task to clean up inactive sessions.
+
+    Each session's idle deadline is kept in session_expiry, which sleeps until
+    the earliest one is due and stops expired containers in parallel on the
+    Docker executor, instead of scanning every session periodically.
+    """
+    await session_expiry.run()
+
+
+def collect_blob_garbage():
+    """Remove blobs no file refers to any more. Blocking."""
+    db = SessionLocal()
+    try:
+        referenced = {
+            content_hash
+            for (content_hash,) in db.query(models.File.content_hash)
+            .filter(models.File.content_hash.isnot(None))
+            .distinct()
+        }
+    finally:
+        db.close()
+    return blob_store.collect_garbage(referenced, BLOB_GC_GRACE_PERIOD)
+
+
+async def cleanup_unused_blobs():
+    """Background task that runs collect_blob_garbage() periodically."""
+    while True:
+        await asyncio.sleep(BLOB_GC_INTERVAL)
+        try:
+            removed = await asyncio.to_thread(collect_blob_garbage)
+            if removed:
+                print(f"Removed {removed} unused blobs")
+        except Exception as e:
+            print(f"Blob garbage collection failed: {e}")
+
+
+async def renew_registry_lease():
+    """Background task keeping this worker's websocket counts in the registry.
+
+    Counts of workers that stop renewing them expire, so sessions their
+    crashed clients were attached to can be paused and stopped.
+    """
     while True:
-        current_time = asyncio.get_event_loop().time()
-        to_remove = []
-
-        for session_key, session in user_sessions.items():
-            # If session is inactive for more than the timeout period
-            if current_time - session["last_active"] > SESSION_TIMEOUT:
-                try:
-                    session["container"].stop()
-                    to_remove.append(session_key)
-                except Exception as e:
-                    print(f"Error stopping container: {str(e)}")
-
-        # Remove stopped sessions
-        for session_key in to_remove:
-            del user_sessions[session_key]
-
-        # Wait for the next cleanup interval
-        await asyncio.sleep(CLEANUP_INTERVAL)
+        try:
+            await asyncio.to_thread(session_registry.heartbeat, WORKER_ID)
+        except Exception as e:
+            print(f"Session registry heartbeat failed: {e}")
+        await asyncio.sleep(REGISTRY_HEARTBEAT_INTERVAL)
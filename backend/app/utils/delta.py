@@ -0,0 +1,25 @@
+"""
+Text deltas for incremental file saves.
+
+An edit replaces the range [start, end) of a text with new text. Offsets count
+UTF-16 code units, as JavaScript string indices and editor change events do,
+so a browser client can send them unconverted. A delta is a list of edits
+applied one after another, each against the result of the previous one.
+"""
+
+
+class InvalidDelta(ValueError):
+    """Raised when an edit's range lies outside the text or splits a character."""
+
+
+def apply_edits(text: str, edits: list):
+    """Apply edits, a list of (start, end, new_text) tuples, to text."""
+    data = bytearray(text.encode("utf-16-le"))
+    for start, end, new_text in edits:
+        if not 0 <= start <= end <= len(data) // 2:
+            raise InvalidDelta(f"Edit range {start}-{end} is outside the text")
+        data[start * 2 : end * 2] = new_text.encode("utf-16-le")
+    try:
+        return data.decode("utf-16-le")
+    except UnicodeDecodeError:
+        raise InvalidDelta("An edit splits a character in two")
@@ -0,0 +1,77 @@
+"""
+Database migrations.
+
+Brings the database schema up to date with Alembic (see migrations/). Runs at
+startup in every worker process, one at a time: the first upgrades the
+database, the others find it up to date. Can also be run by hand:
+
+    python -m app.utils.migration
+"""
+
+import contextlib
+import fcntl
+import os
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.engine import make_url
+
+from ..db.database import SQLALCHEMY_DATABASE_URL
+
+BACKEND_DIR = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+# Revision matching the schema create_all() produced before migrations existed
+BASELINE_REVISION = "0001"
+
+
+def alembic_config(url: str = SQLALCHEMY_DATABASE_URL):
+    config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(BACKEND_DIR, "migrations"))
+    config.set_main_option("sqlalchemy.url", url)
+    config.attributes["configure_logger"] = False
+    return config
+
+
+@contextlib.contextmanager
+def migration_lock(url: str):
+    """Hold an exclusive lock on a file next to the SQLite database at url.
+
+    Concurrent upgrades of the same database would run the same migrations
+    twice and fail halfway.
+    """
+    database = make_url(url).database
+    if not database or database == ":memory:":
+        yield
+        return
+    with open(database + ".migration-lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def run_migrations(url: str = SQLALCHEMY_DATABASE_URL, revision: str = "head"):
+    """Upgrade the database at url to revision. Blocking."""
+    config = alembic_config(url)
+
+    with migration_lock(url):
+        # Databases created by create_all() have the tables but no version;
+        # mark them as the baseline so only the later migrations run
+        engine = create_engine(url)
+        try:
+            tables = inspect(engine).get_table_names()
+        finally:
+            engine.dispose()
+        if "users" in tables and "alembic_version" not in tables:
+            command.stamp(config, BASELINE_REVISION)
+
+        command.upgrade(config, revision)
+
+
+if __name__ == "__main__":
+    run_migrations()
+    print("Database is up to date")
@@ -0,0 +1,121 @@
+"""
+Concurrent read/write throughput of the SQLite engine profiles.
+
+Runs the same mixed workload (file lookups by path and file saves through the
+repositories; saves only repoint the file at a blob, the blob store and
+workspace sync are not involved) against a fresh database for each profile and
+prints operations per second. Run from the backend directory:
+
+    python -m benchmarks.db_profile --threads 16 --seconds 10
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from app.core.sync import workspace_sync
+from app.db import models
+from app.db.database import make_engine
+from app.db.repository import FileRepository, ProjectRepository, UserRepository
+
+
+def seed(Session, files: int):
+    """Create one project with `files` files; returns the project ID."""
+    db = Session()
+    user = UserRepository.create_user(db, "bench", "bench@example.com", "bench")
+    project = ProjectRepository.create_project(db, "bench", user.id)
+    db.add_all(
+        models.File(
+            id=f"file-{i}",
+            name=f"{i}.py",
+            path=f"/src/{i}.py",
+            content_hash="0" * 64,
+            size=1024,
+            project_id=project.id,
+        )
+        for i in range(files)
+    )
+    db.commit()
+    db.close()
+    return project.id
+
+
+def run(profile: str, threads: int, seconds: float, write_ratio: float, files: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", profile)
+        models.Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+        project_id = seed(Session, files)
+
+        counts = {"read": 0, "write": 0, "error": 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + seconds
+
+        def worker(n: int):
+            rng = random.Random(n)
+            local = {"read": 0, "write": 0, "error": 0}
+            db = Session()
+            while time.monotonic() < deadline:
+                i = rng.randrange(files)
+                try:
+                    if rng.random() < write_ratio:
+                        content_hash = hashlib.sha256(
+                            f"{n}:{time.monotonic()}".encode()
+                        ).hexdigest()
+                        FileRepository.set_file_blob(
+                            db, f"file-{i}", content_hash, 1024
+                        )
+                        local["write"] += 1
+                    else:
+                        FileRepository.get_file_by_path(db, project_id, f"/src/{i}.py")
+                        db.rollback()  # end the read transaction
+                        local["read"] += 1
+                except Exception:
+                    db.rollback()
+                    local["error"] += 1
+            db.close()
+            with lock:
+                for key, value in local.items():
+                    counts[key] += value
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        engine.dispose()
+
+    return {key: value / seconds for key, value in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--profiles", nargs="+", default=["default", "wal"])
+    args = parser.parse_args()
+    workspace_sync.enabled = False
+
+    print(
+        f"{args.threads} threads, {args.write_ratio:.0%} writes, "
+        f"{args.seconds:g}s per profile"
+    )
+    print(f"{'profile':<10}{'reads/s':>12}{'writes/s':>12}{'errors/s':>12}")
+    for profile in args.profiles:
+        result = run(profile, args.threads, args.seconds, args.write_ratio, args.files)
+        print(
+            f"{profile:<10}{result['read']:>12.0f}{result['write']:>12.0f}"
+            f"{result['error']:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
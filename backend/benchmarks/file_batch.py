@@ -0,0 +1,119 @@
+"""
+Per-file repository calls against one batch of file operations.
+
+Creates, renames and deletes the same number of files in a fresh database,
+once with a repository call (and commit) per file and once with
+FileRepository.apply_batch, and prints files per second for each. Files are
+created without content so only the database is measured. Run from the
+backend directory:
+
+    python -m benchmarks.file_batch --files 500
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from app.core.sync import workspace_sync
+from app.db import models
+from app.db.database import make_engine
+from app.db.repository import FileRepository, ProjectRepository, UserRepository
+from app.schemas.projects import FileOperation
+
+
+def one_by_one(db, project_id: str, files: int):
+    """Seconds per phase with a repository call per file."""
+    timings = {}
+    started = time.perf_counter()
+    created = [
+        FileRepository.create_file(db, project_id, f"{i}.py", f"/src/{i}.py")
+        for i in range(files)
+    ]
+    timings["create"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for i, db_file in enumerate(created):
+        FileRepository.update_file_name_and_path(
+            db, db_file.id, f"{i}_old.py", f"/src/{i}_old.py"
+        )
+    timings["rename"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for db_file in created:
+        FileRepository.delete_file(db, db_file.id)
+    timings["delete"] = time.perf_counter() - started
+    return timings
+
+
+def batched(db, project_id: str, files: int):
+    """Seconds per phase with one batch per phase."""
+    timings = {}
+    started = time.perf_counter()
+    results = FileRepository.apply_batch(
+        db,
+        project_id,
+        [
+            FileOperation(op="create", name=f"{i}.py", path=f"/src/{i}.py")
+            for i in range(files)
+        ],
+    )
+    timings["create"] = time.perf_counter() - started
+    ids = [result["file"]["id"] for result in results]
+
+    started = time.perf_counter()
+    FileRepository.apply_batch(
+        db,
+        project_id,
+        [
+            FileOperation(op="rename", id=file_id, name=f"{i}_old.py")
+            for i, file_id in enumerate(ids)
+        ],
+    )
+    timings["rename"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    FileRepository.apply_batch(
+        db, project_id, [FileOperation(op="delete", id=file_id) for file_id in ids]
+    )
+    timings["delete"] = time.perf_counter() - started
+    return timings
+
+
+def run(strategy, files: int, profile: str):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", profile)
+        models.Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+        db = Session()
+        user = UserRepository.create_user(db, "bench", "bench@example.com", "bench")
+        project = ProjectRepository.create_project(db, "bench", user.id)
+        timings = strategy(db, project.id, files)
+        db.close()
+        engine.dispose()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--profile", default="wal")
+    args = parser.parse_args()
+    workspace_sync.enabled = False
+
+    single = run(one_by_one, args.files, args.profile)
+    batch = run(batched, args.files, args.profile)
+    print(f"{args.files} files, {args.profile} profile")
+    print(f"{'operation':<12}{'per file/s':>14}{'batch/s':>14}{'speedup':>10}")
+    for phase in single:
+        print(
+            f"{phase:<12}{args.files / single[phase]:>14.0f}"
+            f"{args.files / batch[phase]:>14.0f}"
+            f"{single[phase] / batch[phase]:>9.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Latency of the file and project lookups on a large database.
+
+Seeds a database with the current schema minus the indexes added by revision
+0002, times get_project_files, get_file_by_path and get_user_projects, then
+creates the indexes and times them again. Run from the backend
+directory:
+
+    python -m benchmarks.file_queries --files 1000000
+"""
+
+import argparse
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from app.db import models
+from app.db.database import make_engine
+from app.db.repository import FileRepository, ProjectRepository
+from app.utils.migration import run_migrations
+
+# Indexes added by revision 0002
+INDEXES = (*models.File.__table__.indexes, *models.Project.__table__.indexes)
+
+# Rows inserted per statement while seeding
+BATCH_SIZE = 10000
+
+
+def seed(engine, users: int, projects: int, files: int):
+    now = datetime.datetime.utcnow()
+    with engine.begin() as connection:
+        connection.execute(
+            insert(models.User),
+            [
+                {"id": f"user-{u}", "email": f"{u}@example.com", "password_hash": ""}
+                for u in range(users)
+            ],
+        )
+        connection.execute(
+            insert(models.Project),
+            [
+                {
+                    "id": f"project-{p}",
+                    "name": f"Project {p}",
+                    "user_id": f"user-{p % users}",
+                    "created_at": now,
+                    "updated_at": now,
+                }
+                for p in range(projects)
+            ],
+        )
+        for start in range(0, files, BATCH_SIZE):
+            connection.execute(
+                insert(models.File),
+                [
+                    {
+                        "id": f"file-{f}",
+                        "name": f"{f}.py",
+                        "path": f"/src/{f // projects}.py",
+                        "project_id": f"project-{f % projects}",
+                        "created_at": now,
+                        "updated_at": now,
+                    }
+                    for f in range(start, min(start + BATCH_SIZE, files))
+                ],
+            )
+
+
+def measure(Session, queries: int, users: int, projects: int, files: int):
+    """Milliseconds per call for each lookup, as (median, p95)."""
+    rng = random.Random(0)
+    lookups = {
+        "get_project_files": lambda db: FileRepository.get_project_files(
+            db, f"project-{rng.randrange(projects)}"
+        ),
+        "get_file_by_path": lambda db: FileRepository.get_file_by_path(
+            db,
+            f"project-{rng.randrange(projects)}",
+            f"/src/{rng.randrange(files // projects)}.py",
+        ),
+        "get_user_projects": lambda db: ProjectRepository.get_user_projects(
+            db, f"user-{rng.randrange(users)}"
+        ),
+    }
+
+    results = {}
+    db = Session()
+    for name, lookup in lookups.items():
+        timings = []
+        for _ in range(queries):
+            started = time.perf_counter()
+            lookup(db)
+            timings.append((time.perf_counter() - started) * 1000)
+            db.expunge_all()
+        timings.sort()
+        results[name] = (
+            statistics.median(timings),
+            timings[int(len(timings) * 0.95) - 1],
+        )
+    db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--files", type=int, default=1_000_000)
+    parser.add_argument("--projects", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        run_migrations(url)
+        engine = make_engine(url)
+        for index in INDEXES:
+            index.drop(engine)
+
+        started = time.perf_counter()
+        seed(engine, args.users, args.projects, args.files)
+        print(
+            f"Seeded {args.files} files in {args.projects} projects of "
+            f"{args.users} users in {time.perf_counter() - started:.1f}s"
+        )
+
+        Session = sessionmaker(bind=engine, autoflush=False)
+        sizes = (args.users, args.projects, args.files)
+        before = measure(Session, args.queries, *sizes)
+
+        started = time.perf_counter()
+        for index in INDEXES:
+            index.create(engine)
+        print(f"Indexed in {time.perf_counter() - started:.1f}s")
+        after = measure(Session, args.queries, *sizes)
+        engine.dispose()
+
+    print(f"{'query':<20}{'before p50/p95 ms':>22}{'after p50/p95 ms':>22}")
+    for name in before:
+        print(
+            f"{name:<20}{before[name][0]:>12.2f} /{before[name][1]:>8.2f}"
+            f"{after[name][0]:>12.3f} /{after[name][1]:>8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
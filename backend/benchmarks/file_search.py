@@ -0,0 +1,182 @@
+"""
+Latency of full-text search on a large project.
+
+Seeds a fresh database with one project of --files files plus --other-files
+files spread over other projects, all with generated code-like bodies, and
+times FileRepository.search_files against scanning every body of the project
+in Python (what a client without search has to do after downloading them).
+Run from the backend directory:
+
+    python -m benchmarks.file_search --files 20000 --other-files 80000
+"""
+
+import argparse
+import datetime
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import sessionmaker
+
+from app.core.sync import workspace_sync
+from app.db import models, search
+from app.db.database import make_engine
+from app.db.repository import FileRepository
+
+# Files inserted per transaction while seeding
+BATCH_SIZE = 5000
+
+# Lines per generated file
+LINES = 30
+
+QUERIES = (
+    ("rare term", {"query": "{rare}"}),
+    ("common term", {"query": "return"}),
+    ("two terms", {"query": "import {word}"}),
+    ("regex", {"query": "def", "pattern": r"def \w+_1\d\("}),
+)
+
+
+def vocabulary(rng, size: int = 5000):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return [
+        "".join(rng.choice(letters) for _ in range(rng.randint(4, 10)))
+        for _ in range(size)
+    ]
+
+
+def body(rng, words: list, n: int):
+    lines = [f"import {rng.choice(words)}", ""]
+    for i in range(LINES):
+        a, b = rng.choice(words), rng.choice(words)
+        if i % 6 == 0:
+            lines.append(f"def {a}_{n % 100}({b}):")
+        elif i % 6 == 5:
+            lines.append(f"    return {a}")
+        else:
+            lines.append(f"    {a} = {b}.{rng.choice(words)}({i})")
+    return "\n".join(lines)
+
+
+def seed(Session, rng, words: list, project_ids: list, files: int, other: int):
+    now = datetime.datetime.utcnow()
+    db = Session()
+    db.execute(insert(models.User), [{"id": "user", "email": "e", "password_hash": ""}])
+    db.execute(
+        insert(models.Project),
+        [
+            {"id": p, "name": p, "user_id": "user", "created_at": now}
+            for p in project_ids
+        ],
+    )
+    db.commit()
+    # The benchmarked project first, then the others round-robin
+    owners = [project_ids[0]] * files + [
+        project_ids[1 + i % (len(project_ids) - 1)] for i in range(other)
+    ]
+    for start in range(0, len(owners), BATCH_SIZE):
+        rows = []
+        for n in range(start, min(start + BATCH_SIZE, len(owners))):
+            rows.append(
+                {
+                    "id": f"file-{n}",
+                    "name": f"{n}.py",
+                    "path": f"src/{n}.py",
+                    "project_id": owners[n],
+                    "created_at": now,
+                    "updated_at": now,
+                }
+            )
+        db.execute(insert(models.File), rows)
+        texts = {}
+        for row in rows:
+            texts.setdefault(row["project_id"], []).append(
+                (row["id"], body(rng, words, int(row["id"][5:])))
+            )
+        for project_id, documents in texts.items():
+            search.index_files(db, project_id, documents)
+        db.commit()
+    db.close()
+
+
+def scan(db, project_id: str, query: str, pattern):
+    """Match every body of the project in Python."""
+    terms = query.casefold().split()
+    bodies = db.execute(
+        select(search.documents.c.body).where(
+            search.documents.c.project_id == project_id
+        )
+    ).scalars()
+    found = 0
+    for text in bodies:
+        folded = text.casefold()
+        if all(term in folded for term in terms) and (
+            pattern is None or pattern.search(text)
+        ):
+            found += 1
+    return found
+
+
+def timed(call, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--files", type=int, default=20_000)
+    parser.add_argument("--other-files", type=int, default=80_000)
+    parser.add_argument("--projects", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    workspace_sync.enabled = False
+
+    rng = random.Random(0)
+    words = vocabulary(rng)
+    project_ids = [f"project-{p}" for p in range(args.projects + 1)]
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        models.Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine, autoflush=False)
+
+        started = time.perf_counter()
+        seed(Session, rng, words, project_ids, args.files, args.other_files)
+        print(
+            f"Seeded {args.files} files, plus {args.other_files} in "
+            f"{args.projects} other projects, in "
+            f"{time.perf_counter() - started:.1f}s"
+        )
+
+        db = Session()
+        target = project_ids[0]
+        print(
+            f"{'query':<14}{'results':>8}{'scan p50 ms':>14}{'search p50/p95 ms':>22}"
+        )
+        for name, spec in QUERIES:
+            query = spec["query"].format(rare=words[17], word=words[3])
+            pattern = re.compile(spec["pattern"]) if "pattern" in spec else None
+            results = FileRepository.search_files(db, target, query, pattern)
+            scanned = timed(lambda: scan(db, target, query, pattern), 3)
+            searched = timed(
+                lambda: FileRepository.search_files(db, target, query, pattern),
+                args.repeat,
+            )
+            print(
+                f"{name:<14}{len(results):>8}{scanned[0]:>14.1f}"
+                f"{searched[0]:>12.2f} /{searched[1]:>8.2f}"
+            )
+        db.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Index files by (project_id, path) and projects by user_id
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+The unique (project_id, path) index also serves lookups by project_id alone
+(it is the leading column), so files.project_id gets no separate index.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Paths were only checked for uniqueness by the API, not the schema. Keep
+    # the most recently updated file at each path and move older duplicates
+    # aside (to "<path>~<id>", renaming them to match) so no content is lost.
+    files = sa.table(
+        "files",
+        sa.column("id", sa.String),
+        sa.column("name", sa.String),
+        sa.column("path", sa.String),
+        sa.column("project_id", sa.String),
+        sa.column("updated_at", sa.DateTime),
+    )
+    connection = op.get_bind()
+    duplicates = connection.execute(
+        sa.text(
+            """
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY project_id, path
+                    ORDER BY updated_at DESC, id
+                ) AS rank
+                FROM files
+            ) WHERE rank > 1
+            """
+        )
+    ).scalars()
+    for file_id in list(duplicates):
+        connection.execute(
+            files.update()
+            .where(files.c.id == file_id)
+            .values(
+                name=files.c.name + "~" + file_id, path=files.c.path + "~" + file_id
+            )
+        )
+
+    op.create_index(
+        "ix_files_project_id_path", "files", ["project_id", "path"], unique=True
+    )
+    op.create_index("ix_projects_user_id", "projects", ["user_id"])
+
+
+def downgrade():
+    op.drop_index("ix_projects_user_id", table_name="projects")
+    op.drop_index("ix_files_project_id_path", table_name="files")
@@ -0,0 +1,90 @@
+"""Move file bodies into the content-addressed blob store
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+Each file's content is written to the blob store (BLOB_DIR) and replaced by
+its hash and size; the content column is then dropped. Files are moved in
+batches so the table is never held in memory at once.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from app.core.blobs import blob_store
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    with op.batch_alter_table("files") as batch_op:
+        batch_op.add_column(sa.Column("content_hash", sa.String(64), nullable=True))
+        batch_op.add_column(
+            sa.Column("size", sa.Integer(), nullable=False, server_default="0")
+        )
+
+    files = sa.table(
+        "files",
+        sa.column("id", sa.String),
+        sa.column("content", sa.Text),
+        sa.column("content_hash", sa.String),
+        sa.column("size", sa.Integer),
+    )
+    connection = op.get_bind()
+    last_id = ""
+    while True:
+        rows = connection.execute(
+            sa.select(files.c.id, files.c.content)
+            .where(files.c.id > last_id)
+            .order_by(files.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        for file_id, content in rows:
+            if content is None:
+                continue
+            digest, size = blob_store.put(content.encode("utf-8"))
+            connection.execute(
+                files.update()
+                .where(files.c.id == file_id)
+                .values(content_hash=digest, size=size)
+            )
+        last_id = rows[-1][0]
+
+    with op.batch_alter_table("files") as batch_op:
+        batch_op.drop_column("content")
+
+
+def downgrade():
+    with op.batch_alter_table("files") as batch_op:
+        batch_op.add_column(sa.Column("content", sa.Text(), nullable=True))
+
+    files = sa.table(
+        "files",
+        sa.column("id", sa.String),
+        sa.column("content", sa.Text),
+        sa.column("content_hash", sa.String),
+    )
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select(files.c.id, files.c.content_hash).where(
+            files.c.content_hash.isnot(None)
+        )
+    ).fetchall()
+    for file_id, digest in rows:
+        connection.execute(
+            files.update()
+            .where(files.c.id == file_id)
+            .values(content=blob_store.read_text(digest))
+        )
+
+    with op.batch_alter_table("files") as batch_op:
+        batch_op.drop_column("size")
+        batch_op.drop_column("content_hash")
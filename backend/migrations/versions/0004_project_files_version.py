@@ -0,0 +1,29 @@
+"""Count changes to each project's files
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+
+projects.files_version is bumped on every file change, so file listings can
+be answered with 304 Not Modified without reading the files table.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("projects") as batch_op:
+        batch_op.add_column(
+            sa.Column("files_version", sa.Integer(), nullable=False, server_default="0")
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("projects") as batch_op:
+        batch_op.drop_column("files_version")
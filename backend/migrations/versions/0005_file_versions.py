@@ -0,0 +1,29 @@
+"""Number each file's content versions
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+
+files.version starts at 1 and is incremented on every content change, so a
+save can be made against a known base version and rejected if it is stale.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("files") as batch_op:
+        batch_op.add_column(
+            sa.Column("version", sa.Integer(), nullable=False, server_default="1")
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("files") as batch_op:
+        batch_op.drop_column("version")
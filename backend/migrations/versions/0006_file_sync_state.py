@@ -0,0 +1,29 @@
+"""Record when each file was last in sync with its workspace copy
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+
+files.synced_mtime_ns is the mtime of the workspace copy when it last matched
+the row. Workspace files whose mtime still matches need not be hashed again.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("files") as batch_op:
+        batch_op.add_column(
+            sa.Column("synced_mtime_ns", sa.BigInteger(), nullable=True)
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("files") as batch_op:
+        batch_op.drop_column("synced_mtime_ns")
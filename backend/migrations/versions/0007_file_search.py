@@ -0,0 +1,125 @@
+"""Index file contents for full-text search
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+
+search_documents holds the text of each file, numbered in a range of ids per
+project, and the search_index FTS5 table (trigram tokenizer) indexes it;
+triggers keep the two in step. Existing files are indexed from the blob
+store, in batches so the table is never held in memory at once.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from app.core.blobs import BlobNotFound, blob_store
+from app.core.config import SEARCH_MAX_FILE_SIZE
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+PARTITION_BITS = 32
+
+SEARCH_INDEX_DDL = (
+    "CREATE VIRTUAL TABLE search_index USING fts5("
+    "body, content='search_documents', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER search_documents_insert AFTER INSERT ON search_documents BEGIN "
+    "INSERT INTO search_index(rowid, body) VALUES (new.id, new.body); END",
+    "CREATE TRIGGER search_documents_delete AFTER DELETE ON search_documents BEGIN "
+    "INSERT INTO search_index(search_index, rowid, body) "
+    "VALUES ('delete', old.id, old.body); END",
+    "CREATE TRIGGER search_documents_update AFTER UPDATE OF body "
+    "ON search_documents BEGIN "
+    "INSERT INTO search_index(search_index, rowid, body) "
+    "VALUES ('delete', old.id, old.body); "
+    "INSERT INTO search_index(rowid, body) VALUES (new.id, new.body); END",
+)
+
+
+def text_of(content_hash, size):
+    if size > SEARCH_MAX_FILE_SIZE:
+        return None
+    try:
+        data = blob_store.read(content_hash)
+    except BlobNotFound:
+        return None
+    if b"\0" in data:
+        return None
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+
+def upgrade():
+    documents = op.create_table(
+        "search_documents",
+        sa.Column("id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("file_id", sa.String(), nullable=False),
+        sa.Column("project_id", sa.String(), nullable=False),
+        sa.Column("body", sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("file_id"),
+    )
+    op.create_index(
+        "ix_search_documents_project_id", "search_documents", ["project_id"]
+    )
+    for statement in SEARCH_INDEX_DDL:
+        op.execute(statement)
+
+    files = sa.table(
+        "files",
+        sa.column("id", sa.String),
+        sa.column("project_id", sa.String),
+        sa.column("content_hash", sa.String),
+        sa.column("size", sa.Integer),
+        sa.column("is_directory", sa.Boolean),
+    )
+    connection = op.get_bind()
+    last = ("", "")
+    project_id, next_id = None, 0
+    while True:
+        rows = connection.execute(
+            sa.select(
+                files.c.project_id, files.c.id, files.c.content_hash, files.c.size
+            )
+            .where(
+                files.c.content_hash.isnot(None),
+                sa.tuple_(files.c.project_id, files.c.id) > last,
+            )
+            .order_by(files.c.project_id, files.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        inserts = []
+        for row in rows:
+            if row.project_id != project_id:
+                # The next project's partition
+                project_id = row.project_id
+                next_id = ((next_id >> PARTITION_BITS) + 1) << PARTITION_BITS
+            text = text_of(row.content_hash, row.size)
+            if text:
+                inserts.append(
+                    {
+                        "id": next_id,
+                        "file_id": row.id,
+                        "project_id": row.project_id,
+                        "body": text,
+                    }
+                )
+                next_id += 1
+        if inserts:
+            connection.execute(sa.insert(documents), inserts)
+        last = (rows[-1].project_id, rows[-1].id)
+
+
+def downgrade():
+    op.execute("DROP TABLE search_index")
+    op.drop_index("ix_search_documents_project_id", table_name="search_documents")
+    op.drop_table("search_documents")
@@ -0,0 +1,37 @@
+"""Keep file change events in the database
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+
+file_changes holds the events sent to subscribed clients, numbered by SQLite,
+so that every worker process delivers the same events with the same seq.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "file_changes",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("project_id", sa.String(), nullable=False),
+        sa.Column("event", sa.Text(), nullable=False),
+        sa.Column("created_at", sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sqlite_autoincrement=True,
+    )
+    op.create_index(
+        "ix_file_changes_project_id_id", "file_changes", ["project_id", "id"]
+    )
+
+
+def downgrade():
+    op.drop_index("ix_file_changes_project_id_id", table_name="file_changes")
+    op.drop_table("file_changes")
@@ -0,0 +1,146 @@
+"""Index file paths for search
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+
+search_documents gets a copy of each file's path, indexed by the new
+search_paths FTS5 table, so a search can match a file by name. A trigger on
+files keeps the copy up to date. Files without searchable text get a document
+with an empty body, so they can be found by path too.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+PARTITION_BITS = 32
+
+# As in db/search.py
+INSERT_DOCUMENT = sa.text(
+    f"""
+    INSERT INTO search_documents (id, file_id, project_id, body, path)
+    SELECT COALESCE(
+        (
+            SELECT MAX(id) + 1 FROM search_documents
+            WHERE id >= slot.start AND id < slot.start + {1 << PARTITION_BITS}
+        ),
+        slot.start
+    ), :file_id, :project_id, '', :path
+    FROM (
+        SELECT COALESCE(
+            (
+                SELECT id >> {PARTITION_BITS} << {PARTITION_BITS}
+                FROM search_documents WHERE project_id = :project_id LIMIT 1
+            ),
+            (
+                (SELECT COALESCE(MAX(id), 0) FROM search_documents)
+                >> {PARTITION_BITS}
+            ) + 1 << {PARTITION_BITS}
+        ) AS start
+    ) AS slot
+    """
+)
+
+OLD_TRIGGERS = (
+    "CREATE TRIGGER search_documents_insert AFTER INSERT ON search_documents BEGIN "
+    "INSERT INTO search_index(rowid, body) VALUES (new.id, new.body); END",
+    "CREATE TRIGGER search_documents_delete AFTER DELETE ON search_documents BEGIN "
+    "INSERT INTO search_index(search_index, rowid, body) "
+    "VALUES ('delete', old.id, old.body); END",
+)
+
+NEW_DDL = (
+    "CREATE VIRTUAL TABLE search_paths USING fts5("
+    "path, content='search_documents', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER search_documents_insert AFTER INSERT ON search_documents BEGIN "
+    "INSERT INTO search_index(rowid, body) VALUES (new.id, new.body); "
+    "INSERT INTO search_paths(rowid, path) VALUES (new.id, new.path); END",
+    "CREATE TRIGGER search_documents_delete AFTER DELETE ON search_documents BEGIN "
+    "INSERT INTO search_index(search_index, rowid, body) "
+    "VALUES ('delete', old.id, old.body); "
+    "INSERT INTO search_paths(search_paths, rowid, path) "
+    "VALUES ('delete', old.id, old.path); END",
+    "CREATE TRIGGER search_documents_move AFTER UPDATE OF path "
+    "ON search_documents BEGIN "
+    "INSERT INTO search_paths(search_paths, rowid, path) "
+    "VALUES ('delete', old.id, old.path); "
+    "INSERT INTO search_paths(rowid, path) VALUES (new.id, new.path); END",
+    "CREATE TRIGGER files_move_search_document AFTER UPDATE OF path ON files "
+    "WHEN new.path IS NOT old.path BEGIN "
+    "UPDATE search_documents SET path = new.path WHERE file_id = new.id; END",
+)
+
+
+def upgrade():
+    op.add_column(
+        "search_documents",
+        sa.Column("path", sa.String(), nullable=False, server_default=""),
+    )
+    op.execute(
+        "UPDATE search_documents SET path = "
+        "(SELECT path FROM files WHERE files.id = search_documents.file_id)"
+    )
+    op.execute("DROP TRIGGER search_documents_insert")
+    op.execute("DROP TRIGGER search_documents_delete")
+    for statement in NEW_DDL:
+        op.execute(statement)
+    op.execute("INSERT INTO search_paths(search_paths) VALUES ('rebuild')")
+
+    # Documents for the files that have none; the trigger indexes their paths
+    files = sa.table(
+        "files",
+        sa.column("id", sa.String),
+        sa.column("project_id", sa.String),
+        sa.column("path", sa.String),
+        sa.column("is_directory", sa.Boolean),
+    )
+    documents = sa.table("search_documents", sa.column("file_id", sa.String))
+    connection = op.get_bind()
+    last = ("", "")
+    while True:
+        rows = connection.execute(
+            sa.select(files.c.project_id, files.c.id, files.c.path)
+            .where(
+                sa.not_(files.c.is_directory),
+                sa.tuple_(files.c.project_id, files.c.id) > last,
+            )
+            .order_by(files.c.project_id, files.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        indexed = set(
+            connection.scalars(
+                sa.select(documents.c.file_id).where(
+                    documents.c.file_id.in_([row.id for row in rows])
+                )
+            )
+        )
+        inserts = [
+            {"file_id": row.id, "project_id": row.project_id, "path": row.path}
+            for row in rows
+            if row.id not in indexed
+        ]
+        if inserts:
+            connection.execute(INSERT_DOCUMENT, inserts)
+        last = (rows[-1].project_id, rows[-1].id)
+
+
+def downgrade():
+    op.execute("DROP TRIGGER files_move_search_document")
+    op.execute("DROP TRIGGER search_documents_move")
+    op.execute("DROP TRIGGER search_documents_insert")
+    op.execute("DROP TRIGGER search_documents_delete")
+    op.execute("DROP TABLE search_paths")
+    for statement in OLD_TRIGGERS:
+        op.execute(statement)
+    # Documents of files without searchable text
+    op.execute("DELETE FROM search_documents WHERE body = ''")
+    op.drop_column("search_documents", "path")
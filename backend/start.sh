@@ -5,4 +5,6 @@ echo "Installing dependencies from requirements.txt..."
 pip install -r requirements.txt
 
 echo "Starting the FastAPI application..."
-exec uvicorn main:app --host 0.0.0.0 --reload
\ No newline at end of file
+# File event streams stay open until the client leaves; don't let them hold up
+# reloads and shutdown
+exec uvicorn main:app --host 0.0.0.0 --reload --timeout-graceful-shutdown 5
\ No newline at end of file
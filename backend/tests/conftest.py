@@ -0,0 +1,57 @@
+"""
+Shared setup for the backend tests.
+
+The data directory, blob store and database (./web_terminal.db, relative to
+the working directory) go to a temporary directory, set up before any app
+module is imported. Run from the backend directory:
+
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+TEST_ROOT = tempfile.mkdtemp(prefix="web-terminal-tests-")
+os.environ["DATA_DIR"] = os.path.join(TEST_ROOT, "users")
+os.environ["BLOB_DIR"] = os.path.join(TEST_ROOT, "blobs")
+os.chdir(TEST_ROOT)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    from app.db import models
+    from app.db.database import engine
+
+    models.Base.metadata.create_all(engine)
+    yield
+    engine.dispose()
+
+
+@pytest.fixture
+def db():
+    from app.db.database import SessionLocal
+
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def project(db):
+    """A new user's new project."""
+    from app.db import models
+
+    user = models.User(
+        id=str(uuid.uuid4()), email=f"{uuid.uuid4()}@example.com", password_hash=""
+    )
+    project = models.Project(id=str(uuid.uuid4()), name="test", user_id=user.id)
+    db.add_all([user, project])
+    db.commit()
+    return project
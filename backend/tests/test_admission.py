@@ -0,0 +1,107 @@
+import asyncio
+
+from app.core.admission import AdmissionController
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_requests_over_the_limit_wait_in_line():
+    async def run():
+        admission = AdmissionController(max_sessions=1, max_per_user=1)
+        await admission.acquire("alice")
+        positions = []
+
+        async def on_position(position):
+            positions.append(position)
+
+        waiting = asyncio.create_task(admission.acquire("bob", on_position))
+        await settle()
+        assert not waiting.done()
+        assert positions == [1]
+        assert admission.snapshot()["waiting"] == 1
+
+        admission.release("alice")
+        await asyncio.wait_for(waiting, 1)
+        assert admission.snapshot()["active"] == 1
+
+    asyncio.run(run())
+
+
+def test_waiting_users_are_served_round_robin():
+    async def run():
+        admission = AdmissionController(max_sessions=1, max_per_user=5)
+        await admission.acquire("holder")
+        served = []
+
+        async def request(user_id):
+            await admission.acquire(user_id)
+            served.append(user_id)
+
+        # alice asks for three sessions before bob and carol ask for one each
+        tasks = [asyncio.create_task(request("alice")) for _ in range(3)]
+        await settle()
+        tasks += [asyncio.create_task(request(user)) for user in ("bob", "carol")]
+        await settle()
+
+        owner = "holder"
+        while tasks:
+            admission.release(owner)
+            await settle()
+            done = [task for task in tasks if task.done()]
+            assert len(done) == 1
+            tasks.remove(done[0])
+            owner = served[-1]
+        assert served == ["alice", "bob", "carol", "alice", "alice"]
+
+    asyncio.run(run())
+
+
+def test_idle_sessions_do_not_count_against_the_user():
+    async def run():
+        admission = AdmissionController(max_sessions=10, max_per_user=1)
+        await admission.acquire("alice")
+        waiting = asyncio.create_task(admission.acquire("alice"))
+        await settle()
+        assert not waiting.done()
+
+        # The first session is paused or its client left
+        admission.mark_idle("alice", True)
+        await asyncio.wait_for(waiting, 1)
+        assert admission.snapshot()["active"] == 2
+        assert admission.snapshot()["idle"] == 1
+
+        # Resuming the idle session goes over the limit rather than waiting,
+        # and new sessions queue until it is idle or gone again
+        admission.mark_idle("alice", False)
+        third = asyncio.create_task(admission.acquire("alice"))
+        await settle()
+        assert not third.done()
+        admission.release("alice")
+        await settle()
+        assert not third.done()
+        admission.release("alice")
+        await asyncio.wait_for(third, 1)
+
+        admission.mark_idle("alice", True)
+        admission.release("alice", idle=True)
+        assert admission.snapshot()["active"] == 0
+        assert admission.snapshot()["idle"] == 0
+
+    asyncio.run(run())
+
+
+def test_idle_sessions_still_count_globally():
+    async def run():
+        admission = AdmissionController(max_sessions=1, max_per_user=1)
+        await admission.acquire("alice")
+        admission.mark_idle("alice", True)
+        waiting = asyncio.create_task(admission.acquire("bob"))
+        await settle()
+        assert not waiting.done()
+        admission.release("alice", idle=True)
+        await asyncio.wait_for(waiting, 1)
+
+    asyncio.run(run())
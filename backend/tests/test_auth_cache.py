@@ -0,0 +1,77 @@
+import asyncio
+import time
+import types
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.auth import create_access_token, get_current_user
+from app.core.auth_cache import AuthCache
+from app.db.database import AsyncSessionLocal
+from app.db.repository import UserRepository
+
+
+def _user(user_id):
+    return types.SimpleNamespace(
+        id=user_id,
+        username=None,
+        email=f"{user_id}@example.com",
+        name=None,
+        is_active=True,
+        created_at=None,
+    )
+
+
+def test_deactivated_user_is_rejected_despite_the_cache(db, project):
+    token = create_access_token({"sub": project.user_id})
+
+    async def current_user():
+        async with AsyncSessionLocal() as session:
+            return await get_current_user(token, session)
+
+    # Caches the token and the principal
+    assert asyncio.run(current_user()).id == project.user_id
+    assert asyncio.run(current_user()).is_active
+
+    UserRepository.update_user(db, project.user_id, is_active=False)
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(current_user())
+    assert rejected.value.status_code == 401
+
+
+def test_invalidation_drops_only_that_users_tokens():
+    cache = AuthCache()
+    cache.put_token("a1", "alice")
+    cache.put_token("a2", "alice")
+    cache.put_token("b1", "bob")
+    cache.put_user(_user("alice"), cache.generation)
+    cache.put_user(_user("bob"), cache.generation)
+
+    cache.invalidate_user("alice")
+    assert cache.get_token("a1") is None
+    assert cache.get_token("a2") is None
+    assert cache.get_user("alice") is None
+    assert cache.get_token("b1") == "bob"
+    assert cache.get_user("bob").id == "bob"
+
+
+def test_lookup_racing_an_invalidation_is_not_cached():
+    cache = AuthCache()
+    generation = cache.generation
+    # The row is loaded, then the user changes before it is cached
+    cache.invalidate_user("alice")
+    assert cache.put_user(_user("alice"), generation).id == "alice"
+    assert cache.get_user("alice") is None
+
+    cache.put_user(_user("alice"), cache.generation)
+    assert cache.get_user("alice").id == "alice"
+
+
+def test_tokens_are_not_cached_past_their_expiry():
+    cache = AuthCache(ttl=60)
+    cache.put_token("expired", "alice", expires_at=time.time() - 1)
+    assert cache.get_token("expired") is None
+    cache.put_token("expiring", "alice", expires_at=time.time() + 0.05)
+    assert cache.get_token("expiring") == "alice"
+    time.sleep(0.1)
+    assert cache.get_token("expiring") is None
@@ -0,0 +1,83 @@
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from app.db import models
+from app.db.repository import BatchRejected, FileRepository
+from app.schemas.projects import FileOperation
+
+
+def _state(db, project_id):
+    db.expire_all()
+    files = db.execute(
+        select(models.File.path, models.File.version)
+        .where(models.File.project_id == project_id)
+        .order_by(models.File.path)
+    ).all()
+    documents = db.scalar(
+        select(func.count())
+        .select_from(models.SearchDocument)
+        .where(models.SearchDocument.project_id == project_id)
+    )
+    return files, documents
+
+
+def test_failing_operation_rejects_the_whole_batch(db, project):
+    a = FileRepository.create_file(db, project.id, "a.txt", "a.txt", "a")
+    b = FileRepository.create_file(db, project.id, "b.txt", "b.txt", "b")
+    before = _state(db, project.id)
+
+    operations = [
+        FileOperation(op="create", name="c.txt", path="c.txt", content="c"),
+        FileOperation(op="update", id=a.id, content="a2"),
+        FileOperation(op="delete", id=b.id),
+        FileOperation(op="update", id=a.id, content="a3", base_version=7),
+    ]
+    with pytest.raises(BatchRejected) as rejected:
+        FileRepository.apply_batch(db, project.id, operations)
+    assert [r["status"] for r in rejected.value.results] == [424, 424, 424, 409]
+    assert rejected.value.status == 409
+    assert _state(db, project.id) == before
+
+
+def test_batch_reuses_paths_freed_earlier_in_it(db, project):
+    a = FileRepository.create_file(db, project.id, "a.txt", "a.txt", "a")
+    b = FileRepository.create_file(db, project.id, "b.txt", "b.txt", "b")
+    results = FileRepository.apply_batch(
+        db,
+        project.id,
+        [
+            FileOperation(op="delete", id=a.id),
+            FileOperation(op="rename", id=b.id, name="a.txt"),
+            FileOperation(op="create", name="b.txt", path="b.txt", content="new"),
+        ],
+    )
+    assert [r["status"] for r in results] == [204, 200, 201]
+    assert _state(db, project.id) == ([("a.txt", 1), ("b.txt", 1)], 2)
+    assert [r["path"] for r in FileRepository.search_files(db, project.id, "new")] == [
+        "b.txt"
+    ]
+
+
+def test_writes_are_rolled_back_when_a_later_statement_fails(db, project, monkeypatch):
+    a = FileRepository.create_file(db, project.id, "a.txt", "a.txt", "a")
+    b = FileRepository.create_file(db, project.id, "b.txt", "b.txt", "b")
+    before = _state(db, project.id)
+
+    # Another writer took a path between the checks and the writes
+    def conflict(*args):
+        raise IntegrityError("INSERT", {}, Exception("UNIQUE constraint failed"))
+
+    monkeypatch.setattr("app.db.search.index_files", conflict)
+    with pytest.raises(BatchRejected) as rejected:
+        FileRepository.apply_batch(
+            db,
+            project.id,
+            [
+                FileOperation(op="delete", id=a.id),
+                FileOperation(op="rename", id=b.id, name="z.txt"),
+                FileOperation(op="create", name="c.txt", path="c.txt", content="c"),
+            ],
+        )
+    assert rejected.value.status == 409
+    assert _state(db, project.id) == before
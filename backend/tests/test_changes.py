@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+from app.core.changes import SNAPSHOT, FileChangeFeed
+
+
+def test_events_reach_subscribers_of_every_worker():
+    async def run():
+        # Two workers' feeds over the same database
+        first, second = (
+            FileChangeFeed(poll_interval=0.05),
+            FileChangeFeed(poll_interval=0.05),
+        )
+        first.start()
+        second.start()
+        try:
+            start = first.position
+            subscriptions = [feed.subscribe("p1") for feed in (first, second)]
+            first.publish("p1", [{"type": "deleted", "id": "a", "path": "a"}])
+            second.publish("p2", [{"type": "deleted", "id": "x", "path": "x"}])
+            second.publish("p1", [{"type": "deleted", "id": "b", "path": "b"}])
+
+            received = []
+            for subscription in subscriptions:
+                events = []
+                while len(events) < 2:
+                    events += await subscription.get(2)
+                received.append(events)
+            # The same events, numbered the same, in both workers
+            assert received[0] == received[1]
+            assert sorted(event["id"] for event in received[0]) == ["a", "b"]
+            seqs = [event["seq"] for event in received[0]]
+            assert start < seqs[0] < seqs[1]
+
+            # A client resuming after the first event gets the second
+            assert await first.backlog("p1", seqs[0]) == received[0][1:]
+            assert await second.backlog("p1", seqs[1]) == []
+            assert await second.backlog("p1", seqs[1] + 100) is SNAPSHOT
+        finally:
+            first.stop()
+            second.stop()
+
+    asyncio.run(run())
+
+
+def test_pruned_backlog_is_a_snapshot():
+    async def run():
+        feed = FileChangeFeed(poll_interval=0.05, retention=0)
+        feed.start()
+        try:
+            subscription = feed.subscribe("p")
+            for path in ("a", "b", "c"):
+                feed.publish("p", [{"type": "deleted", "id": path, "path": path}])
+                (event,) = await subscription.get(2)
+            with feed.engine.begin() as connection:
+                feed._prune(connection, time.time())
+            # All but the newest are gone
+            assert await feed.backlog("p", event["seq"] - 2) is SNAPSHOT
+            assert await feed.backlog("p", event["seq"] - 1) == [event]
+        finally:
+            feed.stop()
+
+    asyncio.run(run())
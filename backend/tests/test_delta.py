@@ -0,0 +1,43 @@
+import pytest
+
+from app.db.repository import FileRepository, VersionConflict
+from app.utils.delta import InvalidDelta, apply_edits
+
+
+def test_edits_apply_in_order():
+    text = "hello world"
+    edits = [(0, 5, "goodbye"), (7, 7, ","), (14, 14, "!")]
+    assert apply_edits(text, edits) == "goodbye, world!"
+    assert apply_edits(text, []) == text
+    assert apply_edits("", [(0, 0, "new")]) == "new"
+
+
+def test_offsets_count_utf16_code_units():
+    # The emoji is two code units, as in a JavaScript string
+    text = "a😀b"
+    assert apply_edits(text, [(3, 4, "c")]) == "a😀c"
+    assert apply_edits(text, [(1, 3, "é")]) == "aéb"
+    with pytest.raises(InvalidDelta, match="splits a character"):
+        apply_edits(text, [(2, 3, "x")])
+
+
+def test_edits_outside_the_text_are_rejected():
+    for start, end in ((0, 4), (3, 2), (-1, 0)):
+        with pytest.raises(InvalidDelta, match="outside the text"):
+            apply_edits("abc", [(start, end, "")])
+
+
+def test_patch_applies_to_base_version_only(db, project):
+    file = FileRepository.create_file(db, project.id, "a.py", "a.py", "x = 1\n")
+    patched = FileRepository.patch_file_content(db, file.id, 1, [(4, 5, "2")])
+    assert patched.version == 2
+    assert FileRepository.get_file_content(patched) == "x = 2\n"
+
+    # An edit made against the old version would land in the wrong place
+    with pytest.raises(VersionConflict) as conflict:
+        FileRepository.patch_file_content(db, file.id, 1, [(0, 0, "y")])
+    assert conflict.value.version == 2
+    with pytest.raises(InvalidDelta):
+        FileRepository.patch_file_content(db, file.id, 2, [(0, 99, "")])
+    assert FileRepository.get_file_content(patched) == "x = 2\n"
+    assert FileRepository.patch_file_content(db, "missing", 1, []) is None
@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+from app.core.expiry import ExpiryScheduler
+
+
+def test_keys_expire_in_deadline_order():
+    async def run():
+        expired = []
+
+        async def on_expire(key):
+            expired.append(key)
+
+        scheduler = ExpiryScheduler(on_expire)
+        now = time.monotonic()
+        scheduler.touch("late", now + 0.15)
+        scheduler.touch("early", now + 0.05)
+        scheduler.touch("moved", now + 0.05)
+        scheduler.touch("cancelled", now + 0.05)
+        # Pushed back: its old heap entry must not expire it
+        scheduler.touch("moved", now + 0.25)
+        scheduler.cancel("cancelled")
+
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.1)
+        assert expired == ["early"]
+        assert scheduler.deadline("moved") == now + 0.25
+        await asyncio.sleep(0.25)
+        task.cancel()
+        assert expired == ["early", "late", "moved"]
+        assert scheduler.snapshot()["scheduled"] == 0
+        assert scheduler.snapshot()["heap_size"] == 0
+        assert scheduler.stats == {"expired": 3, "errors": 0}
+
+    asyncio.run(run())
+
+
+def test_an_earlier_deadline_wakes_the_scheduler():
+    async def run():
+        expired = asyncio.Event()
+
+        async def on_expire(key):
+            expired.set()
+
+        scheduler = ExpiryScheduler(on_expire)
+        scheduler.touch("k", time.monotonic() + 60)
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.01)
+        # The scheduler is asleep until the first deadline, a minute away
+        scheduler.touch("k", time.monotonic())
+        await asyncio.wait_for(expired.wait(), 1)
+        task.cancel()
+
+    asyncio.run(run())
+
+
+def test_errors_do_not_stop_the_scheduler():
+    async def run():
+        expired = []
+
+        async def on_expire(key):
+            if key == "bad":
+                raise RuntimeError("container is gone")
+            expired.append(key)
+
+        scheduler = ExpiryScheduler(on_expire)
+        scheduler.touch("bad", time.monotonic())
+        scheduler.touch("good", time.monotonic() + 0.05)
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.15)
+        task.cancel()
+        assert expired == ["good"]
+        assert scheduler.stats == {"expired": 1, "errors": 1}
+
+    asyncio.run(run())
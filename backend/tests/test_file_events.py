@@ -0,0 +1,77 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+from app.db.database import async_engine
+from app.routes import files
+
+app = FastAPI()
+app.include_router(files.router, prefix="/api")
+
+
+async def open_stream(path: str):
+    """Start a GET of path on the app; returns once the response has begun.
+
+    Returns a coroutine function that disconnects the client.
+    """
+    started = asyncio.get_running_loop().create_future()
+    disconnected = asyncio.Event()
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and not started.done():
+            started.set_result(message["body"])
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+    task = asyncio.create_task(app(scope, receive, send))
+    assert b"event: ready" in await asyncio.wait_for(started, 5)
+
+    async def close():
+        disconnected.set()
+        await asyncio.wait_for(task, 5)
+
+    return close
+
+
+def test_open_streams_hold_no_database_connections(project):
+    pool = async_engine.sync_engine.pool
+    streams = pool.size() + pool._max_overflow
+
+    async def run():
+        path = f"/api/projects/{project.id}/files/events"
+        closers = await asyncio.gather(*(open_stream(path) for _ in range(streams)))
+        try:
+            assert pool.checkedout() == 0
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://t") as c:
+                response = await asyncio.wait_for(
+                    c.get(f"/api/projects/{project.id}/files/metadata"), 5
+                )
+            assert response.status_code == 200
+        finally:
+            await asyncio.gather(*(close() for close in closers))
+            await async_engine.dispose()
+
+    asyncio.run(run())
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import tempfile
+import types
+
+import pytest
+
+from app.core.hosts import DockerHost, HostPool, NoHostAvailable
+from app.core.registry import LocalRegistry, SQLiteRegistry
+
+
+class Endpoint:
+    """Stands in for a docker-py client."""
+
+    def __init__(self, url):
+        self.url = url
+        self.up = True
+
+    def ping(self):
+        if not self.up:
+            raise ConnectionError(f"{self.url} is down")
+
+
+def _pool(*capacities, **options):
+    endpoints = {}
+
+    def connect(url):
+        return endpoints.setdefault(url, Endpoint(url))
+
+    hosts = [
+        DockerHost(f"h{i}", f"tcp://h{i}", capacity, client_factory=connect)
+        for i, capacity in enumerate(capacities)
+    ]
+    return HostPool(hosts, **options), endpoints
+
+
+def test_new_sessions_go_to_the_least_loaded_host():
+    pool, _ = _pool(10, 40)
+    # h0 is 50% full, h1 25%
+    assert pool.place("u:a", {"h0": 5, "h1": 10}).name == "h1"
+    assert pool.place("u:b", {"h0": 2, "h1": 10}).name == "h0"
+    with pytest.raises(NoHostAvailable):
+        pool.place("u:c", {"h0": 10, "h1": 40})
+    assert pool.stats == {"placed": 2, "sticky": 0, "rejected": 1}
+
+
+def test_project_returns_to_its_host_while_it_has_room():
+    pool, _ = _pool(10, 10, sticky_size=2)
+    assert pool.place("u:a", {"h0": 1}).name == "h1"
+    # h1 is now the busier host, but u:a stays on it
+    assert pool.place("u:a", {"h1": 5}).name == "h1"
+    assert pool.stats["sticky"] == 1
+    # ...until it is full
+    assert pool.place("u:a", {"h1": 10}).name == "h0"
+
+    # Only the sticky_size most recent projects are remembered
+    pool.place("u:b", {})
+    pool.place("u:c", {})
+    assert pool.place("u:a", {"h0": 5}).name == "h1"
+
+
+def test_draining_hosts_get_no_new_sessions():
+    pool, _ = _pool(10, 10)
+    pool.place("u:a", {"h1": 5})
+    assert pool.place("u:a", {"h1": 5}, draining={"h0"}).name == "h1"
+    with pytest.raises(NoHostAvailable):
+        pool.place("u:b", {}, draining={"h0", "h1"})
+
+    pool.host("h1").draining = True
+    assert pool.place("u:b", {}).name == "h0"
+    snapshot = pool.snapshot({}, draining={"h0"})["hosts"]
+    assert snapshot["h0"]["draining"] and snapshot["h1"]["draining"]
+
+
+def test_runtime_drain_is_shared_through_the_registry():
+    path = os.path.join(tempfile.mkdtemp(prefix="registry-"), "sessions.db")
+    for registry, other in (
+        (SQLiteRegistry(path), SQLiteRegistry(path)),
+        (LocalRegistry(),) * 2,
+    ):
+        registry.set_draining("h0", True)
+        assert other.draining_hosts() == {"h0"}
+        pool, _ = _pool(10, 10)
+        assert pool.place("u:a", {}, other.draining_hosts()).name == "h1"
+        registry.set_draining("h0", False)
+        assert other.draining_hosts() == set()
+
+
+def test_unhealthy_hosts_are_skipped_until_they_answer():
+    pool, endpoints = _pool(10, 10)
+    executor = types.SimpleNamespace(run=lambda op, fn: asyncio.to_thread(fn))
+
+    async def check():
+        task = asyncio.create_task(pool.run_health_checks(executor, 60))
+        while any(host.last_check is None for host in pool.hosts.values()):
+            await asyncio.sleep(0.01)
+        task.cancel()
+        for host in pool.hosts.values():
+            host.last_check = None
+
+    # Connect, so that the endpoints exist
+    pool.host("h0").client
+    pool.host("h1").client
+    endpoints["tcp://h1"].up = False
+    asyncio.run(check())
+    assert not pool.host("h1").healthy
+    assert pool.host("h1").error == "tcp://h1 is down"
+    assert pool.place("u:a", {"h0": 9}).name == "h0"
+
+    endpoints["tcp://h1"].up = True
+    asyncio.run(check())
+    assert pool.host("h1").healthy
+    assert pool.place("u:b", {"h0": 9}).name == "h1"
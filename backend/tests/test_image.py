@@ -0,0 +1,31 @@
+import types
+
+import docker
+
+from app.core.config import RUNTIME_DIR
+from app.core.image import RuntimeImage
+
+
+def test_failed_build_is_retried_with_backoff():
+    builds = []
+
+    def get(tag):
+        raise docker.errors.ImageNotFound(tag)
+
+    def build(**options):
+        builds.append(options["tag"])
+        if len(builds) < 3:
+            raise docker.errors.BuildError("pip failed", [])
+
+    client = types.SimpleNamespace(images=types.SimpleNamespace(get=get, build=build))
+    image = RuntimeImage(client, RUNTIME_DIR, "runtime", "python:3.11")
+
+    delays = []
+    while not image.ensure():
+        assert image.error
+        delays.append(image.retry_delay(60, 100))
+    assert delays == [60, 100]
+    assert len(builds) == 3
+    assert image.snapshot() == dict(
+        tag=image.tag, ready=True, built=True, error=None, failures=0
+    )
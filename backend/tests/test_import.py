@@ -0,0 +1,35 @@
+import pytest
+
+from app.core.blobs import blob_store
+from app.db import repository
+from app.db.repository import FileRepository, ImportIncomplete
+
+
+def test_failed_batch_reports_the_entries_applied(db, project, monkeypatch):
+    entries = []
+    for name in ("a.txt", "b.txt", "c.txt"):
+        content_hash, size = blob_store.put(name.encode())
+        entries.append((name, False, content_hash, size))
+
+    stage = repository._stage_import
+    calls = []
+
+    def failing_stage(db, project_id, batch):
+        calls.append(batch)
+        if len(calls) == 2:
+            raise RuntimeError("disk full")
+        return stage(db, project_id, batch)
+
+    monkeypatch.setattr(repository, "_stage_import", failing_stage)
+    with pytest.raises(ImportIncomplete) as raised:
+        FileRepository.import_files(db, project.id, entries, batch_size=2)
+
+    assert raised.value.applied == 2
+    assert raised.value.counts == {
+        "created": 2,
+        "updated": 0,
+        "unchanged": 0,
+        "skipped": 0,
+    }
+    paths = sorted(f.path for f in FileRepository.get_project_files(db, project.id))
+    assert paths == ["a.txt", "b.txt"]
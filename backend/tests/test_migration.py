@@ -0,0 +1,38 @@
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+
+from app.utils.migration import run_migrations
+
+
+def test_parallel_upgrades_rename_duplicate_paths():
+    path = os.path.join(tempfile.mkdtemp(prefix="migration-"), "test.db")
+    url = f"sqlite:///{path}"
+    run_migrations(url, "0001")
+    db = sqlite3.connect(path)
+    db.execute("INSERT INTO users (id, email, password_hash) VALUES ('u', 'e', '')")
+    db.execute("INSERT INTO projects (id, name, user_id) VALUES ('p', 'P', 'u')")
+    for file_id, updated_at in (("f1", "2024-01-01"), ("f2", "2024-02-01")):
+        db.execute(
+            "INSERT INTO files (id, name, path, project_id, updated_at) "
+            "VALUES (?, 'a.py', 'src/a.py', 'p', ?)",
+            (file_id, updated_at),
+        )
+    db.commit()
+
+    # As every uvicorn worker does at startup
+    workers = [
+        multiprocessing.get_context("fork").Process(target=run_migrations, args=(url,))
+        for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0] * 4
+
+    assert db.execute("SELECT id, name, path FROM files ORDER BY id").fetchall() == [
+        ("f1", "a.py~f1", "src/a.py~f1"),
+        ("f2", "a.py", "src/a.py"),
+    ]
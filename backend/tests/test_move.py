@@ -0,0 +1,55 @@
+from sqlalchemy import select
+
+from app.db import models
+from app.db.repository import FileRepository
+
+
+def _paths(db, project_id):
+    db.expire_all()
+    return sorted(
+        db.scalars(select(models.File.path).where(models.File.project_id == project_id))
+    )
+
+
+def test_move_takes_exactly_the_directory_and_its_descendants(db, project, monkeypatch):
+    # Neighbours that share the prefix but sort around the [src/, src0) range
+    for path in ("src/a.py", "src/sub/b.py", "src.txt", "src-x/c.py", "src0", "srcs"):
+        FileRepository.create_file(db, project.id, path.rsplit("/")[-1], path, "x")
+    FileRepository.create_file(db, project.id, "src", "src", is_directory=True)
+    published = []
+    monkeypatch.setattr(
+        "app.db.repository.file_changes.publish",
+        lambda project_id, events: published.extend(events),
+    )
+
+    assert FileRepository.move_path(db, project.id, "src", "lib/src") == 3
+    assert _paths(db, project.id) == [
+        "lib/src",
+        "lib/src/a.py",
+        "lib/src/sub/b.py",
+        "src-x/c.py",
+        "src.txt",
+        "src0",
+        "srcs",
+    ]
+    moves = sorted((e["old_path"], e["file"]["path"]) for e in published)
+    assert moves == [
+        ("src", "lib/src"),
+        ("src/a.py", "lib/src/a.py"),
+        ("src/sub/b.py", "lib/src/sub/b.py"),
+    ]
+
+
+def test_directories_need_no_row_of_their_own(db, project):
+    FileRepository.create_file(db, project.id, "a.py", "pkg/a.py", "x")
+    assert FileRepository.move_path(db, project.id, "pkg", "lib") == 1
+    assert _paths(db, project.id) == ["lib/a.py"]
+    assert FileRepository.move_path(db, project.id, "pkg", "lib") == 0
+
+
+def test_move_onto_a_taken_path_changes_nothing(db, project):
+    FileRepository.create_file(db, project.id, "a.py", "old/a.py", "x")
+    FileRepository.create_file(db, project.id, "b.py", "old/b.py", "x")
+    FileRepository.create_file(db, project.id, "b.py", "new/b.py", "x")
+    assert FileRepository.move_path(db, project.id, "old", "new") is None
+    assert _paths(db, project.id) == ["new/b.py", "old/a.py", "old/b.py"]
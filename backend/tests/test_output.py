@@ -0,0 +1,75 @@
+import asyncio
+
+from app.core.output import OutputWriter
+from app.core.scrollback import Scrollback
+
+
+class Socket:
+    def __init__(self):
+        self.frames = []
+
+    async def send_bytes(self, data):
+        self.frames.append(data)
+
+    async def send_text(self, text):
+        self.frames.append(text)
+
+
+def test_bursts_are_coalesced_and_echo_is_immediate():
+    async def run():
+        socket = Socket()
+        writer = OutputWriter(socket, window=0.05)
+        # After a quiet period the first chunk goes out at once
+        await writer.write(b"$ ")
+        assert socket.frames == [b"$ "]
+
+        # The rest of a burst waits for the window to end
+        for line in (b"one\n", b"two\n", b"three\n"):
+            await writer.write(line)
+        assert socket.frames == [b"$ "]
+        await asyncio.sleep(0.1)
+        assert socket.frames == [b"$ ", b"one\ntwo\nthree\n"]
+
+    asyncio.run(run())
+
+
+def test_full_frames_are_sent_at_once():
+    async def run():
+        socket = Socket()
+        writer = OutputWriter(socket, window=60, max_bytes=8)
+        await writer.write(b"a")
+        await writer.write(b"bcdefgh")
+        await writer.write(b"ijklmnop")
+        await writer.write(b"q")
+        assert socket.frames == [b"a", b"bcdefghijklmnop"]
+        await writer.close()
+        assert socket.frames[-1] == b"q"
+
+    asyncio.run(run())
+
+
+def test_text_frames_keep_split_characters_whole():
+    async def run():
+        socket = Socket()
+        writer = OutputWriter(socket, binary=False, window=0)
+        euro = "€".encode()
+        await writer.write(b"price: " + euro[:1])
+        await writer.write(euro[1:])
+        await writer.close()
+        assert "".join(socket.frames) == "price: €"
+        assert all(isinstance(frame, str) for frame in socket.frames)
+
+    asyncio.run(run())
+
+
+def test_output_is_recorded_but_replays_are_not():
+    async def run():
+        socket = Socket()
+        scrollback = Scrollback(64)
+        writer = OutputWriter(socket, scrollback, window=0)
+        writer.replay(b"missed ")
+        await writer.write(b"new")
+        assert socket.frames == [b"missed new"]
+        assert scrollback.read_from(0) == (0, b"new")
+
+    asyncio.run(run())
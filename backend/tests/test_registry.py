@@ -0,0 +1,53 @@
+import concurrent.futures
+import os
+import tempfile
+import time
+
+from app.core.registry import LocalRegistry, SQLiteRegistry
+
+
+def _registry(**leases):
+    path = os.path.join(tempfile.mkdtemp(prefix="registry-"), "sessions.db")
+    return SQLiteRegistry(path, **leases)
+
+
+def test_abandoned_pause_expires():
+    for registry in (_registry(pause_lease=0.1), LocalRegistry(pause_lease=0.1)):
+        registry.claim("k", "w1", 10)
+        registry.publish("k", "c1")
+        assert registry.transition("k", "c1", "active", "pausing")
+        assert registry.lookup("k")["state"] == "pausing"
+
+        time.sleep(0.15)
+        # The container may or may not have been frozen; resuming unpauses it
+        assert registry.lookup("k")["state"] == "paused"
+        assert registry.transition("k", "c1", "paused", "active")
+
+
+def test_connections_of_dead_workers_expire():
+    registry = _registry(worker_lease=0.2)
+    registry.claim("k", "w1", 10)
+    registry.publish("k", "c1")
+    registry.add_connections("k", 2, "w1")
+    registry.add_connections("k", 1, "w2")
+    assert registry.lookup("k")["connections"] == 3
+
+    time.sleep(0.25)
+    registry.heartbeat("w2")
+    assert registry.lookup("k")["connections"] == 1
+    registry.add_connections("k", -1, "w2")
+    assert registry.lookup("k")["connections"] == 0
+
+
+def test_assign_never_fills_a_host_past_capacity():
+    for registry in (_registry(), LocalRegistry()):
+        keys = [f"k{i}" for i in range(8)]
+        for key in keys:
+            registry.claim(key, "w1", 10)
+        # A burst of placements that all saw the host empty
+        with concurrent.futures.ThreadPoolExecutor(8) as pool:
+            assigned = list(pool.map(lambda key: registry.assign(key, "h1", 3), keys))
+        assert assigned.count(True) == 3
+        assert registry.host_loads() == {"h1": 3}
+        # Assigning a key again does not count it twice
+        assert registry.assign(keys[assigned.index(True)], "h1", 3)
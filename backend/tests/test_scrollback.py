@@ -0,0 +1,49 @@
+import random
+
+from app.core.scrollback import Scrollback, ScrollbackBudget
+
+
+def test_ring_keeps_the_most_recent_output():
+    rng = random.Random(7)
+    for capacity in (1, 5, 64):
+        scrollback = Scrollback(capacity)
+        output = b""
+        for _ in range(200):
+            # Writes smaller than, equal to and larger than the buffer
+            data = bytes(rng.randrange(256) for _ in range(rng.randrange(capacity * 2)))
+            scrollback.append(data)
+            output += data
+            assert scrollback.end == len(output)
+            assert scrollback.start == max(0, len(output) - capacity)
+            offset = rng.randrange(len(output) + 1)
+            assert scrollback.read_from(offset) == (
+                max(offset, scrollback.start),
+                output[max(offset, scrollback.start) :],
+            )
+
+
+def test_resume_offsets_are_clamped_to_what_is_held():
+    scrollback = Scrollback(4)
+    scrollback.append(b"abcdef")
+    # Output the client never saw is gone; it resumes at the oldest byte held
+    assert scrollback.read_from(0) == (2, b"cdef")
+    assert scrollback.read_from(5) == (5, b"f")
+    # Nothing missed, including an offset from the future
+    assert scrollback.read_from(6) == (6, b"")
+    assert scrollback.read_from(99) == (6, b"")
+
+
+def test_zero_capacity_only_counts_offsets():
+    scrollback = Scrollback(0)
+    scrollback.append(b"abc")
+    assert scrollback.end == 3
+    assert scrollback.read_from(0) == (3, b"")
+
+
+def test_budget_limits_reservations():
+    budget = ScrollbackBudget(10)
+    assert budget.reserve(6) == 6
+    assert budget.reserve(6) == 4
+    assert budget.reserve(1) == 0
+    budget.release(6)
+    assert budget.snapshot() == {"total": 10, "used": 4}
@@ -0,0 +1,117 @@
+import asyncio
+import concurrent.futures
+import re
+import time
+import uuid
+
+import pytest
+from sqlalchemy import select
+
+from app.db import models, search
+from app.db.database import AsyncSessionLocal, SessionLocal
+from app.db.repository import AsyncFileRepository, FileRepository
+
+
+def test_non_ascii_terms_match_in_any_case(db, project):
+    """Bodies are folded like the terms, beyond ASCII."""
+    FileRepository.create_file(db, project.id, "de.txt", "de.txt", "Die Straße\nÄÖ\n")
+    FileRepository.create_file(db, project.id, "en.txt", "en.txt", "The street\n")
+
+    # "straße" folds to "strasse", which lower() would not find in the body;
+    # "äö" is too short for the index and is only checked in the candidates
+    for query in ("straße", "STRAßE äö", "Straße ÄÖ"):
+        results = FileRepository.search_files(db, project.id, query)
+        assert [result["path"] for result in results] == ["de.txt"], query
+        assert results[0]["score"] > 0
+    assert FileRepository.search_files(db, project.id, "straße öä") == []
+
+    async def search_async():
+        async with AsyncSessionLocal() as session:
+            return await AsyncFileRepository.search_files(
+                session, project.id, "raßE äÖ"
+            )
+
+    results = asyncio.run(search_async())
+    assert [result["path"] for result in results] == ["de.txt"]
+    assert [line["line"] for line in results[0]["lines"]] == [1, 2]
+
+
+def test_concurrent_writers_get_distinct_documents(db, project):
+    projects = [project.id]
+    for _ in range(3):
+        other = models.Project(
+            id=str(uuid.uuid4()), name="other", user_id=project.user_id
+        )
+        db.add(other)
+        projects.append(other.id)
+    db.commit()
+
+    def write(n):
+        session = SessionLocal()
+        try:
+            for i in range(10):
+                project_id = projects[(n + i) % len(projects)]
+                path = f"w{n}-{i}.txt"
+                FileRepository.create_file(
+                    session, project_id, path, path, f"needle {n} {i}\\n"
+                )
+        finally:
+            session.close()
+
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+        list(pool.map(write, range(8)))
+
+    for project_id in projects:
+        ids = db.scalars(
+            select(models.SearchDocument.id).where(
+                models.SearchDocument.project_id == project_id
+            )
+        ).all()
+        assert len(ids) == 20
+        # One partition per project
+        assert len({i >> search.PARTITION_BITS for i in ids}) == 1
+        results = FileRepository.search_files(db, project_id, "needle", limit=100)
+        assert len(results) == 20
+
+
+def test_files_are_found_by_path(db, project):
+    FileRepository.create_file(
+        db, project.id, "login_view.py", "src/login_view.py", "x"
+    )
+    FileRepository.create_file(db, project.id, "logo.png", "img/logo.png", "\0PNG")
+    FileRepository.create_file(db, project.id, "notes.txt", "notes.txt", "login soon")
+
+    def paths(query):
+        return sorted(
+            r["path"] for r in FileRepository.search_files(db, project.id, query)
+        )
+
+    assert paths("login") == ["notes.txt", "src/login_view.py"]
+    # Files without searchable text are found by path only
+    assert paths("logo") == ["img/logo.png"]
+    # One term in the path, the other in the body
+    assert paths("soon notes") == ["notes.txt"]
+    assert paths("soon view") == []
+
+    assert FileRepository.move_path(db, project.id, "src", "web") == 1
+    assert paths("web/") == ["web/login_view.py"]
+    assert paths("src/") == []
+
+
+def test_slow_regex_fails_the_search(db, project, monkeypatch):
+    FileRepository.create_file(
+        db, project.id, "a.txt", "a.txt", "needle\n" + "a" * 40 + "!\n"
+    )
+    results = FileRepository.search_files(db, project.id, "needle", re.compile("a+!"))
+    assert [line["line"] for line in results[0]["lines"]] == [2]
+
+    # Backtracks for far longer than anyone waits
+    monkeypatch.setattr("app.db.repository.SEARCH_REGEX_TIMEOUT", 0.5)
+    started = time.monotonic()
+    with pytest.raises(search.InvalidQuery):
+        FileRepository.search_files(db, project.id, "needle", re.compile("(a+)+$"))
+    assert time.monotonic() - started < 5
+
+    # The stuck worker was replaced
+    results = FileRepository.search_files(db, project.id, "needle", re.compile("^n"))
+    assert [line["line"] for line in results[0]["lines"]] == [1]
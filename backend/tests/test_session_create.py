@@ -0,0 +1,104 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.core import docker as sessions
+from app.core.admission import AdmissionController
+from app.core.executor import DockerExecutor, DockerTimeout
+
+
+@pytest.fixture
+def admission(monkeypatch):
+    admission = AdmissionController(max_sessions=5, max_per_user=5)
+    monkeypatch.setattr(sessions, "session_admission", admission)
+    monkeypatch.setattr(
+        sessions,
+        "docker_executor",
+        DockerExecutor(1, {"create": 2}, {"create": 0.05}),
+    )
+    return admission
+
+
+def _slow_create(monkeypatch, finish: threading.Event, fail=False):
+    """Make get_session block until finish is set, then return a new session."""
+    started = threading.Event()
+
+    def get_session(user_id, project_id):
+        started.set()
+        finish.wait(5)
+        if fail:
+            raise RuntimeError("create failed")
+        return {"key": f"{user_id}:{project_id}", "owner": True, "admitted": False}
+
+    monkeypatch.setattr(sessions, "get_session", get_session)
+    return started
+
+
+def _active(admission):
+    return admission.snapshot()["active"]
+
+
+def test_timed_out_create_keeps_its_slot_for_the_session(admission, monkeypatch):
+    finish = threading.Event()
+    _slow_create(monkeypatch, finish)
+    created = []
+    get_admitted_session = sessions.get_admitted_session
+    monkeypatch.setattr(
+        sessions,
+        "get_admitted_session",
+        lambda *args: created.append(get_admitted_session(*args)) or created[-1],
+    )
+
+    async def run():
+        with pytest.raises(DockerTimeout):
+            await sessions.get_session_async("alice", "p")
+        # The container is still being started; its slot stays taken
+        assert _active(admission) == 1
+        finish.set()
+        while not created:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert created[0]["admitted"]
+    assert _active(admission) == 1
+
+
+def test_timed_out_create_that_fails_releases_its_slot(admission, monkeypatch):
+    finish = threading.Event()
+    started = _slow_create(monkeypatch, finish, fail=True)
+
+    async def run():
+        with pytest.raises(DockerTimeout):
+            await sessions.get_session_async("alice", "p")
+        assert started.is_set()
+        assert _active(admission) == 1
+        finish.set()
+        while _active(admission):
+            await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+
+
+def test_create_abandoned_before_it_starts_releases_its_slot(admission, monkeypatch):
+    finish = threading.Event()
+    started = _slow_create(monkeypatch, finish)
+
+    async def run():
+        # Both creates time out; the second is still queued for the one thread
+        results = await asyncio.gather(
+            sessions.get_session_async("alice", "p"),
+            sessions.get_session_async("bob", "p"),
+            return_exceptions=True,
+        )
+        assert all(isinstance(r, DockerTimeout) for r in results)
+        assert admission.snapshot()["active"] == 1
+        started.clear()
+        finish.set()
+        while sessions.docker_executor.snapshot()["create"]["running"]:
+            await asyncio.sleep(0.01)
+        # bob's create did not go ahead; alice's session keeps her slot
+        assert not started.is_set()
+        assert _active(admission) == 1
+
+    asyncio.run(run())
@@ -0,0 +1,83 @@
+import asyncio
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from app.core import streaming
+from app.core.streaming import ExecOutput, pump
+
+
+class Executor:
+    async def run(self, op, fn, *args):
+        return fn(*args)
+
+
+def frame(stream: int, data: bytes):
+    return struct.pack(">BxxxL", stream, len(data)) + data
+
+
+def wait_for_readers(count: int):
+    deadline = time.monotonic() + 5
+    while streaming.stream_stats["readers"] != count:
+        assert time.monotonic() < deadline, "reader thread did not exit"
+        time.sleep(0.01)
+
+
+def test_exec_output_is_demultiplexed():
+    ours, theirs = socket.socketpair()
+    theirs.sendall(frame(1, b"out") + frame(2, b"err"))
+    theirs.close()
+    chunks = []
+
+    async def on_chunk(chunk):
+        chunks.append(chunk)
+
+    asyncio.run(pump(Executor(), "exec", lambda: ExecOutput(ours), on_chunk, 4))
+    assert chunks == [(b"out", None), (None, b"err")]
+    assert ours.fileno() == -1
+
+
+def test_failed_consumer_cancels_blocked_reader():
+    # The command printed once and then went quiet: the reader is blocked on
+    # the socket when on_chunk fails
+    ours, theirs = socket.socketpair()
+    theirs.sendall(frame(1, b"hello"))
+    readers = streaming.stream_stats["readers"]
+
+    async def on_chunk(chunk):
+        raise RuntimeError("client went away")
+
+    with pytest.raises(RuntimeError, match="client went away"):
+        asyncio.run(pump(Executor(), "exec", lambda: ExecOutput(ours), on_chunk, 4))
+    wait_for_readers(readers)
+    assert ours.fileno() == -1
+    theirs.close()
+
+
+def test_generator_is_never_closed_from_another_thread():
+    release = threading.Event()
+    closed = []
+
+    def chunks():
+        try:
+            yield b"first"
+            release.wait()
+            yield b"second"
+        finally:
+            closed.append(threading.current_thread().name)
+
+    readers = streaming.stream_stats["readers"]
+
+    async def on_chunk(chunk):
+        raise RuntimeError("client went away")
+
+    # A generator has no cancel(); the error must not turn into "generator
+    # already executing"
+    with pytest.raises(RuntimeError, match="client went away"):
+        asyncio.run(pump(Executor(), "exec", chunks, on_chunk, 4))
+    release.set()
+    wait_for_readers(readers)
+    assert closed == ["stream-reader"]
@@ -0,0 +1,52 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from app.core import inotify
+from app.core.blobs import blob_store
+from app.core.config import DATA_DIR
+from app.core.sync import WorkspaceSync
+from app.db import models
+
+pytestmark = pytest.mark.skipif(not inotify.available, reason="needs inotify")
+
+
+def test_watch_of_empty_workspace_keeps_rows(db, project):
+    """Files synced before but missing at startup are restored, not deleted."""
+    files = {"a.py": b"print('a')\n", "src/b.py": b"print('b')\n"}
+    for path, data in files.items():
+        content_hash, size = blob_store.put(data)
+        db.add(
+            models.File(
+                id=str(uuid.uuid4()),
+                name=os.path.basename(path),
+                path=path,
+                content_hash=content_hash,
+                size=size,
+                # As if written to a workspace that has since been emptied
+                synced_mtime_ns=1,
+                project_id=project.id,
+            )
+        )
+    db.commit()
+    sync = WorkspaceSync(DATA_DIR, debounce=0.05, max_delay=0.2)
+
+    async def watch_and_settle():
+        sync.start()
+        await sync.watch(project.user_id, project.id)
+        await asyncio.sleep(0.5)
+        await sync.stop()
+
+    asyncio.run(watch_and_settle())
+
+    root = sync.workspace_dir(project.user_id, project.id)
+    for path, data in files.items():
+        with open(os.path.join(root, path), "rb") as f:
+            assert f.read() == data
+    db.expire_all()
+    rows = db.query(models.File).filter(models.File.project_id == project.id).all()
+    assert sorted(row.path for row in rows) == sorted(files)
+    assert all(row.synced_mtime_ns != 1 for row in rows)
+    assert sync.stats["to_database"] == 0
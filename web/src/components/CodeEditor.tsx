@@ -21,11 +21,17 @@ export function CodeEditor() {
       {activeFile ? (
         <div className='flex h-full w-full flex-col'>
           <EditorHeader activeFile={activeFile} />
-          <MonacoEditorWrapper
-            content={activeFile.content}
-            language={getLanguageFromFileName(activeFile.name)}
-            onChange={handleEditorChange}
-          />
+          {activeFile.loaded === false ? (
+            <div className='flex flex-1 items-center justify-center text-sm text-muted-foreground'>
+              Loading {activeFile.name}...
+            </div>
+          ) : (
+            <MonacoEditorWrapper
+              content={activeFile.content}
+              language={getLanguageFromFileName(activeFile.name)}
+              onChange={handleEditorChange}
+            />
+          )}
         </div>
       ) : (
         <EmptyEditor />
@@ -12,11 +12,36 @@ export interface CodeFile {
   name: string
   language: string
   content: string
+  // False until the content has been fetched; listings carry metadata only
+  loaded?: boolean
 }
 
+// The file listing the store holds, with the ETag to revalidate it against
+interface FileListing {
+  projectId: string
+  etag: string
+}
+
+// File metadata as returned by listings and the change stream
+interface FileMetadata {
+  id: string
+  name: string
+  path: string
+  is_directory: boolean
+  size: number
+  version: number
+  updated_at: string | null
+}
+
+// One event of /api/projects/{id}/files/events
+type FileChange =
+  | { type: 'created' | 'modified' | 'renamed'; file: FileMetadata; old_path?: string; seq: number }
+  | { type: 'deleted'; id: string; path: string; seq: number }
+
 interface FileState {
   files: CodeFile[]
   activeFileId: string | null
+  listing: FileListing | null
   addFile: (file: Omit<CodeFile, 'id'>, projectId: string) => Promise<void>
   updateFileContent: (id: string, content: string) => Promise<void>
   renameFile: (id: string, newName: string) => Promise<void>
@@ -24,6 +49,8 @@ interface FileState {
   saveFile: (id: string) => Promise<void>
   setActiveFile: (id: string) => void
   fetchProjectFiles: (projectId: string) => Promise<void>
+  loadFileContent: (id: string) => Promise<void>
+  subscribeProjectFiles: (projectId: string) => () => void
 }
 
 // Default Python code for new file
@@ -42,6 +69,190 @@ for i in range(5):
     print(f"Count: {i}")
 `
 
+// Content and version the server last confirmed for each file. Edits are
+// sent as a delta against them instead of re-uploading the whole file.
+const synced = new Map<string, { content: string; version: number }>()
+// Files with a save in flight; edits made meanwhile are sent when it completes
+const saving = new Set<string>()
+
+// The single edit that turns `from` into `to`: the range between their common
+// prefix and suffix. Offsets are string indices (UTF-16 code units).
+function diffText(from: string, to: string) {
+  const max = Math.min(from.length, to.length)
+  let start = 0
+  while (start < max && from[start] === to[start]) start++
+  let end = 0
+  while (end < max - start && from[from.length - 1 - end] === to[to.length - 1 - end]) end++
+  return { start, end: from.length - end, text: to.slice(start, to.length - end) }
+}
+
+// Send a file's local content to the server, as a patch when its base is known
+async function syncFileContent(id: string) {
+  if (saving.has(id)) return
+  saving.add(id)
+  try {
+    for (;;) {
+      const file = useFileStore.getState().files.find(f => f.id === id)
+      const base = synced.get(id)
+      if (!file || file.loaded === false || base?.content === file.content) return
+
+      const content = file.content
+      let response: Response | null = null
+      if (base) {
+        response = await fetch(`${API_BASE_URL}/api/files/${id}/content`, {
+          method: 'PATCH',
+          headers: {
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify({ base_version: base.version, edits: [diffText(base.content, content)] }),
+        })
+      }
+      if (!response || response.status === 409) {
+        // No known base, or the file was changed elsewhere: save the whole text
+        response = await fetch(`${API_BASE_URL}/api/files/${id}/content`, {
+          method: 'PUT',
+          headers: {
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify({ content }),
+        })
+      }
+
+      if (!response.ok) {
+        console.error('Failed to update file content')
+        return
+      }
+      const savedFile = await response.json()
+      synced.set(id, { content, version: savedFile.version })
+    }
+  } catch (error) {
+    console.error('Error updating file content:', error)
+  } finally {
+    saving.delete(id)
+  }
+}
+
+function fileLanguage(name: string) {
+  return name.endsWith('.py')
+    ? 'python'
+    : name.endsWith('.js')
+      ? 'javascript'
+      : name.endsWith('.ts')
+        ? 'typescript'
+        : name.endsWith('.html')
+          ? 'html'
+          : name.endsWith('.css')
+            ? 'css'
+            : 'plaintext'
+}
+
+// A listed file; its content is fetched when it is opened
+function unloadedFile(apiFile: FileMetadata): CodeFile {
+  return { id: apiFile.id, name: apiFile.name, language: fileLanguage(apiFile.name), content: '', loaded: false }
+}
+
+// All pages of a project's file listing, or null if it still matches `listing`
+async function fetchFileListing(projectId: string, listing: FileListing | null) {
+  // The listing has no file contents. Revalidate the one we already hold
+  // for this project; a 304 means none of its files changed.
+  const url = `${API_BASE_URL}/api/projects/${projectId}/files/metadata`
+  const headers: Record<string, string> = {}
+  if (listing && listing.projectId === projectId) {
+    headers['If-None-Match'] = listing.etag
+  }
+
+  let response = await fetch(url, { headers })
+  if (response.status === 304) {
+    return null
+  }
+  if (!response.ok) {
+    throw new Error('Failed to fetch project files')
+  }
+  const etag = response.headers.get('ETag')
+
+  let page = await response.json()
+  const files: FileMetadata[] = [...page.files]
+  while (page.next_cursor) {
+    response = await fetch(`${url}?cursor=${encodeURIComponent(page.next_cursor)}`)
+    if (!response.ok) {
+      throw new Error('Failed to fetch project files')
+    }
+    page = await response.json()
+    files.push(...page.files)
+  }
+  return { files, listing: etag ? { projectId, etag } : null }
+}
+
+// Whether the server has a newer version of a file than the one we hold, and
+// we can take it without losing unsaved edits
+function isStale(file: CodeFile, version: number) {
+  if (file.loaded === false || saving.has(file.id)) return false
+  const base = synced.get(file.id)
+  return !!base && version > base.version && base.content === file.content
+}
+
+// Replace the file tree with `listed`, keeping the contents still current
+// and files that only exist locally so far
+function applyFileTree(listed: FileMetadata[]) {
+  const { files, activeFileId } = useFileStore.getState()
+  const held = new Map(files.map(file => [file.id, file]))
+  const listedIds = new Set(listed.map(apiFile => apiFile.id))
+  const local = files.filter(file => file.loaded !== false && !synced.has(file.id) && !listedIds.has(file.id))
+  const next = listed.map(apiFile => {
+    const file = held.get(apiFile.id)
+    if (!file || isStale(file, apiFile.version)) {
+      synced.delete(apiFile.id)
+      return unloadedFile(apiFile)
+    }
+    return { ...file, name: apiFile.name, language: fileLanguage(apiFile.name) }
+  })
+  next.push(...local)
+  const active = next.some(file => file.id === activeFileId) ? activeFileId : (next[0]?.id ?? null)
+  useFileStore.setState({ files: next, activeFileId: active })
+  if (active) {
+    useFileStore.getState().loadFileContent(active)
+  }
+}
+
+// Apply one event of the project's change stream
+function applyFileChange(change: FileChange) {
+  const { files, activeFileId } = useFileStore.getState()
+  if (change.type === 'deleted') {
+    synced.delete(change.id)
+    const remaining = files.filter(file => file.id !== change.id)
+    if (remaining.length === files.length) return
+    useFileStore.setState({
+      files: remaining,
+      activeFileId: activeFileId === change.id ? (remaining[0]?.id ?? null) : activeFileId,
+    })
+    return
+  }
+
+  const apiFile = change.file
+  const file = files.find(f => f.id === apiFile.id)
+  if (!file) {
+    useFileStore.setState({ files: [...files, unloadedFile(apiFile)] })
+    return
+  }
+  // Versions we saved ourselves are already in `synced` and are skipped here
+  const stale = isStale(file, apiFile.version)
+  if (stale) {
+    synced.delete(file.id)
+  }
+  useFileStore.setState({
+    files: files.map(f =>
+      f.id === file.id
+        ? stale
+          ? unloadedFile(apiFile)
+          : { ...f, name: apiFile.name, language: fileLanguage(apiFile.name) }
+        : f
+    ),
+  })
+  if (stale && file.id === activeFileId) {
+    useFileStore.getState().loadFileContent(file.id)
+  }
+}
+
 // Create file store
 export const useFileStore = create<FileState>((set, get) => ({
   files: [
@@ -53,6 +264,7 @@ export const useFileStore = create<FileState>((set, get) => ({
     },
   ],
   activeFileId: 'default-file',
+  listing: null,
 
   addFile: async (file, projectId) => {
     const newFileId = generateId()
@@ -81,6 +293,7 @@ export const useFileStore = create<FileState>((set, get) => ({
       }
 
       const savedFile = await response.json()
+      synced.set(savedFile.id, { content: file.content, version: savedFile.version })
       // Update local file with server ID
       set(state => ({
         files: state.files.map(f => (f.id === newFileId ? { ...f, id: savedFile.id } : f)),
@@ -97,26 +310,8 @@ export const useFileStore = create<FileState>((set, get) => ({
       files: state.files.map(file => (file.id === id ? { ...file, content } : file)),
     }))
 
-    // Get the active project and file
-    const file = get().files.find(f => f.id === id)
-    if (!file) return
-
-    try {
-      // Update in backend
-      const response = await fetch(`${API_BASE_URL}/api/files/${id}/content`, {
-        method: 'PUT',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ content }),
-      })
-
-      if (!response.ok) {
-        console.error('Failed to update file content')
-      }
-    } catch (error) {
-      console.error('Error updating file content:', error)
-    }
+    // Update in backend
+    await syncFileContent(id)
   },
 
   renameFile: async (id, newName) => {
@@ -178,55 +373,25 @@ export const useFileStore = create<FileState>((set, get) => ({
     const file = get().files.find(f => f.id === id)
     if (!file) return
 
-    try {
-      // Save file content to backend
-      const response = await fetch(`${API_BASE_URL}/api/files/${id}/content`, {
-        method: 'PUT',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ content: file.content }),
-      })
-
-      if (!response.ok) {
-        console.error('Failed to save file')
-      }
-
-      console.log(`File saved: ${file.name}`)
-    } catch (error) {
-      console.error('Error saving file:', error)
-    }
+    // Save file content to backend
+    await syncFileContent(id)
+    console.log(`File saved: ${file.name}`)
   },
 
-  setActiveFile: id => set({ activeFileId: id }),
+  setActiveFile: id => {
+    set({ activeFileId: id })
+    get().loadFileContent(id)
+  },
 
   fetchProjectFiles: async projectId => {
     try {
-      const response = await fetch(`${API_BASE_URL}/api/projects/${projectId}/files`)
-
-      if (!response.ok) {
-        throw new Error('Failed to fetch project files')
+      const result = await fetchFileListing(projectId, get().listing)
+      if (!result) {
+        return
       }
 
-      const projectFiles = await response.json()
-
       // Transform API response to match our CodeFile format
-      const files = projectFiles.map((apiFile: any) => ({
-        id: apiFile.id,
-        name: apiFile.name,
-        language: apiFile.name.endsWith('.py')
-          ? 'python'
-          : apiFile.name.endsWith('.js')
-            ? 'javascript'
-            : apiFile.name.endsWith('.ts')
-              ? 'typescript'
-              : apiFile.name.endsWith('.html')
-                ? 'html'
-                : apiFile.name.endsWith('.css')
-                  ? 'css'
-                  : 'plaintext',
-        content: apiFile.content || '',
-      }))
+      const files: CodeFile[] = result.files.map(unloadedFile)
 
       // If no files, provide a default one
       if (files.length === 0) {
@@ -238,10 +403,15 @@ export const useFileStore = create<FileState>((set, get) => ({
         })
       }
 
+      const activeFileId = files.length > 0 ? files[0].id : null
       set({
         files,
-        activeFileId: files.length > 0 ? files[0].id : null,
+        activeFileId,
+        listing: result.listing,
       })
+      if (activeFileId) {
+        await get().loadFileContent(activeFileId)
+      }
     } catch (error) {
       console.error('Error fetching project files:', error)
 
@@ -256,7 +426,55 @@ export const useFileStore = create<FileState>((set, get) => ({
           },
         ],
         activeFileId: 'default-file',
+        listing: null,
       })
     }
   },
+
+  loadFileContent: async id => {
+    const file = get().files.find(f => f.id === id)
+    if (!file || file.loaded !== false) return
+
+    try {
+      const response = await fetch(`${API_BASE_URL}/api/files/${id}`)
+
+      if (!response.ok) {
+        throw new Error('Failed to fetch file')
+      }
+
+      const apiFile = await response.json()
+      synced.set(id, { content: apiFile.content || '', version: apiFile.version })
+      set(state => ({
+        files: state.files.map(f => (f.id === id ? { ...f, content: apiFile.content || '', loaded: true } : f)),
+      }))
+    } catch (error) {
+      console.error('Error fetching file content:', error)
+    }
+  },
+
+  subscribeProjectFiles: projectId => {
+    // Changes made elsewhere (other tabs, the terminal) arrive as small
+    // events instead of the whole tree being listed again
+    const source = new EventSource(`${API_BASE_URL}/api/projects/${projectId}/files/events`)
+    source.addEventListener('ready', async () => {
+      // Sent on every (re)connect; catch up on changes missed while offline
+      try {
+        const result = await fetchFileListing(projectId, get().listing)
+        if (result) {
+          set({ listing: result.listing })
+          applyFileTree(result.files)
+        }
+      } catch (error) {
+        console.error('Error fetching project files:', error)
+      }
+    })
+    source.addEventListener('change', event => {
+      applyFileChange(JSON.parse((event as MessageEvent).data))
+    })
+    source.addEventListener('snapshot', event => {
+      // Sent instead of the changes when we fell too far behind
+      applyFileTree(JSON.parse((event as MessageEvent).data).files)
+    })
+    return () => source.close()
+  },
 }))
@@ -32,6 +32,10 @@ interface TerminalState {
   initialize: (projectId?: string) => void
 }
 
+// Where to resume the output stream after a dropped connection: the server
+// sends a resume token and the offset the following binary output starts at
+let resumeState: { projectId: string; token: string; offset: number } | null = null
+
 // Create terminal store
 export const useTerminalStore = create<TerminalState>((set, get) => ({
   terminalHistory: [],
@@ -116,7 +120,17 @@ export const useTerminalStore = create<TerminalState>((set, get) => ({
 
     // Create WebSocket connection with authentication token in query param
     const token = useAuthStore.getState().token
-    const ws = new WebSocket(`${wsBaseUrl}/ws/${user.id}/${projectId}?token=${token}`)
+    const resumeParams =
+      resumeState && resumeState.projectId === projectId
+        ? `&resume=${resumeState.token}&offset=${resumeState.offset}`
+        : ''
+    const ws = new WebSocket(
+      `${wsBaseUrl}/ws/${user.id}/${projectId}?token=${token}${resumeParams}`
+    )
+    // Terminal output arrives as binary frames; decode them as a stream so
+    // characters split across frames are kept intact
+    ws.binaryType = 'arraybuffer'
+    const decoder = new TextDecoder()
 
     set({ webSocket: ws })
 
@@ -179,8 +193,35 @@ export const useTerminalStore = create<TerminalState>((set, get) => ({
         set({ isLoading: false })
       }
 
+      if (typeof event.data === 'string' && event.data.startsWith('{')) {
+        try {
+          const message = JSON.parse(event.data)
+          if (message.type === 'session') {
+            resumeState = { projectId, token: message.resume_token, offset: message.offset }
+            return
+          }
+          if (message.type === 'queue') {
+            addTerminalOutput({
+              content: `Waiting for a free container (position ${message.position} in queue)...\n`,
+              type: 'output',
+            })
+            return
+          }
+        } catch {
+          // Not a control message; show it as output
+        }
+      }
+
+      if (typeof event.data !== 'string' && resumeState) {
+        resumeState.offset += event.data.byteLength
+      }
+
+      const content =
+        typeof event.data === 'string' ? event.data : decoder.decode(event.data, { stream: true })
+      if (!content) return
+
       addTerminalOutput({
-        content: event.data,
+        content,
         type: 'output',
       })
     }
@@ -17,7 +17,7 @@ export function ProjectDetail() {
   const { projectId } = useParams<{ projectId: string }>()
   const { isAuthenticated } = useAuthStore()
   const { getProject, updateProject } = useProjectsStore()
-  const { files, activeFileId, fetchProjectFiles } = useFileStore()
+  const { files, activeFileId, fetchProjectFiles, subscribeProjectFiles } = useFileStore()
   const { toast } = useToast()
   const navigate = useNavigate()
   const [maxRuntime, setMaxRuntime] = useState<number>(10)
@@ -63,6 +63,12 @@ export function ProjectDetail() {
     }
   }, [projectId, isAuthenticated, navigate, getProject, fetchProjectFiles, toast])
 
+  // Keep the file tree in step with changes made elsewhere, e.g. in the terminal
+  useEffect(() => {
+    if (!projectId || !isAuthenticated) return
+    return subscribeProjectFiles(projectId)
+  }, [projectId, isAuthenticated, subscribeProjectFiles])
+
   const handleGoBack = () => {
     navigate('/dashboard')
   }